@@ -0,0 +1,212 @@
+"""
+Compare storing a reference output in outputpath and in S3 storage
+
+The S3 storage uploads to a local stand-in of S3 (:class:`FakeS3`), which
+keeps the objects in a temporary directory and answers the requests used
+by :class:`pywps.inout.s3storage.S3Storage`: PUT object, multipart upload
+and GET object. Signatures are not checked. Every request is delayed by
+given latency, to show the effect of parallel part uploads.
+
+Run from the repository root::
+
+    python benchmarks/s3_storage.py [size_mb] [latency_ms]
+
+The stand-in can be used by other scripts too::
+
+    server = FakeS3(latency=0.02)
+    server.start()
+    # s3->endpoint = server.endpoint
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pywps import configuration, httpclient, Format
+from pywps._compat import PY2, urlparse
+from pywps.inout.outputs import ComplexOutput
+from pywps.inout.storage import FileStorage
+from pywps.inout.s3storage import S3Storage
+
+if PY2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+else:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class FakeS3(ThreadingMixIn, HTTPServer):
+    """Local S3 stand-in, path style addressing, any bucket exists
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _FakeS3Handler)
+        self.latency = latency
+        self.root = tempfile.mkdtemp(prefix='fake-s3-')
+        self.uploads = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:%i' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-s3')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        # close the kept-alive connections, so the handlers finish
+        httpclient.clear()
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.root)
+
+    def get_file(self, path):
+        return os.path.join(self.root, hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+
+class _FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        (path, query) = self._begin()
+        if 'partNumber' in query:
+            target = '%s.%s' % (self.server.get_file(query['uploadId']), query['partNumber'])
+        else:
+            target = self.server.get_file(path)
+
+        digest = hashlib.md5()
+        remaining = int(self.headers.get('Content-Length'))
+        with open(target, 'wb') as f:
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+
+        self._send(200, headers={'ETag': '"%s"' % digest.hexdigest()})
+
+    def do_POST(self):
+        (path, query) = self._begin()
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = path
+            self._send(200, '<InitiateMultipartUploadResult><UploadId>%s</UploadId>'
+                            '</InitiateMultipartUploadResult>' % upload_id)
+            return
+
+        upload_id = query['uploadId']
+        numbers = [int(number) for number in re.findall(b'<PartNumber>(\\d+)</PartNumber>', body)]
+        with open(self.server.get_file(path), 'wb') as target:
+            for number in numbers:
+                part = '%s.%i' % (self.server.get_file(upload_id), number)
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, target)
+                os.remove(part)
+        self._send(200, '<CompleteMultipartUploadResult><Key>%s</Key>'
+                        '</CompleteMultipartUploadResult>' % path)
+
+    def do_DELETE(self):
+        (path, query) = self._begin()
+        self.server.uploads.pop(query.get('uploadId'), None)
+        self._send(204)
+
+    def do_GET(self):
+        (path, query) = self._begin()
+        file_name = self.server.get_file(path)
+        if not os.path.isfile(file_name):
+            self._send(404, '<Error><Code>NoSuchKey</Code></Error>')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(file_name)))
+        self.end_headers()
+        with open(file_name, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def _begin(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        parsed = urlparse(self.path)
+        query = dict(item.partition('=')[::2] for item in parsed.query.split('&') if item)
+        return (parsed.path, query)
+
+    def _send(self, code, body='', headers=None):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _measure(storage, output):
+    start = time.time()
+    (_, _, url) = storage.store(output)
+    return (time.time() - start, url)
+
+
+def main(size_mb=64, latency_ms=20):
+    server = FakeS3(latency=latency_ms / 1000.0)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='pywps-benchmark-')
+    outputpath = tempfile.mkdtemp(prefix='pywps-outputs-')
+
+    configuration.load_configuration([])
+    configuration.config.set('server', 'outputpath', outputpath)
+    configuration.config.set('s3', 'endpoint', server.endpoint)
+    configuration.config.set('s3', 'bucket', 'outputs')
+    configuration.config.set('s3', 'access_key', 'benchmark')
+    configuration.config.set('s3', 'secret_key', 'benchmark')
+
+    file_name = os.path.join(workdir, 'output.bin')
+    with open(file_name, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    output = ComplexOutput('output', 'Output', supported_formats=[Format('application/octet-stream')])
+    output.workdir = workdir
+    output.file = file_name
+
+    try:
+        print('%-24s %10s' % ('storage', 'time [s]'))
+        for mode in ('copy', 'link'):
+            configuration.config.set('server', 'storage_mode', mode)
+            print('%-24s %10.3f' % ('file (%s)' % mode, _measure(FileStorage(), output)[0]))
+
+        for threads in (1, 4, 8):
+            configuration.config.set('s3', 'upload_threads', str(threads))
+            (elapsed, url) = _measure(S3Storage(), output)
+            print('%-24s %10.3f' % ('s3 (%i threads)' % threads, elapsed))
+
+        with open(server.get_file(urlparse(url).path), 'rb') as stored:
+            with open(file_name, 'rb') as original:
+                assert stored.read() == original.read(), 'uploaded object differs'
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+        shutil.rmtree(outputpath)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,68 @@
+"""
+Compare requests/sec of the ``wps`` controller before and after the shared
+Service registry
+
+Before: all processes and a new Service are created for every request.
+After: the Service is taken from :mod:`tethysapp.pywps4.registry`.
+
+Run from the repository root::
+
+    python benchmarks/service_registry.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from pywps.app.Service import Service
+from pywps.app.WPSRequest import WPSRequest
+from tethysapp.pywps4 import registry
+
+REQUESTS = {
+    'GetCapabilities': 'service=wps&request=GetCapabilities',
+    'DescribeProcess': 'service=wps&request=DescribeProcess&version=1.0.0&identifier=all'
+}
+
+
+def _new_service():
+    processes = []
+    for (module_name, class_name) in registry.PROCESSES:
+        module = __import__(module_name, fromlist=[class_name])
+        processes.append(getattr(module, class_name)())
+    return Service(processes=processes)
+
+
+def _dispatch(service, query_string):
+    http_request = Request(EnvironBuilder(query_string=query_string).get_environ())
+    wps_request = WPSRequest(http_request)
+    if wps_request.operation == 'getcapabilities':
+        response = service.get_capabilities()
+    else:
+        response = service.describe(wps_request.identifiers)
+    return response.get_data()
+
+
+def _measure(get_service, query_string, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        _dispatch(get_service(), query_string)
+    return iterations / (time.time() - start)
+
+
+def main(iterations=200):
+    registry.get_service()
+
+    print('%-16s %12s %12s %8s' % ('request', 'before [r/s]', 'after [r/s]', 'speedup'))
+    for name in sorted(REQUESTS):
+        before = _measure(_new_service, REQUESTS[name], iterations)
+        after = _measure(registry.get_service, REQUESTS[name], iterations)
+        print('%-16s %12.1f %12.1f %7.2fx' % (name, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
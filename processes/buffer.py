@@ -1,5 +1,4 @@
 import os
-import tempfile
 
 __author__ = 'Brauni'
 
@@ -40,7 +39,7 @@ class Buffer(Process):
 
         inLayer = inSource.GetLayer()
         out = inLayer.GetName()
-        outPath = os.path.join(tempfile.gettempdir(), out)
+        outPath = os.path.join(self.workdir, out)
 
         # create output file
         driver = ogr.GetDriverByName('GML')
@@ -40,7 +40,9 @@ if PY2:
     from flufl.enum import Enum
     from urlparse import urlparse
     from urlparse import urljoin
-    from urllib2 import urlopen
+    from urllib2 import urlopen, Request as UrlRequest, HTTPError
+    from urllib import getproxies, proxy_bypass, quote
+    import httplib as http_client
 
 else:
     LOGGER.debug('Python 3.x')
@@ -49,4 +51,8 @@ else:
     from enum import Enum
     from urllib.parse import urlparse
     from urllib.parse import urljoin
-    from urllib.request import urlopen
+    from urllib.parse import quote
+    from urllib.request import urlopen, Request as UrlRequest
+    from urllib.error import HTTPError
+    from urllib.request import getproxies, proxy_bypass
+    import http.client as http_client
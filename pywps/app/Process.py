@@ -23,6 +23,7 @@
 #
 ###############################################################################
 
+import copy
 import logging
 import os
 import sys
@@ -30,10 +31,12 @@ import traceback
 import json
 import shutil
 import tempfile
+import types
 
-from pywps import WPS, OWS, E, dblog
+from pywps import WPS, OWS, E, dblog, layout, scheduler, workdirs
 from pywps.app.WPSResponse import WPSResponse
 from pywps.app.WPSRequest import WPSRequest
+from pywps.app.basic import xml_fragment
 import pywps.configuration as config
 from pywps._compat import PY2
 from pywps.exceptions import StorageNotSupported, OperationNotSupported, \
@@ -59,6 +62,13 @@ class Process(object):
                    objects.
     """
 
+    # attributes describing the process, setting any of them invalidates the
+    # cached DescribeProcess fragment
+    _DESCRIPTION_ATTRIBUTES = frozenset([
+        'identifier', 'title', 'abstract', 'metadata', 'profile', 'version',
+        'inputs', 'outputs', 'store_supported', 'status_supported'
+    ])
+
     def __init__(self, handler, identifier, title, abstract='', profile=[], metadata=[], inputs=[],
                  outputs=[], version='None', store_supported=False, status_supported=False, grass_location=None):
         self.identifier = identifier
@@ -74,6 +84,7 @@ class Process(object):
         self.status_location = ''
         self.status_url = ''
         self.workdir = None
+        self.worker_pool = None
         self._grass_mapset = None
         self.grass_location = grass_location
 
@@ -141,6 +152,54 @@ class Process(object):
 
         return doc
 
+    def describe_fragment(self):
+        """Return serialized ProcessDescription element of this process
+
+        The fragment is created once and cached until the process definition
+        changes. Attributes of the inputs and outputs have to be set, not
+        changed in place, so the change is noticed.
+        """
+
+        key = (_get_versions(self.inputs), _get_versions(self.outputs))
+        cached = self._describe_fragment
+        if cached is None or cached[0] != key:
+            LOGGER.debug('Serializing process description of %s', self.identifier)
+            cached = (key, xml_fragment(self.describe_xml(), WPS.ProcessDescriptions()))
+            self._describe_fragment = cached
+
+        return cached[1]
+
+    def __setattr__(self, name, value):
+        if name in self._DESCRIPTION_ATTRIBUTES:
+            self.__dict__['_describe_fragment'] = None
+        object.__setattr__(self, name, value)
+
+    def new_instance(self, workdir=None):
+        """Return copy of the process for one request
+
+        The copy carries the state of the request (uuid, status location,
+        working directory) and has its own inputs and outputs, so requests
+        executed at once in threads of one service do not share any state.
+        Handler bound to this process is bound to the copy.
+
+        :param workdir: working directory of the request
+        """
+
+        instance = copy.copy(self)
+        instance.inputs = [inpt.clone() for inpt in self.inputs]
+        instance.outputs = [copy.deepcopy(outpt) for outpt in self.outputs]
+        if getattr(self.handler, '__self__', None) is self:
+            instance.handler = types.MethodType(self.handler.__func__, instance)
+
+        instance.uuid = None
+        instance.status_location = ''
+        instance.status_url = ''
+        instance.workdir = None
+        instance._grass_mapset = None
+        if workdir:
+            instance.set_workdir(workdir)
+        return instance
+
     def execute(self, wps_request, uuid):
         self._set_uuid(uuid)
         async = False
@@ -173,30 +232,29 @@ class Process(object):
 
         self.uuid = uuid
 
-        file_path = config.get_config_value('server', 'outputpath')
+        file_name = '%s.xml' % self.uuid
 
         file_url = config.get_config_value('server', 'outputurl')
 
-        self.status_location = os.path.join(file_path, str(self.uuid)) + '.xml'
-        self.status_url = os.path.join(file_url, str(self.uuid)) + '.xml'
+        self.status_location = layout.get_path(file_name)
+        self.status_url = os.path.join(file_url, layout.get_relative_url(file_name))
 
     def _execute_process(self, async, wps_request, wps_response):
         """Uses :module:`multiprocessing` module for sending process to
-        background BUT first, check for maxprocesses configuration value
+        background BUT first, check for free slot in :mod:`pywps.scheduler`
 
         :param async: run in asynchronous mode
         :return: wps_response or None
         """
 
-        maxparalel = int(config.get_config_value('server', 'parallelprocesses'))
-        running = len(dblog.get_running())
-        stored = len(dblog.get_stored())
+        stored = dblog.count_stored()
 
         # async
         if async:
 
-            # run immedietly
-            if running < maxparalel:
+            # run immedietly, unless older requests are waiting in the queue
+            if not stored and scheduler.can_run(self.identifier, synchronous=False):
+                self._write_accepted(wps_response)
                 self._run_async(wps_request, wps_response)
 
             # try to store for later usage
@@ -206,21 +264,72 @@ class Process(object):
 
         # not async
         else:
-            if running < maxparalel:
+            if scheduler.can_run(self.identifier):
                 wps_response = self._run_process(wps_request, wps_response)
             else:
                 raise ServerBusy('Maximum number of paralel running processes reached. Please try later.')
 
         return wps_response
 
+    def _write_accepted(self, wps_response):
+        """Write the accepted status document and state of asynchronous
+        request, before the job is handed over, so it never replaces status
+        written by the job in another process
+        """
+
+        wps_response.update_status()
+
     def _run_async(self, wps_request, wps_response):
+        if self.worker_pool is not None:
+            try:
+                self.worker_pool.submit(self, wps_request)
+                return
+            except (TypeError, ValueError) as e:
+                LOGGER.warning('Request can not be passed to worker pool, forking: %s', e)
+
         import multiprocessing
         process = multiprocessing.Process(
-            target=self._run_process,
+            target=self._run_detached,
             args=(wps_request, wps_response)
         )
         process.start()
 
+    def _run_detached(self, wps_request, wps_response):
+        """Run the process in forked child, which exits without running
+        atexit handlers, so the queued request log has to be written here
+        """
+
+        lease = scheduler.hold_lease(self.uuid)
+        try:
+            # the child runs this request only, it may change its directory
+            os.chdir(self.workdir)
+            self._run_process(wps_request, wps_response)
+        finally:
+            lease.set()
+            self.clean()
+            dblog.remove_stored(self.uuid)
+            dblog.shutdown()
+
+    def _restore_request(self, wps_request, uuid, workdir):
+        """Prepare the process for request taken from the queue
+
+        :param wps_request: :class:`~WPSRequest` restored from JSON
+        :param uuid: uuid of the stored request
+        :param workdir: working directory created when the request came
+        :returns: :class:`~WPSResponse` of the request
+        """
+
+        self._set_uuid(uuid)
+        self.set_workdir(workdir)
+        for outpt in self.outputs:
+            if outpt.identifier in wps_request.outputs:
+                is_reference = wps_request.outputs[outpt.identifier].get('asReference', 'false')
+                outpt.as_reference = is_reference.lower() == 'true'
+
+        wps_response = WPSResponse(self, wps_request, uuid)
+        wps_response.status = WPSResponse.STORE_AND_UPDATE_STATUS
+        return wps_response
+
 
     def _store_process(self, stored, wps_request, wps_response):
         """Try to store given requests
@@ -229,7 +338,8 @@ class Process(object):
         maxprocesses = int(config.get_config_value('server', 'maxprocesses'))
 
         if stored < maxprocesses:
-            dblog.store_process(self.uuid, wps_request)
+            self._write_accepted(wps_response)
+            dblog.store_process(self.uuid, wps_request, self.workdir)
         else:
             raise ServerBusy('Maximum number of parallel running processes reached. Please try later.')
 
@@ -273,27 +383,14 @@ class Process(object):
             else:
                 wps_response.update_status(msg, -1)
 
-        # tr
-        stored_requests = dblog.get_first_stored()
-        if len(stored_requests) > 0:
-            (uuid, request_json) = stored_requests[0]
-            new_wps_request = WPSRequest()
-            new_wps_request.json = json.loads(request_json)
-            new_wps_response = WPSResponse(self, new_wps_request, uuid)
-            new_wps_response.status = WPSResponse.STORE_AND_UPDATE_STATUS
-            self._set_uuid(uuid)
-            self._run_async(new_wps_request, new_wps_response)
-            dblog.remove_stored(uuid)
-
-
         return wps_response
 
     def clean(self):
         """Clean the process working dir and other temporary files
         """
         LOGGER.info("Removing temporary working directory: %s" % self.workdir)
-        if os.path.isdir(self.workdir):
-            shutil.rmtree(self.workdir)
+        # emptied in background, if it is from the pool
+        workdirs.release(self.workdir)
         if self._grass_mapset and os.path.isdir(self._grass_mapset):
             LOGGER.info("Removing temporary GRASS GIS mapset: %s" % self._grass_mapset)
             shutil.rmtree(self._grass_mapset)
@@ -392,3 +489,10 @@ class Process(object):
                 'GRASS environment initialised with GISRC {}, GISBASE {}, GISDBASE {}, LOCATION {}, MAPSET {}'.format(
                 os.environ.get('GISRC'), os.environ.get('GISBASE'),
                 dbase, location, os.path.basename(mapset_name)))
+
+
+def _get_versions(ios):
+    """Return identity and version of given inputs or outputs
+    """
+
+    return tuple((id(io), getattr(io, '_description_version', None)) for io in ios)
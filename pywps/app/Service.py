@@ -1,31 +1,59 @@
+import atexit
 import logging
 import tempfile
+import threading
+import weakref
+import lxml.etree
 from werkzeug.exceptions import BadRequest, HTTPException
 from werkzeug.wrappers import Request, Response
 from pywps import WPS, OWS
 from pywps.inout import Format
 from pywps._compat import PY2
-from pywps._compat import urlopen
-from pywps.app.basic import xml_response
+from pywps._compat import urlparse, HTTPError
+from pywps.app.basic import xml_serialize, xml_join, xml_bytes_response, bytes_response, get_etag, \
+    xpath_ns
 from pywps.app.WPSRequest import WPSRequest
+from pywps.app.WorkerPool import WorkerPool
 import pywps.configuration as config
 from pywps.exceptions import MissingParameterValue, NoApplicableCode, InvalidParameterValue, FileSizeExceeded, \
     StorageNotSupported
 from pywps.inout.inputs import ComplexInput, LiteralInput, BoundingBoxInput
+from pywps import dblog, expiry, httpclient, jobstate, layout, refcache, scheduler, workdirs
 from pywps.dblog import log_request, update_response
 
 from collections import deque
+import hashlib
 import os
 import sys
+import json
+import time
 import uuid
 
 LOGGER = logging.getLogger("PYWPS")
 
+# bytes read from reference inputs at once
+REFERENCE_CHUNK_SIZE = 64 * 1024
+
+# services with started workers, stopped at exit, replaced services are not
+# kept alive by the exit handler
+_STARTED = weakref.WeakSet()
+
+
+def _stop_started():
+    for service in list(_STARTED):
+        service.stop_workers()
+
+atexit.register(_stop_started)
+
+
 class Service(object):
 
     """ The top-level object that represents a WPS service. It's a WSGI
     application.
 
+    Call :meth:`start_workers` once the service is created, before it
+    serves requests, so asynchronous and stored requests are run.
+
     :param processes: A list of :class:`~Process` objects that are
                       provided by this service.
 
@@ -34,21 +62,146 @@ class Service(object):
 
     def __init__(self, processes=[], cfgfiles=None):
         self.processes = {p.identifier: p for p in processes}
+        # (cache key, serialized document, etag) of GetCapabilities
+        self._capabilities = None
+        self.worker_pool = None
+        self._dispatcher = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
 
         if cfgfiles:
             config.load_configuration(cfgfiles)
 
-        if config.get_config_value('server', 'logfile') and config.get_config_value('server', 'loglevel'):
-            LOGGER.setLevel(getattr(logging, config.get_config_value('server', 'loglevel')))
-            msg_fmt = '%(asctime)s] [%(levelname)s] file=%(pathname)s line=%(lineno)s module=%(module)s function=%(funcName)s %(message)s'
-            fh = logging.FileHandler(config.get_config_value('server', 'logfile'))
-            fh.setFormatter(logging.Formatter(msg_fmt))
-            LOGGER.addHandler(fh)
-        else:  # NullHandler
-            LOGGER.addHandler(logging.NullHandler())
+        _set_logging()
+
+
+    def start_workers(self):
+        """Start the pool of worker processes for asynchronous Execute, if
+        enabled by server->workerpool, the dispatcher of stored requests,
+        the collector of expired outputs and the resetter of the working
+        directories
+
+        Has to be called once, when the service is loaded, not from a
+        request. The workers are forked first, before the threads of the
+        service start.
+        """
+
+        # workers forked later share the store
+        jobstate.start()
+
+        if self.worker_pool is None and config.get_config_value('server', 'workerpool'):
+            max_rss = config.get_size_mb(config.get_config_value('server', 'workerpool_maxrss'))
+            self.worker_pool = WorkerPool(
+                self.processes,
+                size=int(config.get_config_value('server', 'parallelprocesses')),
+                max_jobs=int(config.get_config_value('server', 'workerpool_maxjobs')),
+                max_rss=int(max_rss * 1024 * 1024)
+            )
+            self.worker_pool.start()
+            for process in self.processes.values():
+                process.worker_pool = self.worker_pool
+
+        if self._dispatcher is None:
+            self._stopping.clear()
+            self._dispatcher = threading.Thread(target=self._dispatch_loop,
+                                                name='pywps-dispatcher')
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+            _STARTED.add(self)
+
+        expiry.start()
+        workdirs.start()
+
+        return self.worker_pool
+
+    def stop_workers(self):
+        """Stop the dispatcher and the pool of worker processes
+        """
+
+        _STARTED.discard(self)
+        if self._dispatcher is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._dispatcher.join()
+            self._dispatcher = None
+
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
+            self.worker_pool = None
+            for process in self.processes.values():
+                process.worker_pool = None
+
+        expiry.stop()
+        workdirs.stop()
+        jobstate.stop()
+        httpclient.clear()
+
+    def _dispatch_loop(self):
+        """Run stored requests, whenever woken up by finished request or
+        every server->queue_pollinterval seconds
+        """
+
+        while not self._stopping.is_set():
+            self._wakeup.wait(float(config.get_config_value('server', 'queue_pollinterval')))
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self._dispatch()
+            except Exception as e:
+                LOGGER.exception('Dispatching stored requests failed: %s', e)
+
+    def _dispatch(self):
+        """Lease stored requests in the order given by :mod:`pywps.scheduler`
+        and run them, while there is free slot
+
+        :returns: number of dispatched requests
+        """
+
+        dispatched = 0
+        while True:
+            stored = scheduler.claim_next()
+            if stored is None:
+                break
+
+            (uuid, identifier, workdir, request_json) = stored
+            process = self.processes.get(identifier)
+            if process is None:
+                LOGGER.error('Stored request %s of unknown process %s removed', uuid, identifier)
+                dblog.remove_stored(uuid)
+                continue
+
+            wps_request = WPSRequest()
+            wps_request.json = json.loads(request_json)
+            process = process.new_instance()
+            wps_response = process._restore_request(wps_request, uuid, workdir)
+            LOGGER.debug('Dispatching stored request %s', uuid)
+            process._run_async(wps_request, wps_response)
+            dispatched += 1
+
+        return dispatched
+
+    def get_capabilities(self, etags=None):
+        """Return GetCapabilities response
+
+        The document is serialized once per set of processes and loaded
+        configuration and served from memory afterwards.
+
+        :param etags: :class:`werkzeug.datastructures.ETags` from the
+                      If-None-Match request header
+        """
+
+        key = (config.get_generation(), tuple(sorted(self.processes)))
+        cached = self._capabilities
+        if cached is None or cached[0] != key:
+            LOGGER.debug('Building GetCapabilities document')
+            xml = xml_serialize(self._capabilities_doc())
+            cached = (key, xml, get_etag(xml))
+            self._capabilities = cached
 
+        return xml_bytes_response(cached[1], cached[2], etags)
 
-    def get_capabilities(self):
+    def _capabilities_doc(self):
         process_elements = [p.capabilities_xml()
                             for p in self.processes.values()]
 
@@ -242,7 +395,7 @@ class Service(object):
 
         doc.append(languages_doc)
 
-        return xml_response(doc)
+        return doc
 
     def describe(self, identifiers):
         if not identifiers:
@@ -254,7 +407,7 @@ class Service(object):
             for process in self.processes:
                 try:
                     identifier_elements.append(
-                        self.processes[process].describe_xml())
+                        self.processes[process].describe_fragment())
                 except Exception as e:
                     raise NoApplicableCode(e)
         else:
@@ -266,19 +419,65 @@ class Service(object):
                         "Unknown process %r" % identifier, "identifier")
                 else:
                     try:
-                        identifier_elements.append(process.describe_xml())
+                        identifier_elements.append(process.describe_fragment())
                     except Exception as e:
                         raise NoApplicableCode(e)
 
-        doc = WPS.ProcessDescriptions(
-            *identifier_elements
-        )
+        doc = WPS.ProcessDescriptions()
         doc.attrib[
             '{http://www.w3.org/2001/XMLSchema-instance}schemaLocation'] = 'http://www.opengis.net/wps/1.0.0 http://schemas.opengis.net/wps/1.0.0/wpsDescribeProcess_response.xsd'
         doc.attrib['service'] = 'WPS'
         doc.attrib['version'] = '1.0.0'
         doc.attrib['{http://www.w3.org/XML/1998/namespace}lang'] = 'en-US'
-        return xml_response(doc)
+        return xml_bytes_response(xml_join(doc, identifier_elements))
+
+    def get_status(self, jobid, etags=None, status_format='json', wait=0,
+                   last_event_id=None):
+        """Return current state of asynchronous request
+
+        State is taken from :mod:`pywps.jobstate`, from the status document
+        if the request is not found there.
+
+        :param jobid: uuid of the request
+        :param etags: :class:`werkzeug.datastructures.ETags` from the
+                      If-None-Match request header
+        :param status_format: 'json' for status, percent done and message,
+                              with the status document once the request
+                              finished, 'xml' for the status document,
+                              'events' for stream of server-sent events with
+                              the json state
+        :param wait: seconds to wait for change of the state, if it matches
+                     etags, at most server->jobstate_maxwait (long polling)
+        :param last_event_id: Last-Event-ID request header, entity tag of the
+                              last received event
+        """
+
+        try:
+            jobid = str(uuid.UUID(str(jobid)))
+        except ValueError:
+            raise InvalidParameterValue('Invalid jobid %r' % jobid, 'jobid')
+
+        state = _get_status(jobid)
+        if state is None:
+            raise InvalidParameterValue('Unknown jobid %s' % jobid, 'jobid')
+
+        if status_format == 'events':
+            response = Response(_status_events(jobid, state, last_event_id),
+                                content_type='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            response.status_percentage = 100
+            return response
+
+        maxwait = float(config.get_config_value('server', 'jobstate_maxwait'))
+        wait = min(float(wait or 0), maxwait)
+        if wait > 0 and etags is not None and etags.contains_weak(state['etag']) and \
+                state['status'] not in ('succeeded', 'failed'):
+            state = jobstate.wait(jobid, state['etag'], wait) or _get_status(jobid) or state
+
+        if status_format == 'xml':
+            return xml_bytes_response(state['document'], state['etag'], etags)
+
+        return bytes_response(_status_json(jobid, state), 'application/json', state['etag'], etags)
 
     def execute(self, identifier, wps_request, uuid):
         """Parse and perform Execute WPS request call
@@ -291,19 +490,22 @@ class Service(object):
         response = None
         try:
             process = self.processes[identifier]
-
-            workdir = config.get_config_value('server', 'workdir')
-            tempdir = tempfile.mkdtemp(prefix='pyws_process_', dir=workdir)
-            process.set_workdir(tempdir)
         except KeyError:
             raise InvalidParameterValue("Unknown process '%r'" % identifier, 'Identifier')
 
-        olddir = os.path.abspath(os.curdir)
+        # the request runs in its own copy of the process and its working
+        # directory is passed to the inputs and outputs, the current
+        # directory is shared by all threads and is not changed
+        process = process.new_instance(workdirs.acquire())
         try:
-            os.chdir(process.workdir)
             response = self._parse_and_execute(process, wps_request, uuid)
+        except:
+            # the request was not started
+            process.clean()
+            raise
         finally:
-            os.chdir(olddir)
+            # capacity may be free now, run stored requests
+            self._wakeup.set()
 
         return response
 
@@ -317,6 +519,8 @@ class Service(object):
 
         LOGGER.debug('Checking if all mandatory inputs have been passed')
         data_inputs = {}
+        # reference inputs, fetched together once all inputs are parsed
+        fetches = []
         for inpt in process.inputs:
             if inpt.identifier not in wps_request.inputs:
                 if inpt.min_occurs > 0:
@@ -332,7 +536,7 @@ class Service(object):
             # set the input to the type defined in the process
             if isinstance(inpt, ComplexInput):
                 data_inputs[inpt.identifier] = self.create_complex_inputs(
-                    inpt, wps_request.inputs[inpt.identifier])
+                    inpt, wps_request.inputs[inpt.identifier], fetches)
             elif isinstance(inpt, LiteralInput):
                 data_inputs[inpt.identifier] = self.create_literal_inputs(
                     inpt, wps_request.inputs[inpt.identifier])
@@ -340,6 +544,7 @@ class Service(object):
                 data_inputs[inpt.identifier] = self.create_bbox_inputs(
                     inpt, wps_request.inputs[inpt.identifier])
 
+        self._fetch_references(fetches)
         wps_request.inputs = data_inputs
 
         # set as_reference to True for all the outputs specified as reference
@@ -390,39 +595,28 @@ class Service(object):
         :param href: href object yes or not
         """
 
-        def href_handler(complexinput, datain):
-            """<wps:Reference /> handler"""
-            tmp_dir = config.get_config_value('server', 'workdir')
-
-            # save the reference input in workdir
-            tmp_file = tempfile.mkstemp(dir=complexinput.workdir)[1]
+        def href_handler(complexinput, datain, deadline=None, stop=None):
+            """<wps:Reference /> handler
 
-
-            try:
-                (reference_file, reference_file_data) = _openurl(datain)
-                data_size = reference_file.headers.get('Content-Length', 0)
-            except Exception as e:
-                raise NoApplicableCode('File reference error: %s' % e)
-
-            # if the response did not return a 'Content-Length' header then
-            # calculate the size
-            if data_size == 0:
-                LOGGER.debug('no Content-Length, calculating size')
-                data_size = _get_datasize(reference_file_data)
+            :param deadline: time, when the download is aborted
+            :param stop: :class:`threading.Event` aborting the download
+            """
 
             # check if input file size was not exceeded
             complexinput.calculate_max_input_size()
-            byte_size = complexinput.max_size * 1024 * 1024
-            if int(data_size) > int(byte_size):
-                raise FileSizeExceeded('File size for input exceeded.'
-                                       ' Maximum allowed: %i megabytes' %
-                                       complexinput.max_size, complexinput.get('identifier'))
+            byte_size = int(complexinput.max_size * 1024 * 1024)
 
+            # save the reference input in workdir
+            (tmp_fd, tmp_file) = tempfile.mkstemp(dir=complexinput.workdir)
+            os.close(tmp_fd)
             try:
-                with open(tmp_file, 'w') as f:
-                    f.write(reference_file_data)
+                _fetch_reference(datain, tmp_file, byte_size, complexinput, deadline, stop)
+            except NoApplicableCode:
+                os.remove(tmp_file)
+                raise
             except Exception as e:
-                raise NoApplicableCode(e)
+                os.remove(tmp_file)
+                raise NoApplicableCode('File reference error: %s' % e)
 
             complexinput.file = tmp_file
             complexinput.url = datain.get('href')
@@ -438,9 +632,13 @@ class Service(object):
         else:
             return data_handler
 
-    def create_complex_inputs(self, source, inputs):
+    def create_complex_inputs(self, source, inputs, fetches=None):
         """Create new ComplexInput as clone of original ComplexInput
         because of inputs can be more then one, take it just as Prototype
+
+        :param fetches: list, where (input, reference) of reference inputs
+                        are added to be fetched later by
+                        :meth:`_fetch_references`, fetched at once if None
         :return collections.deque:
         """
 
@@ -468,8 +666,11 @@ class Service(object):
             # get the referenced input otherwise get the value of the field
             href = inpt.get('href', None)
 
-            complex_data_handler = self._get_complex_input_handler(href)
-            complex_data_handler(data_input, inpt)
+            if href and fetches is not None:
+                fetches.append((data_input, inpt))
+            else:
+                complex_data_handler = self._get_complex_input_handler(href)
+                complex_data_handler(data_input, inpt)
 
             outinputs.append(data_input)
 
@@ -477,6 +678,91 @@ class Service(object):
             raise MissingParameterValue(locator=source.identifier)
         return outinputs
 
+    def _fetch_references(self, fetches):
+        """Fetch reference inputs in parallel
+
+        At most server->fetch_threads downloads run at once, at most
+        server->fetch_perhost of them from one host. All of them have to
+        finish in server->fetch_timeout seconds.
+
+        :param fetches: list of (input, reference)
+        """
+
+        if not fetches:
+            return
+
+        timeout = float(config.get_config_value('server', 'fetch_timeout'))
+        deadline = time.time() + timeout if timeout > 0 else None
+        href_handler = self._get_complex_input_handler(True)
+
+        if len(fetches) == 1:
+            href_handler(fetches[0][0], fetches[0][1], deadline)
+            return
+
+        threads = int(config.get_config_value('server', 'fetch_threads'))
+        per_host = int(config.get_config_value('server', 'fetch_perhost'))
+        pending = list(fetches)
+        hosts = {}
+        errors = []
+        condition = threading.Condition()
+        # set on error or timeout, running downloads are aborted
+        stop = threading.Event()
+
+        def take():
+            """Take next reference, whose host has free connection
+            """
+
+            with condition:
+                while pending and not stop.is_set():
+                    for (index, (_, datain)) in enumerate(pending):
+                        host = urlparse(datain.get('href')).netloc
+                        if hosts.get(host, 0) < per_host:
+                            hosts[host] = hosts.get(host, 0) + 1
+                            return (host,) + pending.pop(index)
+                    condition.wait(1)
+            return None
+
+        def work():
+            while True:
+                fetch = take()
+                if fetch is None:
+                    return
+
+                (host, complexinput, datain) = fetch
+                try:
+                    href_handler(complexinput, datain, deadline, stop)
+                except Exception as e:
+                    with condition:
+                        errors.append(e)
+                    stop.set()
+                finally:
+                    with condition:
+                        hosts[host] -= 1
+                        condition.notify_all()
+
+        LOGGER.debug('Fetching %i reference inputs', len(fetches))
+        workers = [threading.Thread(target=work, name='pywps-fetch')
+                   for _ in range(max(1, min(threads, len(fetches))))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join(_get_timeout(deadline))
+        timed_out = any(worker.is_alive() for worker in workers)
+
+        # the working directory is cleaned, when the request fails, no
+        # download may write to it afterwards
+        stop.set()
+        with condition:
+            condition.notify_all()
+        for worker in workers:
+            worker.join()
+
+        if timed_out:
+            raise NoApplicableCode('Fetching reference inputs took more than %i seconds' % timeout)
+        if errors:
+            raise errors[0]
+
     def create_literal_inputs(self, source, inputs):
         """ Takes the http_request and parses the input to objects
         :return collections.deque:
@@ -567,13 +853,19 @@ class Service(object):
         try:
             wps_request = WPSRequest(http_request)
             LOGGER.info('Request: %s', wps_request.operation)
+            # polled often, not logged
+            if wps_request.operation == 'getstatus':
+                return self.get_status(wps_request.jobid, http_request.if_none_match,
+                                       wps_request.status_format, wps_request.status_wait,
+                                       http_request.headers.get('Last-Event-ID'))
+
             if wps_request.operation in ['getcapabilities',
                                          'describeprocess',
                                          'execute']:
                 log_request(request_uuid, wps_request)
                 response = None
                 if wps_request.operation == 'getcapabilities':
-                    response = self.get_capabilities()
+                    response = self.get_capabilities(http_request.if_none_match)
 
                 elif wps_request.operation == 'describeprocess':
                     response = self.describe(wps_request.identifiers)
@@ -584,6 +876,10 @@ class Service(object):
                         wps_request,
                         request_uuid
                     )
+                    if wps_request.store_execute == 'true' and wps_request.status == 'true':
+                        # logged as accepted before the job was handed over,
+                        # the job may have updated the row meanwhile
+                        return response
                 update_response(request_uuid, response, close=True)
                 return response
             else:
@@ -604,48 +900,229 @@ class Service(object):
             return e
 
 
-def _openurl(inpt):
-    """use urllib to open given href
+def _set_logging():
+    """Attach the configured handler to LOGGER, unless some previously
+    created Service did so already
+    """
+
+    logfile = config.get_config_value('server', 'logfile')
+    if logfile and config.get_config_value('server', 'loglevel'):
+        LOGGER.setLevel(getattr(logging, config.get_config_value('server', 'loglevel')))
+        logfile = os.path.abspath(logfile)
+        for handler in LOGGER.handlers:
+            if isinstance(handler, logging.FileHandler) and handler.baseFilename == logfile:
+                return
+        msg_fmt = '%(asctime)s] [%(levelname)s] file=%(pathname)s line=%(lineno)s module=%(module)s function=%(funcName)s %(message)s'
+        fh = logging.FileHandler(logfile)
+        fh.setFormatter(logging.Formatter(msg_fmt))
+        LOGGER.addHandler(fh)
+    else:  # NullHandler
+        for handler in LOGGER.handlers:
+            if isinstance(handler, logging.NullHandler):
+                return
+        LOGGER.addHandler(logging.NullHandler())
+
+
+def _get_status(jobid):
+    """Return state of the request from :mod:`pywps.jobstate` or from its
+    status document
+    """
+
+    return jobstate.get(jobid) or _read_status(jobid)
+
+
+def _status_json(jobid, state):
+    """Serialize state of the request for GetStatus
+    """
+
+    status = {
+        'jobid': jobid,
+        'status': state['status'],
+        'percent': state['percent'],
+        'message': state['message'],
+        'document': None
+    }
+    if state['status'] in ('succeeded', 'failed'):
+        status['document'] = state['document'].decode('utf-8')
+
+    return json.dumps(status)
+
+
+def _status_events(jobid, state, last_event_id=None):
+    """Generate server-sent event for every change of the state, until the
+    request finished, comment every server->jobstate_keepalive seconds keeps
+    the connection open
+    """
+
+    keepalive = float(config.get_config_value('server', 'jobstate_keepalive'))
+    etag = last_event_id
+    while state is not None:
+        if state['etag'] != etag:
+            etag = state['etag']
+            yield 'id: %s\nevent: status\ndata: %s\n\n' % (etag, _status_json(jobid, state))
+            if state['status'] in ('succeeded', 'failed'):
+                break
+        else:
+            yield ': keepalive\n\n'
+
+        state = jobstate.wait(jobid, etag, keepalive) or _read_status(jobid)
+
+
+def _read_status(jobid):
+    """Read state of the request from its status document, see
+    :func:`pywps.jobstate.put`
+
+    :returns: dict or None if there is no status document
+    """
+
+    status_location = layout.find('%s.xml' % jobid)
+    if status_location is None:
+        LOGGER.debug('Status document of %s not found', jobid)
+        return None
+
+    try:
+        with open(status_location, 'rb') as f:
+            document = f.read()
+        status = xpath_ns(lxml.etree.fromstring(document), '/wps:ExecuteResponse/wps:Status/*')[0]
+    except (IOError, IndexError, lxml.etree.XMLSyntaxError) as e:
+        LOGGER.debug('Status document of %s not read: %s', jobid, e)
+        return None
+
+    name = lxml.etree.QName(status).localname
+    if name == 'ProcessAccepted':
+        (state, percent) = ('accepted', 0)
+    elif name in ('ProcessStarted', 'ProcessPaused'):
+        (state, percent) = (name[7:].lower(), int(float(status.get('percentCompleted', 0))))
+    elif name == 'ProcessSucceeded':
+        (state, percent) = ('succeeded', 100)
+    else:
+        (state, percent) = ('failed', -1)
+
+    return {
+        'status': state,
+        'percent': percent,
+        'message': ''.join(status.itertext()).strip(),
+        'document': document,
+        'etag': get_etag(document)
+    }
+
+
+def _fetch_reference(datain, file_name, byte_size, complexinput, deadline=None, stop=None):
+    """Download the reference to file_name, take it from
+    :mod:`pywps.refcache` if it did not change since it was cached
+    """
+
+    key = None
+    entry = None
+    if refcache.get_cache_path():
+        key = refcache.get_key(datain)
+        entry = refcache.lookup(key)
+
+    try:
+        reference_file = _openurl(datain, _get_timeout(deadline), refcache.get_headers(entry))
+    except HTTPError as e:
+        if e.code != 304 or entry is None:
+            raise
+
+        if entry['size'] > byte_size:
+            _raise_size_exceeded(complexinput)
+        try:
+            refcache.restore(entry, file_name)
+            return
+        except (IOError, OSError) as e:
+            # evicted meanwhile
+            LOGGER.debug('Cached %s not restored: %s', datain.get('href'), e)
+            reference_file = _openurl(datain, _get_timeout(deadline))
+
+    try:
+        # announced size, the real one is counted while downloading
+        data_size = int(reference_file.headers.get('Content-Length') or 0)
+        if data_size > byte_size:
+            _raise_size_exceeded(complexinput)
+
+        digest = hashlib.sha256() if key else None
+        with open(file_name, 'wb') as f:
+            _copy_reference(reference_file, f, byte_size, complexinput, deadline, digest, stop)
+
+        if key and refcache.is_cacheable(reference_file.headers):
+            refcache.store(key, datain, reference_file.headers, file_name, digest.hexdigest())
+    finally:
+        reference_file.close()
+
+
+def _openurl(inpt, timeout=None, headers=None):
+    """open given href by :mod:`pywps.httpclient`, with headers of the
+    reference
+
+    :param timeout: socket timeout in seconds
+    :param headers: additional request headers
+    :returns: file-like response, body is not read yet
     """
     data = None
-    reference_file = None
     href = inpt.get('href')
+    request_headers = dict(inpt.get('header') or {})
+    request_headers.update(headers or {})
 
     LOGGER.debug('Fetching URL %s', href)
     if inpt.get('method') == 'POST':
         if inpt.has_key('body'):
             data = inpt.get('body')
         elif inpt.has_key('bodyreference'):
-            data = urlopen(url=inpt.get('bodyreference')).read()
+            body_file = httpclient.urlopen(inpt.get('bodyreference'), timeout=timeout)
+            try:
+                data = body_file.read()
+            finally:
+                body_file.close()
 
-        reference_file = urlopen(url=href, data=data)
+        return httpclient.urlopen(href, data, request_headers, timeout)
     else:
-        reference_file = urlopen(url=href)
+        return httpclient.urlopen(href, headers=request_headers, timeout=timeout)
 
 
-    if PY2:
-        reference_file_data = reference_file.read()
-    else:
-        reference_file_data = reference_file.read().decode('utf-8')
+def _get_timeout(deadline):
+    """Return seconds remaining to the deadline, None without deadline
+    """
 
-    return (reference_file, reference_file_data)
+    if deadline is None:
+        return None
 
+    return max(deadline - time.time(), 0.001)
 
-def _get_datasize(reference_file_data):
 
-    tmp_sio = None
-    data_size = 0
+def _copy_reference(reference_file, target, byte_size, complexinput, deadline=None,
+                    digest=None, stop=None):
+    """Copy body of the reference to target file in chunks of
+    REFERENCE_CHUNK_SIZE bytes, stop as soon as it is bigger than byte_size,
+    the deadline passed or the stop event is set
 
-    if PY2:
-        from StringIO import StringIO
+    :param digest: hashlib object updated with the body
+    :param stop: :class:`threading.Event` aborting the copy
+    :returns: number of copied bytes
+    """
 
-        tmp_sio = StringIO(reference_file_data)
-        data_size = tmp_sio.len
-    else:
-        from io import StringIO
+    data_size = 0
+    while True:
+        if deadline is not None and time.time() > deadline:
+            raise NoApplicableCode('Fetching reference input %s timed out' % complexinput.identifier)
+        if stop is not None and stop.is_set():
+            raise NoApplicableCode('Fetching reference input %s cancelled' % complexinput.identifier)
+
+        chunk = reference_file.read(REFERENCE_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        data_size += len(chunk)
+        if data_size > byte_size:
+            _raise_size_exceeded(complexinput)
+        target.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+
+    LOGGER.debug('%i bytes of %s stored', data_size, complexinput.identifier)
+    return data_size
 
-        tmp_sio = StringIO()
-        data_size = tmp_sio.write(reference_file_data)
-    tmp_sio.close()
 
-    return data_size
+def _raise_size_exceeded(complexinput):
+    raise FileSizeExceeded('File size for input exceeded.'
+                           ' Maximum allowed: %i megabytes' %
+                           complexinput.max_size, complexinput.identifier)
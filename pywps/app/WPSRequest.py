@@ -17,6 +17,7 @@ from pywps.inout.literaltypes import AnyValue, NoValue, ValuesReference, Allowed
 from pywps.inout.formats import Format
 
 import json
+import uuid
 
 
 class WPSRequest(object):
@@ -34,8 +35,10 @@ class WPSRequest(object):
         self.inputs = None
         self.outputs = None
         self.raw = None
+        self.owner = None
 
         if self.http_request:
+            self.owner = _get_owner(http_request)
             request_parser = self._get_request_parser_method(http_request.method)
             request_parser()
 
@@ -148,6 +151,28 @@ class WPSRequest(object):
                 wpsrequest.store_execute = 'false'
                 wpsrequest.status = 'false'
 
+        def parse_get_getstatus(http_request):
+            """Parse GET GetStatus request
+            """
+            jobid = _get_get_param(http_request, 'jobid')
+            if not jobid:
+                raise MissingParameterValue('Missing jobid value', 'jobid')
+            try:
+                wpsrequest.jobid = str(uuid.UUID(jobid))
+            except ValueError:
+                raise InvalidParameterValue('Invalid jobid %r' % jobid, 'jobid')
+
+            wpsrequest.status_format = _get_get_param(http_request, 'format', 'json').lower()
+            if wpsrequest.status_format not in ('json', 'xml', 'events'):
+                raise InvalidParameterValue(
+                    'Format %r not supported' % wpsrequest.status_format, 'format')
+
+            wait = _get_get_param(http_request, 'wait', 0)
+            try:
+                wpsrequest.status_wait = float(wait)
+            except ValueError:
+                raise InvalidParameterValue('Invalid wait %r' % wait, 'wait')
+
         if not operation:
             raise MissingParameterValue('Missing request value', 'request')
         else:
@@ -159,6 +184,8 @@ class WPSRequest(object):
             return parse_get_describeprocess
         elif self.operation == 'execute':
             return parse_get_execute
+        elif self.operation == 'getstatus':
+            return parse_get_getstatus
         else:
             raise OperationNotSupported(
                 'Unknown request %r' % self.operation, operation)
@@ -300,13 +327,15 @@ class WPSRequest(object):
             'operation': self.operation,
             'version': self.version,
             'language': self.language,
+            'identifier': getattr(self, 'identifier', None),
             'identifiers': self.identifiers,
             'store_execute': self.store_execute,
             'status': self.status,
             'lineage': self.lineage,
             'inputs': dict((i, [inpt.json for inpt in self.inputs[i]]) for i in self.inputs),
             'outputs': self.outputs,
-            'raw': self.raw
+            'raw': self.raw,
+            'owner': self.owner
         }
 
         return json.dumps(obj, allow_nan=False)
@@ -321,12 +350,14 @@ class WPSRequest(object):
         self.operation = value['operation']
         self.version = value['version']
         self.language = value['language']
+        self.identifier = value.get('identifier')
         self.identifiers = value['identifiers']
         self.store_execute = value['store_execute']
         self.status = value['status']
         self.lineage = value['lineage']
         self.outputs = value['outputs']
         self.raw = value['raw']
+        self.owner = value.get('owner')
         self.inputs = {}
 
         for identifier in value['inputs']:
@@ -458,9 +489,9 @@ def get_inputs_from_xml(doc):
                 '{http://www.w3.org/1999/xlink}href', '')
             inpt['mimeType'] = reference_data_el.attrib.get('mimeType', '')
             inpt['method'] = reference_data_el.attrib.get('method', 'GET')
-            header_element = xpath_ns(reference_data_el, './wps:Header')
-            if header_element:
-                inpt['header'] = _get_reference_header(header_element)
+            header_elements = xpath_ns(reference_data_el, './wps:Header')
+            if header_elements:
+                inpt['header'] = _get_reference_header(header_elements)
             body_element = xpath_ns(reference_data_el, './wps:Body')
             if body_element:
                 inpt['body'] = _get_reference_body(body_element[0])
@@ -582,6 +613,25 @@ def _get_get_param(http_request, key, default=None, aslist=False):
     return value
 
 
+def _get_owner(http_request):
+    """Returns user of the request, used for the fair share of the slots
+    and the quotas, identified by authenticated user name, by
+    scheduler->owner_header, if it is configured, or by client address
+
+    :param http_request: http_request object
+    """
+
+    if http_request.remote_user:
+        return http_request.remote_user
+
+    header = configuration.get_config_value('scheduler', 'owner_header')
+    owner = None
+    if header:
+        owner = http_request.headers.get(header)
+
+    return owner or http_request.remote_addr
+
+
 def _get_dataelement_value(value_el):
     """Return real value of XML Element (e.g. convert Element.FeatureCollection
     to String
@@ -609,12 +659,15 @@ def _get_rawvalue_value(data, encoding=None):
         return data
 
 
-def _get_reference_header(header_element):
-    """Parses ReferenceInput Header element
+def _get_reference_header(header_elements):
+    """Parses ReferenceInput Header elements
+
+    :returns: dict of header names and values
     """
     header = {}
-    header['key'] = header_element.attrib('key')
-    header['value'] = header_element.attrib('value')
+    for header_element in header_elements:
+        if header_element.attrib.get('key'):
+            header[header_element.attrib.get('key')] = header_element.attrib.get('value', '')
     return header
 
 
@@ -1,13 +1,19 @@
+import errno
 import os
+import logging
+import threading
 from lxml import etree
 import time
 from werkzeug.wrappers import Request
 from werkzeug.exceptions import HTTPException
-from pywps import WPS, OWS
-from pywps.app.basic import xml_response
+from pywps import WPS, OWS, jobstate, layout
+from pywps.app.basic import xml_response, xml_template, xml_fragment
 from pywps.exceptions import NoApplicableCode
+from pywps.inout.basic import ComplexOutput
 import pywps.configuration as config
-from pywps.dblog import update_response
+from pywps.dblog import update_response, record_output
+
+LOGGER = logging.getLogger('PYWPS')
 
 
 class WPSResponse(object):
@@ -28,46 +34,175 @@ class WPSResponse(object):
         self.process = process
         self.wps_request = wps_request
         self.outputs = {o.identifier: o for o in process.outputs}
+        for output in process.outputs:
+            if isinstance(output, ComplexOutput):
+                output.uuid = uuid
+                output.owner = getattr(wps_request, 'owner', None)
         self.message = ''
         self.status = self.NO_STATUS
         self.status_percentage = 0
         self.doc = None
         self.uuid = uuid
 
+        # (key, head, tail, empty root) of serialized skeleton document
+        self._skeleton = None
+        # state and time of the last written status, pending progress update
+        self._written_state = None
+        self._written_time = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
     def update_status(self, message=None, status_percentage=None, status=None):
+        """Update status of the request, write the status document and the
+        request log
+
+        Progress updates are coalesced and written at most every
+        server->status_interval milliseconds, the last one after the interval
+        elapsed. Change of the state (accepted, started, succeeded, failed)
+        is written immediately.
+        """
+
+        with self._lock:
+            if message:
+                self.message = message
+
+            if status:
+                self.status = status
+
+            if status_percentage:
+                self.status_percentage = status_percentage
+
+            state = self._get_state()
+            interval = float(config.get_config_value('server', 'status_interval')) / 1000
+            delay = self._written_time + interval - time.time()
+
+            if state == self._written_state and delay > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(delay, self._write_pending)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+
+            self._write_status(state)
+
+    def _get_state(self):
+        """Return state of the request, as written to the status document
+        """
+
+        if self.status_percentage == -1:
+            progress = 'failed'
+        elif self.status >= self.STORE_AND_UPDATE_STATUS and self.status_percentage == 0:
+            progress = 'accepted'
+        elif self.status >= self.STORE_AND_UPDATE_STATUS and 0 < self.status_percentage < 100:
+            progress = 'started'
+        else:
+            progress = 'succeeded'
+
+        return (self.status, progress)
+
+    def _write_pending(self):
+        """Write coalesced progress update, called by the timer
+        """
 
-        if message:
-            self.message = message
+        with self._lock:
+            # cancelled by newer write meanwhile
+            if self._timer is not threading.current_thread():
+                return
 
-        if status:
-            self.status = status
+            try:
+                self._write_status(self._get_state())
+            except Exception as e:
+                LOGGER.error('Writing status of %s failed: %s', self.uuid, e)
 
-        if status_percentage:
-            self.status_percentage = status_percentage
+    def _write_status(self, state):
+        """Rebuild the doc, update the status xml file and the request log
+        """
 
-        # rebuild the doc and update the status xml file
-        self.doc = self._construct_doc()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
 
+        self._written_state = state
+        self._written_time = time.time()
 
         # check if storing of the status is requested
         if self.status >= self.STORE_STATUS:
-            self.write_response_doc(self.doc)
+            self._write_response_xml(self._serialize_doc())
 
         update_response(self.uuid, self)
 
+    def _serialize_doc(self):
+        """Serialize the status document
+
+        While the process runs, only the Status element is rendered, the
+        rest of the document is serialized once per job.
+        """
+
+        if self._get_state()[1] == 'succeeded':
+            self.doc = self._construct_doc()
+            return etree.tostring(self.doc, pretty_print=True)
+
+        key = (self.status >= self.STORE_STATUS, self.process.status_url)
+        if self._skeleton is None or self._skeleton[0] != key:
+            skeleton = self._construct_skeleton()
+            (head, tail) = xml_template(skeleton)
+            self._skeleton = (key, head, tail, etree.Element(skeleton.tag, nsmap=skeleton.nsmap))
+
+        (_, head, tail, root) = self._skeleton
+        status = xml_fragment(self._construct_status(), root)
+        root.clear()
+        return head + status + tail
+
     def write_response_doc(self, doc):
-        # TODO: check if file/directory is still present, maybe deleted in mean time
+        """Write the document to status_location
 
-        try:
-            with open(self.process.status_location, 'w') as f:
-                f.write(etree.tostring(doc, pretty_print=True, encoding='utf-8').decode('utf-8'))
-                f.flush()
-                os.fsync(f.fileno())
+        :param doc: ExecuteResponse element
+        """
 
-            if self.status >= self.DONE_STATUS:
-                self.process.clean()
+        self._write_response_xml(etree.tostring(doc, pretty_print=True))
 
-        except IOError as e:
+    def _write_response_xml(self, xml):
+        """Write serialized document to status_location
+
+        Document is written to temporary file, which replaces the status
+        document at once, so readers never get incomplete document.
+        """
+        # TODO: check if file/directory is still present, maybe deleted in mean time
+
+        status_location = self.process.status_location
+        temp_location = '%s.%i-%i.tmp' % (status_location, os.getpid(),
+                                          threading.current_thread().ident)
+        try:
+            try:
+                f = open(temp_location, 'wb')
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                # first document in the prefix directory of the layout
+                layout.make_dirs(status_location)
+                f = open(temp_location, 'wb')
+            with f:
+                f.write(xml)
+
+            # the first document is recorded for expiry
+            created = not os.path.exists(status_location)
+            try:
+                os.rename(temp_location, status_location)
+            except OSError:
+                # Windows does not replace existing file
+                os.remove(status_location)
+                os.rename(temp_location, status_location)
+
+            if created:
+                record_output(self.uuid, getattr(self.wps_request, 'owner', None),
+                              status_location, len(xml))
+
+            jobstate.put(self.uuid, self._get_state()[1], self.status_percentage,
+                         self.message, xml)
+
+        except (IOError, OSError) as e:
+            if os.path.exists(temp_location):
+                os.remove(temp_location)
             raise NoApplicableCode('Writing Response Document failed with : %s' % e)
 
     def _process_accepted(self):
@@ -114,7 +249,11 @@ class WPSResponse(object):
             creationTime=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime())
         )
 
-    def _construct_doc(self):
+    def _construct_skeleton(self):
+        """Construct ExecuteResponse with the Process element, the part of
+        the document, which does not change during the execution
+        """
+
         doc = WPS.ExecuteResponse()
         doc.attrib['{http://www.w3.org/2001/XMLSchema-instance}schemaLocation'] = 'http://www.opengis.net/wps/1.0.0 http://schemas.opengis.net/wps/1.0.0/wpsExecute_response.xsd'
         doc.attrib['service'] = 'WPS'
@@ -144,31 +283,35 @@ class WPSResponse(object):
         process_doc.attrib['{http://www.opengis.net/wps/1.0.0}processVersion'] = self.process.version
 
         doc.append(process_doc)
+        return doc
+
+    def _construct_status(self):
+        """Construct the Status element
+        """
 
-        # Status XML
         # return the correct response depending on the progress of the process
         if self.status >= self.STORE_AND_UPDATE_STATUS:
             if self.status_percentage == 0:
                 self.message = 'PyWPS Process %s accepted' % self.process.identifier
-                status_doc = self._process_accepted()
-                doc.append(status_doc)
-                self.write_response_doc(doc)
-                return doc
+                return self._process_accepted()
             elif 0 < self.status_percentage < 100:
-                status_doc = self._process_started()
-                doc.append(status_doc)
-                return doc
+                return self._process_started()
 
         # check if process failed and display fail message
         if self.status_percentage == -1:
-            status_doc = self._process_failed()
-            doc.append(status_doc)
-            return doc
+            return self._process_failed()
 
         # TODO: add paused status
 
-        status_doc = self._process_succeeded()
-        doc.append(status_doc)
+        return self._process_succeeded()
+
+    def _construct_doc(self):
+        doc = self._construct_skeleton()
+
+        # Status XML
+        doc.append(self._construct_status())
+        if self._get_state()[1] != 'succeeded':
+            return doc
 
         # DataInputs and DataOutputs definition XML if lineage=true
         if self.wps_request.lineage == 'true':
@@ -199,7 +342,9 @@ class WPSResponse(object):
         except Exception as exp:
             raise NoApplicableCode(exp)
 
-        if self.status >= self.DONE_STATUS:
+        # status of asynchronous request is written by Process and the job,
+        # which cleans its working directory too
+        if self.status != self.STORE_AND_UPDATE_STATUS:
             self.process.clean()
 
         return xml_response(doc)
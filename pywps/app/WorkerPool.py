@@ -0,0 +1,204 @@
+"""
+Pool of pre-forked worker processes running asynchronous Execute requests
+"""
+
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import weakref
+
+from pywps import dblog, scheduler
+from pywps.app.WPSRequest import WPSRequest
+
+LOGGER = logging.getLogger('PYWPS')
+
+# started pools, stopped at exit, stopped pools are not kept alive by the
+# exit handler
+_STARTED = weakref.WeakSet()
+
+
+def _stop_started():
+    for pool in list(_STARTED):
+        pool.stop()
+
+atexit.register(_stop_started)
+
+
+class WorkerPool(object):
+    """Fixed number of worker processes taking jobs from a common queue
+
+    Workers are forked from the service process, so they start with the
+    process modules already imported. Worker is replaced by a new one after
+    it ran given number of jobs or when its memory grows over given limit.
+
+    :param processes: dict of :class:`~Process` objects by identifier
+    :param size: number of worker processes
+    :param max_jobs: replace worker after given number of jobs, 0 never
+    :param max_rss: replace worker when its resident memory exceeds given
+                    number of bytes, 0 never
+    """
+
+    def __init__(self, processes, size, max_jobs=0, max_rss=0):
+        self.processes = processes
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self._queue = multiprocessing.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._supervisor = None
+
+    def start(self):
+        """Fork the worker processes
+        """
+
+        LOGGER.info('Starting %i worker processes', self.size)
+        with self._lock:
+            while len(self._workers) < self.size:
+                self._workers.append(self._spawn())
+
+        self._supervisor = threading.Thread(target=self._supervise,
+                                            name='pywps-worker-supervisor')
+        self._supervisor.daemon = True
+        self._supervisor.start()
+        _STARTED.add(self)
+
+    def submit(self, process, wps_request):
+        """Queue the request for execution by given process
+
+        :param process: :class:`~Process` with uuid and workdir of the request set
+        :param wps_request: :class:`~WPSRequest` with parsed inputs
+        """
+
+        # serialize here, errors in the queue feeder thread would be lost
+        job = (process.identifier, wps_request.json, str(process.uuid), process.workdir)
+        self._queue.put(job)
+
+    def stop(self, timeout=None):
+        """Let workers finish the queued jobs and exit
+
+        :param timeout: seconds to wait for every worker
+        """
+
+        if self._stopping.is_set():
+            return
+
+        LOGGER.info('Stopping worker processes')
+        self._stopping.set()
+        _STARTED.discard(self)
+        with self._lock:
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join(timeout)
+            self._workers = []
+
+    def _spawn(self):
+        worker = multiprocessing.Process(
+            target=_work,
+            args=(self.processes, self._queue, self.max_jobs, self.max_rss),
+            name='pywps-worker'
+        )
+        worker.daemon = True
+        worker.start()
+        LOGGER.debug('Worker process %s started', worker.pid)
+        return worker
+
+    def _supervise(self):
+        """Reap exited workers and replace them with new ones
+        """
+
+        while not self._stopping.wait(1):
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                for (index, worker) in enumerate(self._workers):
+                    if not worker.is_alive():
+                        worker.join()
+                        LOGGER.debug('Worker process %s exited with %s', worker.pid, worker.exitcode)
+                        self._workers[index] = self._spawn()
+
+
+def _work(processes, queue, max_jobs, max_rss):
+    """Main loop of the worker process
+
+    Worker, which finished a job, takes the oldest stored request first, so
+    the freed capacity is not left unused until the service dispatches it.
+    """
+
+    jobs = 0
+    while True:
+        job = jobs and _claim_stored() or queue.get()
+        if job is None:
+            break
+
+        try:
+            _run_job(processes, *job)
+        except Exception as e:
+            LOGGER.exception('Asynchronous job %s failed: %s', job[2], e)
+
+        jobs += 1
+        if max_jobs and jobs >= max_jobs:
+            LOGGER.debug('Worker %s ran %i jobs, exiting', os.getpid(), jobs)
+            break
+        if max_rss and _get_rss() > max_rss:
+            LOGGER.debug('Worker %s exceeded memory limit, exiting', os.getpid())
+            break
+
+    # worker exits without running atexit handlers
+    dblog.shutdown()
+
+
+def _run_job(processes, identifier, request_json, uuid, workdir):
+    """Restore the request and run it
+    """
+
+    process = None
+    lease = scheduler.hold_lease(uuid)
+    try:
+        process = processes[identifier].new_instance()
+
+        wps_request = WPSRequest()
+        wps_request.json = json.loads(request_json)
+
+        wps_response = process._restore_request(wps_request, uuid, workdir)
+        # the worker runs one request at a time, it may change its directory
+        os.chdir(workdir)
+        process._run_process(wps_request, wps_response)
+    finally:
+        lease.set()
+        if process is not None:
+            process.clean()
+        dblog.remove_stored(uuid)
+
+
+def _claim_stored():
+    """Lease the stored request, which should run next, if there is free slot
+
+    :returns: job tuple or None
+    """
+
+    stored = scheduler.claim_next()
+    if stored is None:
+        return None
+
+    (uuid, identifier, workdir, request_json) = stored
+    LOGGER.debug('Worker %s took stored request %s', os.getpid(), uuid)
+    return (identifier, request_json, uuid, workdir)
+
+
+def _get_rss():
+    """Return resident memory of this process in bytes
+    """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # peak resident memory, kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import lxml
 from werkzeug.wrappers import Response
@@ -13,9 +14,96 @@ def xml_response(doc):
     """XML response serializer"""
 
     LOGGER.debug('Serializing XML response')
+    return xml_bytes_response(xml_serialize(doc))
+
+
+def xml_serialize(doc):
+    """Serialize XML document to the bytes sent to the client"""
+
     pywps_version_comment = '<!-- PyWPS %s -->\n' % __version__
     xml = lxml.etree.tostring(doc, pretty_print=True)
-    response = Response(pywps_version_comment.encode('utf8') + xml,
-                        content_type='text/xml')
-    response.status_percentage = 100;
+    return pywps_version_comment.encode('utf8') + xml
+
+
+def xml_bytes_response(xml, etag=None, etags=None):
+    """Response with already serialized XML document
+
+    :param xml: serialized document, see :func:`xml_serialize`
+    :param etag: strong entity tag of the document
+    :param etags: :class:`werkzeug.datastructures.ETags` from the
+                  If-None-Match request header, if matching, response is
+                  empty 304 Not Modified
+    """
+
+    return bytes_response(xml, 'text/xml', etag, etags)
+
+
+def bytes_response(data, content_type, etag=None, etags=None):
+    """Response with already serialized document, see
+    :func:`xml_bytes_response`
+    """
+
+    if etag and etags is not None and etags.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(data, content_type=content_type)
+
+    if etag:
+        response.set_etag(etag)
+
+    response.status_percentage = 100
     return response
+
+
+def xml_fragment(element, parent):
+    """Serialize element exactly as it appears being the child of the
+    pretty-printed parent document, so the fragments can be joined with
+    :func:`xml_join` later on
+
+    :param element: element to be serialized
+    :param parent: empty element with the namespaces of the target document
+    """
+
+    parent.append(element)
+    xml = lxml.etree.tostring(parent, pretty_print=True)
+    return xml[xml.index(b'>') + 2:xml.rindex(b'</')]
+
+
+def xml_join(parent, fragments):
+    """Serialize parent document with given serialized children, see
+    :func:`xml_fragment`
+
+    :param parent: root element of the document, without children
+    :param fragments: list of serialized children
+    """
+
+    if not fragments:
+        return xml_serialize(parent)
+
+    pywps_version_comment = '<!-- PyWPS %s -->\n' % __version__
+    (head, tail) = xml_template(parent)
+    return pywps_version_comment.encode('utf8') + head + b''.join(fragments) + tail
+
+
+def xml_template(parent):
+    """Serialize parent document into head, with the children parent already
+    has, and tail, new children serialized by :func:`xml_fragment` go in
+    between
+
+    :param parent: root element of the document
+    :returns: (head, tail) bytes
+    """
+
+    placeholder = lxml.etree.SubElement(parent, 'placeholder')
+    xml = lxml.etree.tostring(parent, pretty_print=True)
+    parent.remove(placeholder)
+
+    start = xml.rindex(b'<placeholder/>')
+    head = xml[:xml.rindex(b'\n', 0, start) + 1]
+    return (head, xml[xml.index(b'\n', start) + 1:])
+
+
+def get_etag(data):
+    """Compute strong entity tag of given bytes"""
+
+    return hashlib.sha1(data).hexdigest()
@@ -40,6 +40,7 @@ else:
 
 
 config = None
+generation = 0
 LOGGER = logging.getLogger("PYWPS")
 
 
@@ -71,6 +72,38 @@ def get_config_value(section, option):
     return value
 
 
+def get_config_section(section):
+    """Get all options of given section in configuration files
+
+    :param section: section in configuration files
+    :type section: string
+    :returns: option names (lower case) and values
+    :rtype: dict
+    """
+
+    if not config:
+        load_configuration()
+
+    if not config.has_section(section):
+        return {}
+
+    return dict(config.items(section))
+
+
+def get_generation():
+    """Get number of the currently loaded configuration, it is increased
+    every time configuration files are (re)loaded
+
+    :returns: configuration generation
+    :rtype: int
+    """
+
+    if not config:
+        load_configuration()
+
+    return generation
+
+
 def load_configuration(cfgfiles=None):
     """Load PyWPS configuration from configuration files.
     The later configuration file in the array overwrites configuration
@@ -80,6 +113,7 @@ def load_configuration(cfgfiles=None):
     """
 
     global config
+    global generation
 
     LOGGER.info('loading configuration')
     if PY2:
@@ -95,15 +129,77 @@ def load_configuration(cfgfiles=None):
     config.set('server', 'maxprocesses', '30')
     config.set('server', 'maxsingleinputsize', '1mb')
     config.set('server', 'maxrequestsize', '3mb')
+    config.set('server', 'fetch_threads', '4')
+    config.set('server', 'fetch_perhost', '2')
+    config.set('server', 'fetch_timeout', '600')
+    config.set('server', 'cache_path', '')
+    config.set('server', 'cache_maxsize', '1024mb')
     config.set('server', 'temp_path', tempfile.gettempdir())
     config.set('server', 'processes_path', '')
     outputpath = tempfile.gettempdir()
     config.set('server', 'outputurl', 'file:///%s' % outputpath)
     config.set('server', 'outputpath', outputpath)
+    config.set('server', 'outputlayout', 'flat')
+    config.set('server', 'storage', 'file')
+    config.set('server', 'storage_mode', 'link')
     config.set('server', 'logfile', '')
     config.set('server', 'loglevel', 'INFO')
     config.set('server', 'workdir',  tempfile.gettempdir())
+    config.set('server', 'workdir_pool', '0')
+    config.set('server', 'workdir_pool_path', '')
     config.set('server', 'parallelprocesses', '2')
+    config.set('server', 'workerpool', 'true')
+    config.set('server', 'workerpool_maxjobs', '100')
+    config.set('server', 'workerpool_maxrss', '0')
+    config.set('server', 'queue_leasetime', '3600')
+    config.set('server', 'queue_pollinterval', '1')
+    config.set('server', 'status_interval', '1000')
+    config.set('server', 'jobstate', 'shared')
+    config.set('server', 'jobstate_ttl', '3600')
+    config.set('server', 'jobstate_maxwait', '30')
+    config.set('server', 'jobstate_keepalive', '15')
+    config.set('server', 'logdatabase', '')
+    config.set('server', 'logdatabase_synchronous', 'NORMAL')
+    config.set('server', 'logdatabase_writebehind', 'true')
+    config.set('server', 'logdatabase_flushsize', '100')
+    config.set('server', 'logdatabase_flushinterval', '0.5')
+    config.set('server', 'logretention_days', '30')
+    config.set('server', 'logretention_batchsize', '1000')
+    config.set('server', 'logretention_archive', 'table')
+
+    config.add_section('scheduler')
+    config.set('scheduler', 'sync_reserved', '0')
+    config.set('scheduler', 'owner_header', '')
+
+    config.add_section('quota')
+    config.set('quota', 'total', '0')
+    config.set('quota', 'user', '0')
+    config.set('quota', 'reservation_timeout', '3600')
+
+    config.add_section('expiry')
+    config.set('expiry', 'ttl', '0')
+    config.set('expiry', 'batchsize', '500')
+    config.set('expiry', 'pause', '1')
+    config.set('expiry', 'interval', '3600')
+    config.set('expiry', 'maxruntime', '86400')
+
+    config.add_section('http')
+    config.set('http', 'poolsize', '4')
+    config.set('http', 'keepalive', '30')
+    config.set('http', 'timeout', '30')
+    config.set('http', 'retries', '3')
+    config.set('http', 'backoff', '0.5')
+
+    config.add_section('s3')
+    config.set('s3', 'endpoint', '')
+    config.set('s3', 'bucket', '')
+    config.set('s3', 'region', 'us-east-1')
+    config.set('s3', 'access_key', '')
+    config.set('s3', 'secret_key', '')
+    config.set('s3', 'prefix', '')
+    config.set('s3', 'url', '')
+    config.set('s3', 'part_size', '8mb')
+    config.set('s3', 'upload_threads', '4')
 
     config.add_section('metadata:main')
     config.set('metadata:main', 'identification_title', 'PyWPS Processing Service')
@@ -144,6 +240,7 @@ def load_configuration(cfgfiles=None):
     else:
         LOGGER.info('No configuration files loaded. Using default values')
 
+    generation += 1
     _check_config()
 
 def _check_config():
@@ -10,21 +10,112 @@ import datetime
 import pickle
 import json
 import os
+import threading
+import atexit
+import time
+import binascii
 
 LOGGER = logging.getLogger('PYWPS')
+
+# connection shared by all threads, used for in-memory database only
 _CONNECTION = None
+# connections to database file, one per thread (and worker process)
+_LOCAL = threading.local()
+# (pid, database) pairs, where the table schema was already checked
+_CHECKED = set()
+_LOCK = threading.Lock()
+# name of the database file in server->workdir, if server->logdatabase is
+# not set
+DEFAULT_DATABASE = 'pywps-log.sqlite'
+# size of the per-connection cache of prepared statements, all statements of
+# this module are constant strings and are prepared only once per connection
+CACHED_STATEMENTS = 32
+
+# schema migrations, item N upgrades the database from version N to N + 1
+_MIGRATIONS = [
+    [
+        'CREATE INDEX IF NOT EXISTS pywps_requests_percent_done ON pywps_requests(percent_done)',
+        'CREATE INDEX IF NOT EXISTS pywps_requests_status ON pywps_requests(status)',
+        'CREATE INDEX IF NOT EXISTS pywps_requests_time_start ON pywps_requests(time_start)'
+    ],
+    [
+        """
+            CREATE TABLE IF NOT EXISTS pywps_requests_archive(
+                uuid VARCHAR(255) not null primary key,
+                pid INTEGER not null,
+                operation varchar(30) not null,
+                version varchar(5) not null,
+                time_start text not null,
+                time_end text,
+                identifier text,
+                message text,
+                percent_done float,
+                status varchar(30)
+            )
+        """
+    ],
+    [
+        'ALTER TABLE pywps_stored_requests ADD COLUMN identifier text',
+        'ALTER TABLE pywps_stored_requests ADD COLUMN workdir text',
+        'ALTER TABLE pywps_stored_requests ADD COLUMN queued float',
+        'ALTER TABLE pywps_stored_requests ADD COLUMN lease_owner varchar(255)',
+        'ALTER TABLE pywps_stored_requests ADD COLUMN lease_expires float',
+        'UPDATE pywps_stored_requests SET queued = 0',
+        'CREATE INDEX IF NOT EXISTS pywps_stored_requests_queued ON pywps_stored_requests(queued)'
+    ],
+    [
+        'ALTER TABLE pywps_requests ADD COLUMN owner varchar(255)',
+        'ALTER TABLE pywps_stored_requests ADD COLUMN owner varchar(255)'
+    ],
+    [
+        """
+            CREATE TABLE IF NOT EXISTS pywps_outputs(
+                id INTEGER primary key,
+                uuid varchar(255),
+                owner varchar(255),
+                path text,
+                size INTEGER not null,
+                reserved INTEGER not null,
+                created float not null
+            )
+        """,
+        'CREATE INDEX IF NOT EXISTS pywps_outputs_owner ON pywps_outputs(owner)',
+        'CREATE INDEX IF NOT EXISTS pywps_outputs_created ON pywps_outputs(created)'
+    ],
+    [
+        'ALTER TABLE pywps_outputs ADD COLUMN deleted float',
+        'CREATE INDEX IF NOT EXISTS pywps_outputs_path ON pywps_outputs(path)'
+    ]
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+# status of finished request, WPSResponse.DONE_STATUS
+DONE_STATUS = 3
+
+# write-behind queue of (statement, parameters) not yet written to database
+_QUEUE = []
+_QUEUE_PID = os.getpid()
+_QUEUE_CONDITION = threading.Condition()
+# (pid, thread) of the background writer flushing _QUEUE
+_WRITER = None
+_STOPPING = False
+# serializes flushing of the queue
+_FLUSH_LOCK = threading.Lock()
+# serializes transactions of the threads of this process, the threads
+# share one connection to the in-memory database
+_WRITE_LOCK = threading.RLock()
+# server->logdatabase :memory: was reported
+_MEMORY_WARNED = False
 
 def log_request(uuid, request):
     """Write OGC WPS request (only the necessary parts) to database logging
     system
     """
 
-    conn = get_connection()
     insert = """
         INSERT INTO
-            pywps_requests (uuid, pid, operation, version, time_start, identifier)
+            pywps_requests (uuid, pid, operation, version, time_start, identifier, owner)
         VALUES
-            (?, ?, ?, ?, ?, ?)
+            (?, ?, ?, ?, ?, ?, ?)
     """
 
     pid = os.getpid()
@@ -32,18 +123,17 @@ def log_request(uuid, request):
     version = request.version
     time_start = datetime.datetime.now().isoformat()
     identifier = _get_identifier(request)
+    owner = getattr(request, 'owner', None)
 
     #LOGGER.debug(str((insert, str(uuid), pid, operation, version, time_start, identifier)))
 
-    cur = conn.cursor()
-    cur.execute(insert, (str(uuid), pid, operation, version, time_start, identifier))
-    conn.commit()
-    close_connection()
+    _write(insert, (str(uuid), pid, operation, version, time_start, identifier, owner))
 
 def get_running():
     """Returns running processes ids
     """
 
+    _flush_pending()
     conn = get_connection()
     cur = conn.cursor()
 
@@ -52,10 +142,66 @@ def get_running():
     return res.fetchall()
 
 
+def count_running():
+    """Returns number of running processes
+
+    Failed processes (percent_done -1) are not counted as running
+    """
+
+    return sum(count for (_, _, count) in get_running_counts())
+
+
+def get_running_counts():
+    """Returns numbers of running processes by process identifier and owner
+
+    Stored requests waiting in the queue are accepted (0 %), but not running
+
+    :returns: list of (identifier, owner, count)
+    """
+
+    _flush_pending()
+    conn = get_connection()
+    cur = conn.cursor()
+
+    res = cur.execute("""
+        SELECT
+            identifier, owner, COUNT(*)
+        FROM
+            pywps_requests
+        WHERE
+            percent_done >= 0 AND percent_done < 100 AND uuid NOT IN (
+                SELECT
+                    uuid
+                FROM
+                    pywps_stored_requests
+                WHERE
+                    lease_expires IS NULL OR lease_expires < ?
+            )
+        GROUP BY
+            identifier, owner
+    """, (time.time(),))
+
+    return res.fetchall()
+
+
+def count_stored():
+    """Returns number of stored requests
+    """
+
+    _flush_pending()
+    conn = get_connection()
+    cur = conn.cursor()
+
+    res = cur.execute('SELECT COUNT(*) FROM pywps_stored_requests')
+
+    return res.fetchone()[0]
+
+
 def get_stored():
     """Returns running processes ids
     """
 
+    _flush_pending()
     conn = get_connection()
     cur = conn.cursor()
 
@@ -67,20 +213,119 @@ def get_first_stored():
     """Returns running processes ids
     """
 
+    _flush_pending()
+    conn = get_connection()
+    cur = conn.cursor()
+
+    res = cur.execute('SELECT uuid,  request FROM pywps_stored_requests ORDER BY queued, rowid LIMIT 1')
+
+    return res.fetchall()
+
+
+def get_waiting():
+    """Returns stored requests, which are not leased, in the queue order
+
+    :returns: list of (uuid, identifier, owner)
+    """
+
+    _flush_pending()
     conn = get_connection()
     cur = conn.cursor()
 
-    res = cur.execute('SELECT uuid,  request FROM pywps_stored_requests LIMIT 1')
+    res = cur.execute("""
+        SELECT
+            uuid, identifier, owner
+        FROM
+            pywps_stored_requests
+        WHERE
+            lease_expires IS NULL OR lease_expires < ?
+        ORDER BY
+            queued, rowid
+    """, (time.time(),))
 
     return res.fetchall()
 
 
+def claim_stored(lease_time, uuid=None):
+    """Lease stored request, which is not leased yet or whose lease expired,
+    so that no other worker takes it. The request is removed by
+    :func:`remove_stored` once it is done, if the worker dies, the lease
+    expires and the request is taken by another worker.
+
+    :param lease_time: lease duration in seconds
+    :param uuid: request to be leased, default the oldest one
+    :returns: (uuid, identifier, workdir, request) or None if there is no
+              request to be leased
+    :raises sqlite3.OperationalError: database is locked by another worker
+    """
+
+    _flush_pending()
+    conn = get_connection()
+    cur = conn.cursor()
+
+    token = binascii.hexlify(os.urandom(16))
+    now = time.time()
+
+    # the statement is atomic, the row can not be leased by anybody else
+    # between the subquery and the update
+    claim = """
+        UPDATE
+            pywps_stored_requests
+        SET
+            lease_owner = ?, lease_expires = ?
+        WHERE
+            (lease_expires IS NULL OR lease_expires < ?) AND uuid = %s
+    """
+    if uuid is None:
+        claim = claim % """(
+                SELECT
+                    uuid
+                FROM
+                    pywps_stored_requests
+                WHERE
+                    lease_expires IS NULL OR lease_expires < ?
+                ORDER BY
+                    queued, rowid
+                LIMIT 1
+            )"""
+        params = (token, now + lease_time, now, now)
+    else:
+        claim = claim % '?'
+        params = (token, now + lease_time, now, str(uuid))
+
+    with _WRITE_LOCK:
+        try:
+            cur.execute(claim, params)
+            conn.commit()
+        except sqlite3.OperationalError:
+            conn.rollback()
+            raise
+
+    if not cur.rowcount:
+        return None
+
+    res = cur.execute("""
+        SELECT
+            uuid, identifier, workdir, request
+        FROM
+            pywps_stored_requests
+        WHERE
+            lease_owner = ?
+    """, (token,))
+
+    return res.fetchone()
+
 
 def update_response(uuid, response, close=False):
     """Writes response to database
+
+    Row of finished request (percent_done 100 or -1, or done status) is not
+    replaced, the response of the service may be logged after the job
+    finished.
+
+    :param close: kept for backward compatibility, connections stay open
     """
 
-    conn = get_connection()
     message = 'Null'
     status_percentage = 'Null'
     status = 'Null'
@@ -92,6 +337,8 @@ def update_response(uuid, response, close=False):
     if hasattr(response, 'status'):
         status = response.status
 
+    # updates are written behind by several processes, do not let an older
+    # one overwrite a newer one
     update = """
         UPDATE
             pywps_requests
@@ -100,17 +347,187 @@ def update_response(uuid, response, close=False):
             time_end = ?, message=?,
             percent_done = ?, status=?
         WHERE
-            uuid = ?
+            uuid = ? AND (time_end IS NULL OR time_end <= ?) AND
+            COALESCE(percent_done, 0) NOT IN (100, -1) AND COALESCE(status, '') <> ?
     """
 
     pid = os.getpid()
     time_end = datetime.datetime.now().isoformat()
 
     #LOGGER.debug(update % (pid, time_end, message, status_percentage, status, uuid))
-    cur = conn.cursor()
-    cur.execute(update, (pid, time_end, message, status_percentage, status, str(uuid)))
-    conn.commit()
-    close_connection()
+    _write(update, (pid, time_end, message, status_percentage, status, str(uuid), time_end,
+                    str(DONE_STATUS)))
+
+
+def renew_lease(uuid, lease_time):
+    """Extend lease of stored request taken by :func:`claim_stored`
+
+    :param lease_time: lease duration in seconds from now
+    :returns: False if the request is not leased
+    """
+
+    conn = get_connection()
+    renew = """
+        UPDATE
+            pywps_stored_requests
+        SET
+            lease_expires = ?
+        WHERE
+            uuid = ? AND lease_owner IS NOT NULL
+    """
+    with _WRITE_LOCK:
+        cur = conn.execute(renew, (time.time() + lease_time, str(uuid)))
+        conn.commit()
+    return cur.rowcount > 0
+
+
+def _write(statement, parameters):
+    """Execute given write statement, either immediately or, with write-behind
+    enabled, queue it for the background writer
+    """
+
+    if not configuration.get_config_value('server', 'logdatabase_writebehind'):
+        conn = get_connection()
+        with _WRITE_LOCK:
+            conn.execute(statement, parameters)
+            conn.commit()
+        return
+
+    _check_fork()
+    _start_writer()
+
+    with _QUEUE_CONDITION:
+        _QUEUE.append((statement, parameters))
+        if len(_QUEUE) >= _get_flush_size():
+            _QUEUE_CONDITION.notify()
+
+
+def flush():
+    """Write all queued statements to the database in one transaction
+    """
+
+    global _QUEUE
+
+    _check_fork()
+
+    with _FLUSH_LOCK:
+        with _QUEUE_CONDITION:
+            (batch, _QUEUE) = (_QUEUE, [])
+
+        if not batch:
+            return
+
+        LOGGER.debug('Writing %i queued statements to database', len(batch))
+        conn = get_connection()
+        with _WRITE_LOCK:
+            cur = conn.cursor()
+            try:
+                for (statement, parameters) in batch:
+                    cur.execute(statement, parameters)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                LOGGER.warning('Writing queued statements failed: %s, writing one by one', e)
+                for (statement, parameters) in batch:
+                    try:
+                        cur.execute(statement, parameters)
+                        conn.commit()
+                    except sqlite3.Error as e:
+                        conn.rollback()
+                        LOGGER.error('Writing queued statement to database failed: %s', e)
+
+
+def shutdown():
+    """Stop the background writer and write remaining queued statements
+    """
+
+    global _STOPPING, _WRITER
+
+    writer = _WRITER
+    if writer is not None and writer[0] == os.getpid():
+        with _QUEUE_CONDITION:
+            _STOPPING = True
+            _QUEUE_CONDITION.notify()
+        writer[1].join()
+        _WRITER = None
+        _STOPPING = False
+
+    flush()
+
+
+def _flush_pending():
+    """Make queued statements visible before reading from the database
+    """
+
+    if _QUEUE and _QUEUE_PID == os.getpid():
+        flush()
+
+
+def _start_writer():
+    """Start background writer thread in this process, if not running yet
+    """
+
+    global _WRITER
+
+    pid = os.getpid()
+    if _WRITER is not None and _WRITER[0] == pid:
+        return
+
+    with _QUEUE_CONDITION:
+        if _WRITER is not None and _WRITER[0] == pid:
+            return
+
+        thread = threading.Thread(target=_writer_loop, name='pywps-dblog-writer')
+        thread.daemon = True
+        thread.start()
+        _WRITER = (pid, thread)
+
+
+def _check_fork():
+    """Drop the queue and locks inherited from the parent process, the
+    queued statements are written by the parent
+    """
+
+    global _QUEUE, _QUEUE_PID, _QUEUE_CONDITION, _FLUSH_LOCK, _WRITE_LOCK, _WRITER
+
+    pid = os.getpid()
+    if _QUEUE_PID != pid:
+        _QUEUE = []
+        _QUEUE_CONDITION = threading.Condition()
+        _FLUSH_LOCK = threading.Lock()
+        _WRITE_LOCK = threading.RLock()
+        _WRITER = None
+        _QUEUE_PID = pid
+
+
+def _writer_loop():
+    """Flush the queue when it is full or when the flush interval elapsed
+    """
+
+    interval = _get_flush_interval()
+    size = _get_flush_size()
+
+    while True:
+        with _QUEUE_CONDITION:
+            if not _STOPPING and len(_QUEUE) < size:
+                _QUEUE_CONDITION.wait(interval)
+            stopping = _STOPPING
+
+        flush()
+
+        if stopping:
+            return
+
+
+def _get_flush_size():
+    return int(configuration.get_config_value('server', 'logdatabase_flushsize'))
+
+
+def _get_flush_interval():
+    return float(configuration.get_config_value('server', 'logdatabase_flushinterval'))
+
+
+atexit.register(shutdown)
 
 
 def _get_identifier(request):
@@ -127,34 +544,97 @@ def _get_identifier(request):
     else:
         return 'NULL'
 
+def get_database():
+    """Return path of the database file, server->logdatabase
+
+    Database file in server->workdir is used by default, so the service and
+    its worker processes share the state of the requests. In-memory
+    database is kept by every process separately, it is suitable for
+    services running synchronous requests only.
+    """
+
+    global _MEMORY_WARNED
+
+    database = configuration.get_config_value('server', 'logdatabase')
+    if not database:
+        return os.path.join(configuration.get_config_value('server', 'workdir'), DEFAULT_DATABASE)
+
+    if database == ':memory:' and not _MEMORY_WARNED:
+        _MEMORY_WARNED = True
+        LOGGER.warning('Request log in memory is not shared by worker processes, asynchronous '
+                       'requests, request queue, quotas and expiry of outputs need database file')
+    return database
+
+
 def get_connection():
     """Get Connection for database
+
+    Connections are opened once per thread and worker process and reused
+    afterwards, the table schema is checked once per process only.
     """
 
-    LOGGER.debug('Initializing database connection')
     global _CONNECTION
 
-    if _CONNECTION:
-        return _CONNECTION
+    database = get_database()
+    pid = os.getpid()
+    # locks held by other threads at fork are never released in the child
+    _check_fork()
+
+    if database == ':memory:':
+        # every connection would get its own in-memory database, share one
+        with _LOCK:
+            if _CONNECTION is None or _CONNECTION[0] != pid:
+                LOGGER.debug('Initializing database connection')
+                connection = sqlite3.connect(database, check_same_thread=False)
+                _check_schema(connection, database, pid)
+                _CONNECTION = (pid, connection)
+        return _CONNECTION[1]
+
+    connection = getattr(_LOCAL, 'connection', None)
+    if connection is not None and _LOCAL.key == (pid, database):
+        return connection
 
-    database = configuration.get_config_value('server', 'logdatabase')
+    LOGGER.debug('Initializing database connection')
+    connection = sqlite3.connect(database, cached_statements=CACHED_STATEMENTS)
+    # let retention give free pages back in small steps, takes effect for
+    # new databases only, so it has to precede anything writing to the file
+    connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=%s' % _get_synchronous())
+    with _LOCK:
+        _check_schema(connection, database, pid)
+
+    _LOCAL.connection = connection
+    _LOCAL.key = (pid, database)
+    return connection
+
+
+def _get_synchronous():
+    """Get the PRAGMA synchronous value from configuration
+    """
 
-    if not database:
-        database = ':memory:'
+    synchronous = str(configuration.get_config_value('server', 'logdatabase_synchronous')).upper()
+    if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        LOGGER.warning('Invalid server->logdatabase_synchronous value %s, using NORMAL', synchronous)
+        synchronous = 'NORMAL'
+    return synchronous
+
+
+def _check_schema(connection, database, pid):
+    """Check the tables in the database or create them, once per process
+    """
+
+    if (pid, database) in _CHECKED:
+        return
 
-    connection = sqlite3.connect(database)
     if check_db_table(connection):
-        if check_db_columns(connection):
-            _CONNECTION = connection
-        else:
+        if not check_db_columns(connection):
             raise NoApplicableCode("""
                 Columns in the table 'pywps_requests' or 'pywps_stored_requests' in database '%s' are in
                 conflict
             """ % database)
-
     else:
-        _CONNECTION = sqlite3.connect(database, check_same_thread=False)
-        cursor = _CONNECTION.cursor()
+        cursor = connection.cursor()
         createsql = """
             CREATE TABLE pywps_requests(
                 uuid VARCHAR(255) not null primary key,
@@ -178,9 +658,31 @@ def get_connection():
             )
             """
         cursor.execute(createsql)
-        _CONNECTION.commit()
+        connection.commit()
+
+    _migrate(connection)
+
+    if database != ':memory:':
+        _CHECKED.add((pid, database))
+
+
+def _migrate(connection):
+    """Upgrade database schema to SCHEMA_VERSION, the version of the
+    database is kept in PRAGMA user_version
+    """
 
-    return _CONNECTION
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+
+    if version > SCHEMA_VERSION:
+        LOGGER.warning('Database schema version %i is newer than %i', version, SCHEMA_VERSION)
+        return
+
+    for (number, statements) in enumerate(_MIGRATIONS[version:], version + 1):
+        LOGGER.info('Migrating database schema to version %i', number)
+        for statement in statements:
+            connection.execute(statement)
+        connection.execute('PRAGMA user_version = %i' % number)
+        connection.commit()
 
 def check_db_table(connection):
     """Check for existing pywps_requests table in the datase
@@ -209,7 +711,8 @@ def check_db_table(connection):
 def check_db_columns(connection):
     """Simple check for existing columns in given database
 
-    we will make just simple check, this is not django
+    we will make just simple check, this is not django, columns added by
+    schema migrations are allowed
 
     :return: all needed columns found
     :rtype: boolean
@@ -223,10 +726,7 @@ def check_db_columns(connection):
         for column in metas:
             columns.append(column[1])
 
-        needed_columns.sort()
-        columns.sort()
-
-        if columns == needed_columns:
+        if set(needed_columns) <= set(columns):
             return True
         else:
             return False
@@ -243,29 +743,35 @@ def check_db_columns(connection):
     return pywps_requests and pywps_stored_requests
 
 def close_connection():
-    """close connection"""
+    """close connection of the current thread"""
     LOGGER.debug('Closing DB connection')
     global _CONNECTION
-    if _CONNECTION:
-        _CONNECTION.close()
-    _CONNECTION = None
-
-def store_process(uuid, request):
+    connection = getattr(_LOCAL, 'connection', None)
+    if connection is not None:
+        connection.close()
+        _LOCAL.connection = None
+    elif _CONNECTION is not None:
+        _CONNECTION[1].close()
+        _CONNECTION = None
+
+def store_process(uuid, request, workdir=None):
     """Save given request under given UUID for later usage
+
+    :param workdir: working directory of the request
     """
 
     conn = get_connection()
     insert = """
         INSERT INTO
-            pywps_stored_requests (uuid, request)
+            pywps_stored_requests (uuid, request, identifier, workdir, queued, owner)
         VALUES
-            (?, ?)
+            (?, ?, ?, ?, ?, ?)
     """
 
-    cur = conn.cursor()
-    cur.execute(insert, (str(uuid), request.json))
-    conn.commit()
-    close_connection()
+    with _WRITE_LOCK:
+        conn.execute(insert, (str(uuid), request.json, getattr(request, 'identifier', None),
+                              workdir, time.time(), getattr(request, 'owner', None)))
+        conn.commit()
 
 def remove_stored(uuid):
     """Remove given request from stored requests
@@ -277,7 +783,216 @@ def remove_stored(uuid):
             pywps_stored_requests
         WHERE uuid = ?
     """
-    cur = conn.cursor()
-    cur.execute(insert, (str(uuid)))
-    conn.commit()
-    close_connection()
+    with _WRITE_LOCK:
+        conn.execute(insert, (str(uuid),))
+        conn.commit()
+
+
+def reserve_output(size, owner=None, uuid=None, owner_quota=0, total_quota=0,
+                   free_space=None, expired=None):
+    """Reserve size bytes for output of given user, if the quotas and the
+    free space allow it
+
+    The check and the reservation are done in one transaction, concurrent
+    reservations of other processes wait for it. In-memory database counts
+    the outputs of this process only.
+
+    :param owner_quota: bytes of outputs of the owner, 0 unlimited
+    :param total_quota: bytes of outputs of all users, 0 unlimited
+    :param free_space: free bytes on the file system, reserved bytes, which
+                       are not written yet, are subtracted
+    :param expired: reservations not finished before this time are dropped
+    :returns: id of the reservation or None
+    """
+
+    # outputs recorded by write-behind count too
+    _flush_pending()
+    conn = get_connection()
+    with _WRITE_LOCK:
+        # in-memory database is not shared with other processes, the lock
+        # is enough
+        if _CONNECTION is None or _CONNECTION[1] is not conn:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            if expired is not None:
+                conn.execute('DELETE FROM pywps_outputs WHERE reserved = 1 AND created < ?',
+                             (expired,))
+
+            (total, owner_total, pending) = conn.execute("""
+                SELECT
+                    COALESCE(SUM(size), 0),
+                    COALESCE(SUM(CASE WHEN owner = ? THEN size ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN reserved = 1 THEN size ELSE 0 END), 0)
+                FROM
+                    pywps_outputs
+                WHERE
+                    deleted IS NULL
+            """, (owner,)).fetchone()
+
+            if (total_quota and total + size > total_quota) or \
+                    (owner_quota and owner_total + size > owner_quota) or \
+                    (free_space is not None and pending + size > free_space):
+                conn.rollback()
+                return None
+
+            cur = conn.execute("""
+                INSERT INTO
+                    pywps_outputs (uuid, owner, size, reserved, created)
+                VALUES
+                    (?, ?, ?, 1, ?)
+            """, (uuid and str(uuid), owner, int(size), time.time()))
+            conn.commit()
+            return cur.lastrowid
+        except:
+            conn.rollback()
+            raise
+
+
+def finish_output(reservation, path, size):
+    """Record stored output in place of its reservation
+    """
+
+    conn = get_connection()
+    with _WRITE_LOCK:
+        conn.execute("""
+            UPDATE
+                pywps_outputs
+            SET
+                path = ?, size = ?, reserved = 0
+            WHERE
+                id = ?
+        """, (path, int(size), reservation))
+        conn.commit()
+
+
+def remove_output(reservation):
+    """Remove reservation or record of stored output
+    """
+
+    conn = get_connection()
+    with _WRITE_LOCK:
+        conn.execute('DELETE FROM pywps_outputs WHERE id = ?', (reservation,))
+        conn.commit()
+
+
+def get_output_usage(owner=None):
+    """Return bytes of stored and reserved outputs of given user or all users
+    """
+
+    _flush_pending()
+    conn = get_connection()
+    if owner is None:
+        res = conn.execute('SELECT COALESCE(SUM(size), 0) FROM pywps_outputs WHERE deleted IS NULL')
+    else:
+        res = conn.execute("""
+            SELECT COALESCE(SUM(size), 0) FROM pywps_outputs WHERE deleted IS NULL AND owner = ?
+        """, (owner,))
+    return res.fetchone()[0]
+
+
+def record_output(uuid, owner, path, size, created=None):
+    """Record file stored without reservation (status document)
+
+    :param created: time of creation, default now
+    """
+
+    _write("""
+        INSERT INTO
+            pywps_outputs (uuid, owner, path, size, reserved, created)
+        VALUES
+            (?, ?, ?, ?, 0, ?)
+    """, (uuid and str(uuid), owner, path, int(size), created or time.time()))
+
+
+def move_outputs(moves):
+    """Change paths of recorded files
+
+    :param moves: list of (old path, new path)
+    """
+
+    _flush_pending()
+    conn = get_connection()
+    with _WRITE_LOCK:
+        try:
+            conn.executemany('UPDATE pywps_outputs SET path = ? WHERE path = ?',
+                             [(new, old) for (old, new) in moves])
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+
+def is_output_recorded(path):
+    """Check if file with given path is recorded and not deleted
+    """
+
+    conn = get_connection()
+    res = conn.execute("""
+        SELECT 1 FROM pywps_outputs WHERE path = ? AND deleted IS NULL LIMIT 1
+    """, (path,))
+    return res.fetchone() is not None
+
+
+def get_expired_outputs(created, limit, started=None):
+    """Return recorded files created before given time, except files of
+    requests, which are waiting or running
+
+    :param created: time
+    :param limit: maximum number of files
+    :param started: time_start, requests logged as running, which started
+                    before, are taken as dead, default all are running
+    :returns: list of (id, uuid, path), oldest first
+    """
+
+    _flush_pending()
+    conn = get_connection()
+    res = conn.execute("""
+        SELECT
+            id, uuid, path
+        FROM
+            pywps_outputs
+        WHERE
+            deleted IS NULL AND reserved = 0 AND created < ? AND (
+                uuid IS NULL OR (
+                    uuid NOT IN (
+                        SELECT
+                            uuid
+                        FROM
+                            pywps_requests
+                        WHERE
+                            percent_done >= 0 AND percent_done < 100 AND time_start >= ?
+                    ) AND
+                    uuid NOT IN (SELECT uuid FROM pywps_stored_requests)
+                )
+            )
+        ORDER BY
+            created
+        LIMIT ?
+    """, (created, started or '', limit))
+    return res.fetchall()
+
+
+def mark_outputs_deleted(ids):
+    """Mark files as deleted, files marked by another process meanwhile are
+    left out
+
+    :param ids: ids of the records, see :func:`get_expired_outputs`
+    :returns: ids marked by this call
+    """
+
+    conn = get_connection()
+    now = time.time()
+    marked = []
+    with _WRITE_LOCK:
+        try:
+            for output_id in ids:
+                cur = conn.execute("""
+                    UPDATE pywps_outputs SET deleted = ? WHERE id = ? AND deleted IS NULL
+                """, (now, output_id))
+                if cur.rowcount:
+                    marked.append(output_id)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+    return marked
@@ -0,0 +1,237 @@
+"""
+Expiry of outputs and status documents in server->outputpath
+
+Stored outputs and status documents are recorded in the pywps_outputs
+table of the request log with the time they were created and the uuid of
+the request. Files older than the configured age are removed in batches
+of bounded size, deleted files stay in the table with the time of the
+deletion, until the request log retention removes them::
+
+    [expiry]
+    # seconds the files are kept, 0 keeps them forever
+    ttl = 604800
+    # number of files removed in one batch, seconds to sleep between batches
+    batchsize = 500
+    pause = 1
+    # seconds between runs in the service, 0 runs from command line only
+    interval = 3600
+    # seconds, after which request still logged as running is taken as
+    # dead and its files expire, 0 keeps them while it is logged as running
+    maxruntime = 86400
+
+Files of waiting and running requests are kept. Status documents and
+files in prefix directories of server->outputlayout stored before the
+files were recorded can be added by :func:`scan`. The files are recorded
+in the request log, so expiry needs server->logdatabase file (the
+default), the :memory: database of one process does not know files of the
+others. Can be run from command line::
+
+    python -m pywps.expiry --config pywps.cfg [--scan]
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+
+from pywps import configuration, dblog, layout
+
+LOGGER = logging.getLogger('PYWPS')
+
+# status documents are named by the request uuid
+STATUS_FILE = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.xml$')
+
+_THREAD = None
+_STOPPING = threading.Event()
+
+
+def collect(ttl=None, batch_size=None, pause=None, max_batches=None, max_runtime=None):
+    """Remove files older than ttl seconds
+
+    :param ttl: default expiry->ttl, 0 keeps the files
+    :param batch_size: default expiry->batchsize
+    :param pause: seconds to sleep between batches, default expiry->pause
+    :param max_batches: stop after given number of batches
+    :param max_runtime: seconds, files of requests logged as running longer
+                        expire too, default expiry->maxruntime
+    :returns: number of removed files
+    """
+
+    ttl = float(_get_option('ttl', ttl))
+    batch_size = int(_get_option('batchsize', batch_size))
+    pause = float(_get_option('pause', pause))
+    max_runtime = float(_get_option('maxruntime', max_runtime))
+    if ttl <= 0:
+        return 0
+
+    created = time.time() - ttl
+    # time_start of the request log is local time in ISO format
+    started = None
+    if max_runtime > 0:
+        started = datetime.datetime.fromtimestamp(time.time() - max_runtime).isoformat()
+    removed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        expired = dblog.get_expired_outputs(created, batch_size, started)
+        if not expired:
+            break
+
+        # another process may collect at the same time
+        marked = set(dblog.mark_outputs_deleted([output_id for (output_id, _, _) in expired]))
+        for (output_id, uuid, path) in expired:
+            if output_id in marked and _remove(path):
+                removed += 1
+                LOGGER.debug('Expired %s of request %s removed', path, uuid)
+
+        batches += 1
+        if len(expired) < batch_size or _STOPPING.is_set():
+            break
+        if pause:
+            _STOPPING.wait(pause)
+
+    if removed:
+        LOGGER.info('%i expired files removed from outputpath', removed)
+    return removed
+
+
+def scan(path=None, batch_size=None):
+    """Record status documents and files in prefix directories of
+    outputpath, which are not recorded yet, with their modification time as
+    time of creation
+
+    Other files directly in outputpath are not recorded, outputpath may be
+    shared with server->workdir and other temporary files, see
+    :func:`pywps.layout.walk`.
+
+    :param path: default server->outputpath
+    :returns: number of recorded files
+    """
+
+    if path is None:
+        path = configuration.get_config_value('server', 'outputpath')
+    batch_size = int(_get_option('batchsize', batch_size))
+    # outputs recorded by write-behind
+    dblog.flush()
+
+    recorded = 0
+    for (file_path, prefixed) in layout.walk(path):
+        match = STATUS_FILE.match(os.path.basename(file_path))
+        if not match and not prefixed:
+            continue
+        if dblog.is_output_recorded(file_path):
+            continue
+
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+
+        uuid = match.group(1) if match else None
+        dblog.record_output(uuid, None, file_path, stat.st_size, stat.st_mtime)
+        recorded += 1
+        if recorded % batch_size == 0:
+            dblog.flush()
+
+    dblog.flush()
+    LOGGER.info('%i files in %s recorded', recorded, path)
+    return recorded
+
+
+def start():
+    """Start thread collecting expired files every expiry->interval seconds,
+    if expiry is enabled
+    """
+
+    global _THREAD
+
+    interval = float(_get_option('interval'))
+    if _THREAD is not None or interval <= 0 or float(_get_option('ttl')) <= 0:
+        return
+
+    _check_database()
+    _STOPPING.clear()
+    _THREAD = threading.Thread(target=_collect_loop, args=(interval,), name='pywps-expiry')
+    _THREAD.daemon = True
+    _THREAD.start()
+
+
+def stop():
+    """Stop the collecting thread
+    """
+
+    global _THREAD
+
+    if _THREAD is not None:
+        _STOPPING.set()
+        _THREAD.join()
+        _THREAD = None
+
+
+def _collect_loop(interval):
+    while not _STOPPING.is_set():
+        try:
+            collect()
+        except Exception as e:
+            LOGGER.exception('Collecting expired files failed: %s', e)
+        _STOPPING.wait(interval)
+
+
+def _check_database():
+    if dblog.get_database() == ':memory:':
+        LOGGER.warning('Expiry of outputs needs server->logdatabase file, files stored by '
+                       'other processes are not removed')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError as e:
+        if os.path.exists(path):
+            LOGGER.warning('Removing expired %s failed: %s', path, e)
+        return False
+
+
+def _get_option(option, value=None):
+    if value is not None:
+        return value
+    return configuration.get_config_value('expiry', option)
+
+
+def main(argv=None):
+    """Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Remove expired outputs and status documents from the PyWPS outputpath')
+    parser.add_argument('-c', '--config', action='append',
+                        help='PyWPS configuration file, can be repeated')
+    parser.add_argument('-t', '--ttl', type=float,
+                        help='remove files older than given number of seconds')
+    parser.add_argument('-b', '--batch-size', type=int,
+                        help='number of files removed in one batch')
+    parser.add_argument('-m', '--max-batches', type=int,
+                        help='stop after given number of batches')
+    parser.add_argument('-p', '--pause', type=float,
+                        help='seconds to sleep between batches')
+    parser.add_argument('--scan', action='store_true',
+                        help='record files in outputpath, which are not recorded yet, first')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    configuration.load_configuration(args.config)
+    _check_database()
+
+    if args.scan:
+        print('%i files recorded' % scan(batch_size=args.batch_size))
+
+    removed = collect(ttl=args.ttl, batch_size=args.batch_size, pause=args.pause,
+                      max_batches=args.max_batches)
+    print('%i files removed' % removed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""
+Pooled HTTP client for reference inputs and object storage
+
+Connections are kept open (HTTP keep-alive) and reused by the next request
+to the same host, so many small references to one server do not pay for
+new TCP and TLS handshake each. Configuration::
+
+    [http]
+    # idle connections kept open to one host
+    poolsize = 4
+    # seconds idle connection is kept open
+    keepalive = 30
+    # socket timeout in seconds
+    timeout = 30
+    # failed idempotent requests are retried after backoff,
+    # 2 * backoff, ... seconds
+    retries = 3
+    backoff = 0.5
+
+    [http:poolsize]
+    # idle connections kept open to given host
+    demo.example.com = 16
+
+GET, HEAD, PUT and DELETE requests are retried, if the connection failed or
+the server answered 502, 503 or 504. URLs other than http and https are opened by urllib.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+
+import pywps
+from pywps import configuration
+from pywps._compat import PY2, text_type, http_client, urlparse, urljoin, \
+    urlopen as _urlopen, UrlRequest, HTTPError, getproxies, proxy_bypass
+
+LOGGER = logging.getLogger('PYWPS')
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+RETRY_CODES = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+# unread rest of the body smaller than this is read, so the connection
+# can be reused
+DRAIN_SIZE = 64 * 1024
+
+# (scheme, host:port) -> [(connection, released), ...]
+_POOLS = {}
+_LOCK = threading.Lock()
+_PID = os.getpid()
+
+
+def urlopen(url, data=None, headers=None, timeout=None, method=None):
+    """Open given URL, reuse pooled connection to its host
+
+    Redirects are followed.
+
+    :param url: URL
+    :param data: request body, string or seekable file-like object with
+                 Content-Length in the headers
+    :param headers: dict of additional request headers
+    :param timeout: seconds, default http->timeout. Retries are not started
+                    after the timeout.
+    :param method: default POST with data, GET without
+    :returns: :class:`Response`, body is not read yet
+    :raises HTTPError: server answered 304 Not Modified or with an error
+    """
+
+    if urlparse(url).scheme.lower() not in ('http', 'https'):
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        return _urlopen(UrlRequest(url, data=data, headers=headers or {}), **kwargs)
+
+    if timeout is None:
+        timeout = float(_get_option('timeout'))
+    deadline = time.time() + timeout
+
+    if method is None:
+        method = 'POST' if data is not None else 'GET'
+    if isinstance(data, text_type):
+        data = data.encode('utf-8')
+    headers = _get_headers(headers, data)
+
+    for _ in range(MAX_REDIRECTS + 1):
+        response = _request(method, url, data, headers, deadline)
+        location = response.headers.get('Location')
+        if response.code in REDIRECT_CODES and location:
+            response.close()
+            url = urljoin(url, location)
+            if response.code not in (307, 308) and method != 'HEAD':
+                method = 'GET'
+                data = None
+                headers.pop('Content-Type', None)
+            LOGGER.debug('Redirected to %s', url)
+            continue
+
+        if response.code == 304 or response.code >= 400:
+            response.close()
+            raise HTTPError(url, response.code, response.reason, response.headers, None)
+
+        return response
+
+    raise HTTPError(url, response.code, 'Too many redirects', response.headers, None)
+
+
+def clear():
+    """Close all idle connections
+    """
+
+    with _LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+
+    for idle in pools:
+        for (connection, _) in idle:
+            connection.close()
+
+
+class Response(object):
+    """Response of :func:`urlopen`
+
+    The connection returns to the pool, once the body is read.
+    """
+
+    def __init__(self, url, key, connection, response):
+        self.url = url
+        self.code = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def info(self):
+        return self.headers
+
+    def read(self, size=None):
+        """Read at most size bytes of the body, whole body if size is None
+        """
+
+        response = self._response
+        if response is None:
+            return b''
+
+        if size is None or size < 0:
+            data = response.read()
+        else:
+            data = response.read(size)
+
+        if response.isclosed():
+            self._release(True)
+        return data
+
+    def close(self):
+        """Close the response, the connection is reused if the body was read
+        """
+
+        response = self._response
+        if response is None:
+            return
+
+        if not response.isclosed() and response.length is not None \
+                and response.length <= DRAIN_SIZE:
+            try:
+                response.read()
+            except (socket.error, http_client.HTTPException):
+                pass
+
+        self._release(response.isclosed())
+
+    def _release(self, reusable):
+        (response, connection) = (self._response, self._connection)
+        self._response = None
+        self._connection = None
+
+        if reusable and not response.will_close:
+            _release(self._key, connection)
+        else:
+            response.close()
+            connection.close()
+
+
+def _request(method, url, data, headers, deadline):
+    """Send the request, retry idempotent requests with exponential backoff
+
+    :returns: :class:`Response`
+    """
+
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = parsed.netloc.rpartition('@')[2]
+    proxy = _get_proxy(scheme, parsed.hostname)
+    if proxy and scheme == 'http':
+        path = url.split('#')[0]
+    else:
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+    key = (scheme, host)
+    retries = int(_get_option('retries'))
+    backoff = float(_get_option('backoff'))
+    # file-like body is rewound before it is sent again
+    position = data.tell() if hasattr(data, 'read') else None
+    attempt = 0
+    while True:
+        timeout = max(deadline - time.time(), 0.001)
+        (connection, reused) = _get_connection(key, proxy, timeout)
+        delay = backoff * 2 ** attempt
+        try:
+            if position is not None:
+                data.seek(position)
+            connection.request(method, path, data, headers)
+            response = Response(url, key, connection, connection.getresponse())
+        except (socket.error, http_client.HTTPException) as e:
+            connection.close()
+            if reused:
+                # the server closed the idle connection meanwhile
+                LOGGER.debug('Pooled connection to %s closed: %s', host, e)
+                continue
+            if method not in IDEMPOTENT_METHODS or attempt >= retries \
+                    or time.time() + delay >= deadline:
+                raise
+            LOGGER.warning('Request to %s failed: %s, retrying', url, e)
+        else:
+            if response.code not in RETRY_CODES or method not in IDEMPOTENT_METHODS \
+                    or attempt >= retries:
+                return response
+
+            retry_after = response.headers.get('Retry-After') or ''
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if time.time() + delay >= deadline:
+                return response
+            response.close()
+            LOGGER.warning('%s answered %i, retrying', url, response.code)
+
+        time.sleep(delay)
+        attempt += 1
+
+
+def _get_headers(headers, data):
+    """Return request headers, header names are case insensitive
+    """
+
+    names = set()
+    result = {}
+    for (name, value) in (headers or {}).items():
+        if PY2:
+            (name, value) = (str(name), str(value))
+        names.add(name.lower())
+        result[name] = value
+
+    if 'user-agent' not in names:
+        result['User-Agent'] = 'PyWPS/%s' % pywps.__version__
+    if data is not None and 'content-type' not in names:
+        # as urllib does
+        result['Content-Type'] = 'application/x-www-form-urlencoded'
+    return result
+
+
+def _get_connection(key, proxy, timeout):
+    """Take idle connection from the pool or open new one
+
+    :returns: (connection, reused)
+    """
+
+    keepalive = float(_get_option('keepalive'))
+    with _LOCK:
+        _check_pid()
+        idle = _POOLS.get(key, [])
+        while idle:
+            (connection, released) = idle.pop()
+            if time.time() - released < keepalive:
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return (connection, True)
+            connection.close()
+
+    (scheme, host) = key
+    if proxy is None:
+        if scheme == 'https':
+            return (http_client.HTTPSConnection(host, timeout=timeout), False)
+        return (http_client.HTTPConnection(host, timeout=timeout), False)
+
+    if scheme == 'https':
+        connection = http_client.HTTPSConnection(proxy, timeout=timeout)
+        connection.set_tunnel(host)
+        return (connection, False)
+    return (http_client.HTTPConnection(proxy, timeout=timeout), False)
+
+
+def _release(key, connection):
+    """Return connection to the pool, close it if the pool is full
+    """
+
+    with _LOCK:
+        _check_pid()
+        idle = _POOLS.setdefault(key, [])
+        if len(idle) < _get_pool_size(key[1]):
+            idle.append((connection, time.time()))
+            return
+
+    connection.close()
+
+
+def _check_pid():
+    """Forget connections of the parent process after fork
+    """
+
+    global _PID
+
+    if os.getpid() != _PID:
+        _POOLS.clear()
+        _PID = os.getpid()
+
+
+def _get_pool_size(host):
+    hostname = host.rsplit(':', 1)[0] if not host.endswith(']') else host
+    sizes = configuration.get_config_section('http:poolsize')
+    return int(sizes.get(hostname.strip('[]').lower(), _get_option('poolsize')))
+
+
+def _get_proxy(scheme, hostname):
+    """Return host:port of the proxy for given URL, None for direct
+    connection
+    """
+
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(hostname or ''):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return urlparse(proxy).netloc.rpartition('@')[2]
+
+
+def _get_option(option):
+    return configuration.get_config_value('http', option)
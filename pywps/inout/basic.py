@@ -11,11 +11,15 @@ from pywps.validator.literalvalidator import validate_anyvalue,\
 from pywps.validator.allowed_value import ALLOWEDVALUETYPE
 from pywps.exceptions import InvalidParameterValue
 import base64
+import itertools
 from collections import namedtuple
 
 _SOURCE_TYPE = namedtuple('SOURCE_TYPE', 'MEMORY, FILE, STREAM, DATA')
 SOURCE_TYPE = _SOURCE_TYPE(0, 1, 2, 3)
 
+# versions of the inputs and outputs, unique in the process
+_VERSIONS = itertools.count(1)
+
 class IOHandler(object):
     """Basic IO class. Provides functions, to accept input data in file,
     memory object and stream object and give them out in all three types
@@ -77,6 +81,13 @@ class IOHandler(object):
 
         self.valid_mode = mode
 
+    def __setattr__(self, name, value):
+        # any change gets new version, the process describes its inputs and
+        # outputs again, when version of any of them changed, see
+        # Process.describe_fragment
+        object.__setattr__(self, '_description_version', next(_VERSIONS))
+        object.__setattr__(self, name, value)
+
     def _check_valid(self):
         """Validate this input usig given validator
         """
@@ -88,9 +99,10 @@ class IOHandler(object):
                                         'mode %s' % (self.valid_mode))
 
     def set_file(self, filename):
-        """Set source as file name"""
+        """Set source as file name, relative name is taken as relative to
+        the workdir"""
         self.source_type = SOURCE_TYPE.FILE
-        self.source = os.path.abspath(filename)
+        self.source = os.path.abspath(os.path.join(self.workdir or '', filename))
         self._check_valid()
 
     def set_workdir(self, workdirpath):
@@ -137,6 +149,7 @@ class IOHandler(object):
                 return self._tempfile
             else:
                 (opening, stream_file_name) = tempfile.mkstemp(dir=self.workdir)
+                os.close(opening)
                 stream_file = open(stream_file_name, 'w')
 
                 if self.source_type == SOURCE_TYPE.STREAM:
@@ -570,6 +583,10 @@ class ComplexOutput(BasicIO, BasicComplex, IOHandler):
         BasicComplex.__init__(self, data_format, supported_formats)
 
         self._storage = None
+        self._stored = None
+        # request producing the output, its storage is accounted to
+        self.uuid = None
+        self.owner = None
 
     @property
     def storage(self):
@@ -578,12 +595,15 @@ class ComplexOutput(BasicIO, BasicComplex, IOHandler):
     @storage.setter
     def storage(self, storage):
         self._storage = storage
+        self._stored = None
 
     def get_url(self):
-        """Return URL pointing to data
+        """Return URL pointing to data, the data are stored only once
         """
-        (outtype, storage, url) = self.storage.store(self)
-        return url
+        if self._stored is None or self._stored[0] != self.file:
+            (outtype, storage, url) = self.storage.store(self)
+            self._stored = (self.file, url)
+        return self._stored[1]
 
 
 class UOM(object):
@@ -0,0 +1,281 @@
+"""
+Storage of outputs in S3 compatible object storage (AWS S3, MinIO, Ceph)
+
+Selected by server->storage = s3 and configured by::
+
+    [s3]
+    endpoint = http://minio.example.com:9000
+    bucket = wps-outputs
+    region = us-east-1
+    access_key = ...
+    secret_key = ...
+    # prefix of object keys
+    prefix = outputs/
+    # URL of the objects in the response, default endpoint/bucket/
+    url = https://outputs.example.com/
+    # files bigger than part_size are uploaded in parts, upload_threads
+    # parts at once
+    part_size = 8mb
+    upload_threads = 4
+
+Files are streamed from the workdir, the requests are signed by AWS
+Signature Version 4 with unsigned payload. Requests are sent by
+:mod:`pywps.httpclient`, so the connections to the endpoint are reused.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from pywps import configuration as config, httpclient
+from pywps._compat import urlparse, quote
+from pywps.exceptions import NoApplicableCode
+from pywps.inout.storage import StorageAbstract, STORE_TYPE
+
+LOGGER = logging.getLogger('PYWPS')
+
+# smallest part allowed by S3, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+
+class S3Storage(StorageAbstract):
+    """Storage uploading outputs to S3 bucket
+    """
+
+    def __init__(self):
+        self.endpoint = config.get_config_value('s3', 'endpoint').rstrip('/')
+        self.bucket = config.get_config_value('s3', 'bucket')
+        self.region = config.get_config_value('s3', 'region')
+        self.access_key = config.get_config_value('s3', 'access_key')
+        self.secret_key = config.get_config_value('s3', 'secret_key')
+        self.prefix = config.get_config_value('s3', 'prefix')
+        self.output_url = config.get_config_value('s3', 'url') or \
+            '%s/%s/' % (self.endpoint, self.bucket)
+        part_size = config.get_size_mb(config.get_config_value('s3', 'part_size'))
+        self.part_size = max(int(part_size * 1024 * 1024), MIN_PART_SIZE)
+        self.upload_threads = int(config.get_config_value('s3', 'upload_threads'))
+
+        if not self.endpoint or not self.bucket:
+            raise NoApplicableCode('S3 storage needs s3->endpoint and s3->bucket')
+
+    def store(self, output):
+        file_name = output.file
+        (prefix, suffix) = os.path.splitext(file_name)
+        if not suffix:
+            suffix = output.output_format.get_extension()
+        key = '%s%s-%s%s' % (self.prefix, os.path.basename(prefix), uuid.uuid4().hex, suffix)
+
+        content_type = 'application/octet-stream'
+        if output.data_format and output.data_format.mime_type:
+            content_type = output.data_format.mime_type
+
+        size = os.path.getsize(file_name)
+        LOGGER.info('Uploading file output to s3://%s/%s', self.bucket, key)
+        try:
+            if size <= self.part_size:
+                self._put_object(key, file_name, size, content_type)
+            else:
+                self._put_multipart(key, file_name, size, content_type)
+        except NoApplicableCode:
+            raise
+        except Exception as e:
+            raise NoApplicableCode('Uploading output %s failed: %s' % (output.identifier, e))
+
+        url = self.output_url + quote(key)
+        LOGGER.info('File output URI: %s', url)
+        return (STORE_TYPE.S3, 's3://%s/%s' % (self.bucket, key), url)
+
+    def _put_object(self, key, file_name, size, content_type):
+        with open(file_name, 'rb') as body:
+            response = self._request('PUT', key, data=body, headers={
+                'Content-Length': str(size),
+                'Content-Type': content_type
+            })
+            response.close()
+
+    def _put_multipart(self, key, file_name, size, content_type):
+        """Upload the file in parts of part_size bytes, upload_threads
+        parts at once
+        """
+
+        response = self._request('POST', key, {'uploads': ''}, data=b'', headers={
+            'Content-Type': content_type
+        })
+        upload_id = _get_element(response.read(), 'UploadId')
+        response.close()
+
+        parts = [(number, offset, min(self.part_size, size - offset))
+                 for (number, offset) in enumerate(range(0, size, self.part_size), 1)]
+        pending = list(reversed(parts))
+        etags = {}
+        errors = []
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not pending or errors:
+                        return
+                    (number, offset, length) = pending.pop()
+                try:
+                    etag = self._put_part(key, upload_id, number, file_name, offset, length)
+                    with lock:
+                        etags[number] = etag
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+
+        workers = [threading.Thread(target=work, name='pywps-s3-upload')
+                   for _ in range(max(1, min(self.upload_threads, len(parts))))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if errors:
+            self._abort_multipart(key, upload_id)
+            raise errors[0]
+
+        complete = '<CompleteMultipartUpload>%s</CompleteMultipartUpload>' % ''.join(
+            '<Part><PartNumber>%i</PartNumber><ETag>%s</ETag></Part>' % (number, etags[number])
+            for (number, _, _) in parts)
+        response = self._request('POST', key, {'uploadId': upload_id}, data=complete.encode('utf-8'))
+        result = response.read()
+        response.close()
+        # S3 may report failure of the completion with 200 OK
+        if b'<Error>' in result:
+            self._abort_multipart(key, upload_id)
+            raise NoApplicableCode('Completing upload of %s failed: %s' % (key, _get_element(result, 'Message')))
+
+        LOGGER.debug('%i parts of s3://%s/%s uploaded', len(parts), self.bucket, key)
+
+    def _put_part(self, key, upload_id, number, file_name, offset, length):
+        """Upload one part
+
+        :returns: ETag of the part
+        """
+
+        with open(file_name, 'rb') as f:
+            body = _FilePart(f, offset, length)
+            response = self._request('PUT', key, {'partNumber': str(number), 'uploadId': upload_id},
+                                     data=body, headers={'Content-Length': str(length)})
+            etag = response.headers.get('ETag')
+            response.close()
+        return etag
+
+    def _abort_multipart(self, key, upload_id):
+        try:
+            self._request('DELETE', key, {'uploadId': upload_id}).close()
+        except Exception as e:
+            LOGGER.warning('Aborting upload of s3://%s/%s failed: %s', self.bucket, key, e)
+
+    def _request(self, method, key, query=None, data=None, headers=None):
+        """Send signed request concerning given object
+
+        :param query: dict of query parameters
+        :param data: string or file-like request body
+        """
+
+        endpoint = urlparse(self.endpoint)
+        path = quote('%s/%s/%s' % (endpoint.path.rstrip('/'), self.bucket, key), safe='/~')
+        query_string = '&'.join('%s=%s' % (quote(name, safe='~'), quote(value, safe='~'))
+                                for (name, value) in sorted((query or {}).items()))
+        url = '%s://%s%s' % (endpoint.scheme, endpoint.netloc, path)
+        if query_string:
+            url += '?' + query_string
+
+        headers = dict(headers or {})
+        if self.access_key:
+            payload_hash = UNSIGNED_PAYLOAD
+            if isinstance(data, bytes):
+                payload_hash = hashlib.sha256(data).hexdigest()
+            headers.update(self._sign(method, path, query_string, headers, payload_hash))
+
+        return httpclient.urlopen(url, data, headers, method=method)
+
+    def _sign(self, method, path, query_string, headers, payload_hash, timestamp=None):
+        """Return headers authorizing the request by AWS Signature Version 4
+
+        :param timestamp: time of the request, default now
+        """
+
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(timestamp))
+        date = amz_date[:8]
+        signed = {
+            'host': urlparse(self.endpoint).netloc,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date
+        }
+        for (name, value) in headers.items():
+            if name.lower() == 'content-type':
+                signed['content-type'] = value
+
+        names = sorted(signed)
+        canonical_request = '\n'.join([
+            method,
+            path,
+            query_string,
+            ''.join('%s:%s\n' % (name, str(signed[name]).strip()) for name in names),
+            ';'.join(names),
+            payload_hash
+        ])
+        scope = '%s/%s/s3/aws4_request' % (date, self.region)
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+
+        signing_key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (date, self.region, 's3', 'aws4_request'):
+            signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        return {
+            'Host': signed['host'],
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            'Authorization': 'AWS4-HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, Signature=%s' % (
+                self.access_key, scope, ';'.join(names), signature)
+        }
+
+
+class _FilePart(object):
+    """File-like object reading length bytes of the file from offset
+    """
+
+    def __init__(self, file_object, offset, length):
+        self._file = file_object
+        self._offset = offset
+        self._length = length
+        self.seek(0)
+
+    def read(self, size=-1):
+        remaining = self._length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self._file.read(size)
+
+    def seek(self, position):
+        self._file.seek(self._offset + position)
+
+    def tell(self):
+        return self._file.tell() - self._offset
+
+
+def _get_element(xml, name):
+    """Return text of the first element with given name in S3 response
+    """
+
+    match = re.search(b'<' + name.encode('utf-8') + b'>([^<]*)</', xml)
+    if match is None:
+        raise NoApplicableCode('Unexpected response of S3: %s' % xml[:200])
+    return match.group(1).decode('utf-8')
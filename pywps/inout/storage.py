@@ -3,12 +3,25 @@ import logging
 import os
 from pywps._compat import urljoin
 from pywps.exceptions import NotEnoughStorage, NoApplicableCode
-from pywps import configuration as config
+from pywps import configuration as config, layout, quota
 
 LOGGER = logging.getLogger('PYWPS')
 
+# chunk size of copied files
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+# storages selected by server->storage, other values are taken as dotted
+# path of StorageAbstract subclass
+STORAGES = {
+    'file': 'pywps.inout.storage.FileStorage',
+    's3': 'pywps.inout.s3storage.S3Storage'
+}
+
+
 class STORE_TYPE:
     PATH = 0
+    S3 = 1
 # TODO: cover with tests
 class StorageAbstract(object):
     """Data storage abstract class
@@ -79,7 +92,23 @@ class FileStorage(StorageAbstract):
         )
 
     def store(self, output):
-        import shutil, tempfile, math
+        """Publish the output file in server->outputpath
+
+        The file is published as server->storage_mode says:
+
+        link
+            reflink (copy-on-write clone), or hard link if the file is in
+            the workdir of the output, copy otherwise
+        move
+            file in the workdir of the output is renamed, it is linked as
+            above if it is on another file system
+        copy
+            file is always copied
+
+        The file is put in prefix directory of server->outputlayout, see
+        :mod:`pywps.layout`.
+        """
+        import math
 
         file_name = output.file
 
@@ -93,24 +122,154 @@ class FileStorage(StorageAbstract):
         if avail_size < actual_file_size:
             raise NotEnoughStorage('Not enough space in %s to store %s' % (self.target, file_name))
 
+        # outputs written meanwhile by other requests take the space too
+        reservation = quota.reserve(actual_file_size, output.owner, output.uuid, avail_size)
+
         (prefix, suffix) = os.path.splitext(file_name)
         if not suffix:
             suffix = output.output_format.get_extension()
         (file_dir, file_name) = os.path.split(prefix)
-        output_name = tempfile.mkstemp(suffix=suffix, prefix=file_name,
-                                       dir=self.target)[1]
+        full_output_name = None
+        try:
+            output_name = layout.create_file(file_name, suffix, self.target)
 
-        full_output_name  = os.path.join(self.target, output_name)
-        LOGGER.info('Storing file output to %s', full_output_name)
-        shutil.copy2(output.file, full_output_name)
+            full_output_name  = os.path.join(self.target, output_name)
+            LOGGER.info('Storing file output to %s', full_output_name)
+            how = self._publish(output, full_output_name)
+            LOGGER.debug('File output %s stored (%s)', output.identifier, how)
+        except:
+            # do not leave partial file behind
+            if full_output_name and os.path.exists(full_output_name):
+                os.remove(full_output_name)
+            quota.release(reservation)
+            raise
+
+        quota.finish(reservation, full_output_name, actual_file_size)
 
         just_file_name = os.path.basename(output_name)
 
-        url = urljoin(self.output_url, just_file_name)
+        url = urljoin(self.output_url, layout.get_relative_url(just_file_name))
         LOGGER.info('File output URI: %s', url)
 
         return (STORE_TYPE.PATH, output_name, url)
 
+    def _publish(self, output, target):
+        """Make target file with the content of the output
+
+        :returns: 'rename', 'reflink', 'hardlink' or 'copy'
+        """
+
+        mode = config.get_config_value('server', 'storage_mode')
+        if mode == 'copy':
+            copy_file(output.file, target)
+            return 'copy'
+
+        # files in the workdir are not changed anymore, they are removed
+        temporary = _is_in_dir(output.file, output.workdir)
+        if mode == 'move' and temporary:
+            try:
+                os.rename(output.file, target)
+                output.file = target
+                return 'rename'
+            except OSError:
+                # other file system
+                pass
+
+        return link_file(output.file, target, hardlink=temporary)
+
+
+def get_storage():
+    """Return storage of reference outputs selected by server->storage
+
+    :returns: instance of :class:`StorageAbstract` subclass
+    """
+    import importlib
+
+    name = config.get_config_value('server', 'storage') or 'file'
+    class_path = STORAGES.get(name, name)
+    (module_name, _, class_name) = class_path.rpartition('.')
+    try:
+        storage_class = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise NoApplicableCode('Unknown storage %s: %s' % (name, e))
+
+    return storage_class()
+
+
+def link_file(source, target, hardlink=True):
+    """Make target a copy of source without copying the data, if possible
+
+    Target is a reflink (copy-on-write clone) of source, a hard link if
+    the file system does not support reflinks, or a copy if source is on
+    another file system. Existing target is replaced.
+
+    :param hardlink: hard link may be made, changes of source change target
+    :returns: 'reflink', 'hardlink' or 'copy'
+    """
+
+    if os.path.lexists(target):
+        os.remove(target)
+
+    if _reflink(source, target):
+        return 'reflink'
+
+    if hardlink:
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except (OSError, AttributeError):
+            # other file system or no hard links on the platform
+            pass
+
+    copy_file(source, target)
+    return 'copy'
+
+
+def copy_file(source, target):
+    """Copy source to target in chunks of COPY_CHUNK_SIZE bytes, with its
+    permissions and modification time
+    """
+    import shutil
+
+    with open(source, 'rb') as source_file:
+        with open(target, 'wb') as target_file:
+            shutil.copyfileobj(source_file, target_file, COPY_CHUNK_SIZE)
+    shutil.copystat(source, target)
+
+
+def _is_in_dir(file_name, dir_name):
+    if not dir_name:
+        return False
+
+    dir_name = os.path.join(os.path.realpath(dir_name), '')
+    return os.path.realpath(file_name).startswith(dir_name)
+
+
+# ioctl FICLONE of Linux
+_FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    """Clone source to target on copy-on-write file systems (btrfs, xfs)
+
+    :returns: True if cloned
+    """
+
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(source, 'rb') as source_file:
+            with open(target, 'wb') as target_file:
+                fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
+        return True
+    except (IOError, OSError):
+        if os.path.lexists(target):
+            os.remove(target)
+        return False
+
 
 def get_free_space(folder):
     """ Return folder/drive free space (in bytes)
@@ -124,7 +283,9 @@ def get_free_space(folder):
         ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(folder), None, None, ctypes.pointer(free_bytes))
         free_space = free_bytes.value
     else:
-        free_space = os.statvfs(folder).f_bfree
+        # blocks available to unprivileged users
+        stat = os.statvfs(folder)
+        free_space = stat.f_bavail * stat.f_frsize
 
     LOGGER.debug('Free space: %s', free_space)
     return free_space
@@ -0,0 +1,222 @@
+"""
+Current state of asynchronous requests, kept in memory
+
+Workers write the state with every status document update, the Service
+reads it to answer GetStatus requests without reading the status document
+from disk. Threads of the service can :func:`wait` for the next update.
+The store is selected by server->jobstate:
+
+shared
+    dictionary held by :class:`multiprocessing.Manager` server process,
+    shared by the service and the worker processes forked after
+    :func:`start` was called
+memory
+    dictionary of this process, for services running processes in threads
+none
+    state is not kept, GetStatus reads the status documents
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+
+from pywps import configuration
+
+LOGGER = logging.getLogger('PYWPS')
+
+# prune finished requests after every given number of updates
+PRUNE_INTERVAL = 100
+# states of finished requests
+FINAL_STATES = ('succeeded', 'failed')
+
+_MANAGER = None
+_STATES = None
+_FINISHED = None
+# notified by put(), shared by all processes with the shared store
+_UPDATED = None
+# notified in this process, waiting threads wait for it
+_CHANGED = threading.Condition()
+_WATCHER = None
+_LOCK = threading.Lock()
+_UPDATES = 0
+
+
+def start():
+    """Create the store selected by server->jobstate, if not created yet
+
+    Has to be called before worker processes are forked.
+    """
+
+    global _MANAGER, _STATES, _FINISHED, _UPDATED, _WATCHER
+
+    with _LOCK:
+        if _STATES is not None:
+            return
+
+        store = configuration.get_config_value('server', 'jobstate')
+        if store == 'shared':
+            _MANAGER = multiprocessing.Manager()
+            _STATES = _MANAGER.dict()
+            _FINISHED = _MANAGER.dict()
+            _UPDATED = _MANAGER.Condition()
+
+            # one thread waits for the other processes, so the waiting
+            # threads do not need connection to the manager each
+            _WATCHER = threading.Thread(target=_watch, args=(_UPDATED,),
+                                        name='pywps-jobstate-watcher')
+            _WATCHER.daemon = True
+            _WATCHER.start()
+        elif store == 'memory':
+            _STATES = {}
+            _FINISHED = {}
+            _UPDATED = _CHANGED
+        elif store and store != 'none':
+            LOGGER.warning('Unknown server->jobstate %s, state is not kept', store)
+
+
+def stop():
+    """Drop the store and stop the manager process
+    """
+
+    global _MANAGER, _STATES, _FINISHED, _UPDATED, _WATCHER
+
+    with _LOCK:
+        _STATES = None
+        _FINISHED = None
+        _UPDATED = None
+        if _WATCHER is not None:
+            _WATCHER.join()
+            _WATCHER = None
+        if _MANAGER is not None:
+            _MANAGER.shutdown()
+        _MANAGER = None
+
+    with _CHANGED:
+        _CHANGED.notify_all()
+
+
+def put(uuid, status, percent, message, document):
+    """Store state of the request, state of finished request is not
+    replaced by state of running one
+
+    :param uuid: uuid of the request
+    :param status: 'accepted', 'started', 'succeeded' or 'failed'
+    :param percent: percent done
+    :param message: status message
+    :param document: serialized status document
+    """
+
+    global _UPDATES
+
+    (states, finished, updated) = (_STATES, _FINISHED, _UPDATED)
+    if states is None:
+        return
+
+    state = {
+        'status': status,
+        'percent': percent,
+        'message': message,
+        'document': document,
+        'etag': hashlib.sha1(document).hexdigest()
+    }
+    try:
+        if status in FINAL_STATES:
+            finished[str(uuid)] = time.time()
+        elif str(uuid) in finished:
+            LOGGER.debug('State %s of finished request %s ignored', status, uuid)
+            return
+        states[str(uuid)] = state
+
+        with updated:
+            updated.notify_all()
+
+        _UPDATES += 1
+        if _UPDATES % PRUNE_INTERVAL == 0:
+            prune()
+    except (EOFError, IOError) as e:
+        # manager process is gone
+        LOGGER.warning('Storing state of %s failed: %s', uuid, e)
+
+
+def get(uuid):
+    """Return state of the request, see :func:`put`
+
+    :returns: dict or None if the request is not known
+    """
+
+    states = _STATES
+    if states is None:
+        return None
+
+    try:
+        return states.get(str(uuid))
+    except (EOFError, IOError) as e:
+        LOGGER.warning('Reading state of %s failed: %s', uuid, e)
+        return None
+
+
+def wait(uuid, etag=None, timeout=None):
+    """Wait until state of the request differs from the state with given
+    entity tag
+
+    Without the store, sleeps for given timeout.
+
+    :param uuid: uuid of the request
+    :param etag: entity tag of the state known by the caller
+    :param timeout: seconds to wait at most, default server->jobstate_maxwait
+    :returns: state, see :func:`put`, or None if the request is not known
+    """
+
+    if timeout is None:
+        timeout = float(configuration.get_config_value('server', 'jobstate_maxwait'))
+
+    if _STATES is None:
+        time.sleep(timeout)
+        return None
+
+    deadline = time.time() + timeout
+    with _CHANGED:
+        while True:
+            state = get(uuid)
+            if state is None or state['etag'] != etag or _STATES is None:
+                return state
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return state
+            _CHANGED.wait(remaining)
+
+
+def _watch(updated):
+    """Pass notifications of other processes to the waiting threads
+    """
+
+    try:
+        with updated:
+            while _UPDATED is updated:
+                updated.wait(1)
+                with _CHANGED:
+                    _CHANGED.notify_all()
+    except (EOFError, IOError) as e:
+        LOGGER.warning('Job state watcher stopped: %s', e)
+
+
+def prune(max_age=None):
+    """Remove requests finished more than given number of seconds ago
+
+    :param max_age: default server->jobstate_ttl
+    """
+
+    if _STATES is None:
+        return
+
+    if max_age is None:
+        max_age = float(configuration.get_config_value('server', 'jobstate_ttl'))
+
+    cutoff = time.time() - max_age
+    for (uuid, finished) in _FINISHED.items():
+        if finished < cutoff:
+            _STATES.pop(uuid, None)
+            _FINISHED.pop(uuid, None)
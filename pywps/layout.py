@@ -0,0 +1,402 @@
+"""
+Layout of outputs and status documents in server->outputpath
+
+With the flat layout all files are stored in outputpath directly. Millions
+of files in one directory make creating and looking up a file slow, so the
+files can be spread to prefix directories instead::
+
+    [server]
+    # flat, or widths of the prefix directories, 2/2 stores
+    # 3fa85f64-5717-....xml as 3f/a8/3fa85f64-5717-....xml
+    outputlayout = 2/2
+
+The prefix directories are the first characters of the file name, if they
+are hexadecimal digits (status documents, outputs named by uuid), of MD5
+hash of the name otherwise. The path and the URL of a file are computed
+from its name only, the URL of a file is the path relative to outputpath
+under server->outputurl.
+
+Files stored in another layout are moved by :func:`migrate`, URLs in the
+status documents and records of the files in the request log are updated.
+Only status documents and outputs recorded in the request log are moved,
+outputpath may be shared with server->workdir and other temporary files.
+Change server->outputlayout and restart the service first, so running
+requests write to the new layout. Can be run from command line::
+
+    python -m pywps.layout --config pywps.cfg [--layout 2/2]
+"""
+
+import argparse
+import errno
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+
+from pywps import configuration, dblog, workdirs
+from pywps._compat import urljoin
+from pywps.exceptions import NoApplicableCode
+
+LOGGER = logging.getLogger('PYWPS')
+
+# widest prefix directory, 16 ** 4 directories in one level
+MAX_WIDTH = 4
+HEX_DIGITS = set('0123456789abcdef')
+# status documents are named by the request uuid
+STATUS_FILE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.xml$')
+# attributes of the status documents with URLs of the files
+URL_ATTRIBUTE = re.compile(br'(statusLocation|href)="([^"]*)"')
+# files of the request log database
+DATABASE_SUFFIXES = ('', '-wal', '-shm', '-journal')
+
+
+def get_levels(layout=None):
+    """Return widths of the prefix directories, empty list for flat layout
+
+    :param layout: default server->outputlayout
+    """
+
+    if layout is None:
+        layout = configuration.get_config_value('server', 'outputlayout')
+    layout = (layout or '').strip().strip('/').lower()
+    if layout in ('', 'flat'):
+        return []
+
+    try:
+        levels = [int(width) for width in layout.split('/')]
+    except ValueError:
+        levels = []
+    if not levels or any(width < 1 or width > MAX_WIDTH for width in levels):
+        raise NoApplicableCode('Invalid output layout %s, flat or widths like 2/2 expected' % layout)
+    return levels
+
+
+def get_shards(name, levels=None):
+    """Return names of the prefix directories of file with given name
+    """
+
+    if levels is None:
+        levels = get_levels()
+    if not levels:
+        return []
+
+    key = name[:sum(levels)].lower()
+    if len(key) < sum(levels) or not set(key) <= HEX_DIGITS:
+        key = hashlib.md5(name.encode('utf-8')).hexdigest()
+
+    shards = []
+    start = 0
+    for width in levels:
+        shards.append(key[start:start + width])
+        start += width
+    return shards
+
+
+def get_relative_path(name, levels=None):
+    """Return path of file with given name relative to outputpath
+    """
+
+    return os.path.join(*(get_shards(name, levels) + [name]))
+
+
+def get_relative_url(name, levels=None):
+    """Return URL of file with given name relative to outputurl
+    """
+
+    return '/'.join(get_shards(name, levels) + [name])
+
+
+def get_path(name, levels=None, path=None):
+    """Return path of file with given name
+
+    :param path: default server->outputpath
+    """
+
+    if path is None:
+        path = configuration.get_config_value('server', 'outputpath')
+    return os.path.join(path, get_relative_path(name, levels))
+
+
+def find(name):
+    """Return path of existing file with given name, None if there is no
+    such file
+
+    Files stored in the flat layout are found too, until they are migrated.
+    """
+
+    file_path = get_path(name)
+    if os.path.exists(file_path):
+        return file_path
+
+    flat_path = get_path(name, [])
+    if flat_path != file_path and os.path.exists(flat_path):
+        return flat_path
+    return None
+
+
+def make_dirs(file_path):
+    """Make missing prefix directories of given file
+    """
+
+    dir_name = os.path.dirname(file_path)
+    try:
+        os.makedirs(dir_name)
+    except OSError as e:
+        # made by another request meanwhile
+        if e.errno != errno.EEXIST or not os.path.isdir(dir_name):
+            raise
+
+
+def create_file(prefix, suffix, path=None):
+    """Create new empty file in outputpath
+
+    Files in the flat layout are named as by :func:`tempfile.mkstemp`,
+    other layouts put random uuid in front of the prefix, so the files are
+    spread evenly to the prefix directories.
+
+    :param path: default server->outputpath
+    :returns: path of the file
+    """
+
+    if path is None:
+        path = configuration.get_config_value('server', 'outputpath')
+
+    levels = get_levels()
+    if not levels:
+        (fd, file_path) = tempfile.mkstemp(suffix=suffix, prefix=prefix, dir=path)
+        os.close(fd)
+        return file_path
+
+    while True:
+        file_path = get_path('%s-%s%s' % (uuid.uuid4().hex, prefix, suffix), levels, path)
+        make_dirs(file_path)
+        try:
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            raise
+        os.close(fd)
+        return file_path
+
+
+def walk(path=None):
+    """Yield files in outputpath and in its prefix directories of any
+    layout
+
+    Other directories, like working directories of the requests and their
+    pool, are not entered. The request log database and files being
+    written are left out.
+
+    :param path: default server->outputpath
+    :returns: iterator of (path of the file, True if it is in prefix
+              directory)
+    """
+
+    if path is None:
+        path = configuration.get_config_value('server', 'outputpath')
+    excluded = _get_excluded()
+
+    for (dir_name, depth) in _walk_prefix_dirs(path, excluded):
+        for name in _list_dir(dir_name):
+            file_path = os.path.join(dir_name, name)
+            if name.endswith('.tmp') or _normalize(file_path) in excluded or \
+                    not os.path.isfile(file_path):
+                continue
+            yield (file_path, depth > 0)
+
+
+def migrate(path=None, levels=None, batch_size=1000):
+    """Move files stored in another layout to given layout
+
+    Status documents and files recorded in the request log are moved, see
+    :func:`walk`. Files are renamed, so they are never missing or
+    incomplete. URLs of the files in the status documents are changed
+    before the documents are moved. Prefix directories left empty are
+    removed.
+
+    :param path: default server->outputpath
+    :param levels: widths of the prefix directories, default
+                   server->outputlayout
+    :param batch_size: number of files recorded in request log at once
+    :returns: number of moved files
+    """
+
+    if path is None:
+        path = configuration.get_config_value('server', 'outputpath')
+    if levels is None:
+        levels = get_levels()
+    bases = _get_url_bases()
+    # outputs recorded by write-behind
+    dblog.flush()
+
+    moved = 0
+    moves = []
+    # the prefix directories are changed while they are walked
+    for (source, _) in list(walk(path)):
+        file_name = os.path.basename(source)
+        target = get_path(file_name, levels, path)
+        if source == target:
+            continue
+
+        is_status = STATUS_FILE.match(file_name)
+        if not is_status and not dblog.is_output_recorded(source):
+            continue
+        if os.path.exists(target):
+            LOGGER.warning('%s not moved, %s exists', source, target)
+            continue
+
+        if is_status:
+            _rewrite_urls(source, bases, levels)
+        make_dirs(target)
+        os.rename(source, target)
+        moves.append((source, target))
+        moved += 1
+
+        if len(moves) >= batch_size:
+            dblog.move_outputs(moves)
+            moves = []
+            LOGGER.info('%i files moved', moved)
+
+    if moves:
+        dblog.move_outputs(moves)
+    _remove_empty_dirs(path, levels)
+
+    LOGGER.info('%i files in %s moved to %s layout', moved, path,
+                '/'.join(str(width) for width in levels) or 'flat')
+    return moved
+
+
+def _get_excluded():
+    """Return normalized paths, which are never taken for files or prefix
+    directories in outputpath: the request log database, working
+    directories and their pool
+    """
+
+    excluded = set()
+    database = dblog.get_database()
+    if database != ':memory:':
+        excluded.update(_normalize(database + suffix) for suffix in DATABASE_SUFFIXES)
+
+    pool_path = workdirs.get_pool_path()
+    excluded.update(_normalize(os.path.join(pool_path, subdir))
+                    for subdir in workdirs.SUBDIRS)
+    return excluded
+
+
+def _walk_prefix_dirs(path, excluded):
+    """Yield (directory, depth) of path and of prefix directories under it
+    """
+
+    stack = [(path, 0)]
+    while stack:
+        (dir_name, depth) = stack.pop()
+        yield (dir_name, depth)
+        for name in _list_dir(dir_name):
+            sub_dir = os.path.join(dir_name, name)
+            if _is_prefix_dir(name) and _normalize(sub_dir) not in excluded and \
+                    os.path.isdir(sub_dir) and not os.path.islink(sub_dir):
+                stack.append((sub_dir, depth + 1))
+
+
+def _is_prefix_dir(name):
+    return 0 < len(name) <= MAX_WIDTH and set(name) <= HEX_DIGITS and \
+        not name.startswith(workdirs.PREFIX)
+
+
+def _list_dir(dir_name):
+    try:
+        return os.listdir(dir_name)
+    except OSError:
+        return []
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _get_url_bases():
+    """Return URLs of outputpath used in the status documents
+
+    Status documents are referenced by server->outputurl, outputs by
+    server->outputurl joined to server->url.
+    """
+
+    outputurl = configuration.get_config_value('server', 'outputurl')
+    storage_url = urljoin('%s%s' % (configuration.get_config_value('server', 'url'), outputurl), '_')
+    return set([outputurl.rstrip('/') + '/', storage_url[:-1]])
+
+
+def _rewrite_urls(file_path, bases, levels):
+    """Change URLs of files in outputpath in status document to given layout
+    """
+
+    def replace(match):
+        url = match.group(2).decode('utf-8')
+        for base in bases:
+            if url.startswith(base):
+                name = url.rpartition('/')[2]
+                url = base + get_relative_url(name, levels)
+                break
+        return match.group(1) + b'="' + url.encode('utf-8') + b'"'
+
+    with open(file_path, 'rb') as f:
+        document = f.read()
+    rewritten = URL_ATTRIBUTE.sub(replace, document)
+    if rewritten == document:
+        return
+
+    temp_path = '%s.%i-%i.tmp' % (file_path, os.getpid(), threading.current_thread().ident)
+    with open(temp_path, 'wb') as f:
+        f.write(rewritten)
+    os.rename(temp_path, file_path)
+
+
+def _remove_empty_dirs(path, levels):
+    """Remove empty prefix directories, which are not prefix directories of
+    given layout, prefix directories may be made by running requests
+    meanwhile
+    """
+
+    dir_names = [dir_name for (dir_name, depth) in _walk_prefix_dirs(path, _get_excluded())
+                 if depth > 0]
+    # subdirectories first
+    for dir_name in sorted(dir_names, key=len, reverse=True):
+        relative = os.path.relpath(dir_name, path)
+        widths = [len(shard) for shard in relative.split(os.sep)]
+        if widths == levels[:len(widths)]:
+            continue
+        try:
+            os.rmdir(dir_name)
+        except OSError:
+            # not empty
+            pass
+
+
+def main(argv=None):
+    """Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Move outputs and status documents in the PyWPS outputpath to another layout')
+    parser.add_argument('-c', '--config', action='append',
+                        help='PyWPS configuration file, can be repeated')
+    parser.add_argument('-l', '--layout',
+                        help='flat, or widths of the prefix directories like 2/2, '
+                             'default server->outputlayout')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                        help='number of files recorded in request log at once')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    configuration.load_configuration(args.config)
+
+    moved = migrate(levels=get_levels(args.layout), batch_size=args.batch_size)
+    print('%i files moved' % moved)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Quotas of the outputs stored in server->outputpath
+
+Space for an output is reserved before it is written, so concurrent
+requests can not take more than the quotas or the free space of the file
+system together, the output fails at once instead. Stored outputs are
+recorded in the request log database, which is shared by all processes.
+It has to be a database file, as server->logdatabase is by default, with
+:memory: every process counts only outputs it stored itself, so the quotas
+apply to every process separately. Sizes are given with kb, mb or gb
+unit, as server->maxsingleinputsize is, number without unit is megabytes::
+
+    [quota]
+    # size of outputs of all users, 0 unlimited
+    total = 100gb
+    # size of outputs of one user, identified as the scheduler does,
+    # 0 unlimited
+    user = 10gb
+    # reservations not finished in given number of seconds are dropped
+    reservation_timeout = 3600
+
+    [quota:users]
+    # size of outputs of given user
+    alice = 50gb
+"""
+
+import logging
+import time
+
+from pywps import configuration, dblog
+from pywps.exceptions import NotEnoughStorage
+
+LOGGER = logging.getLogger('PYWPS')
+
+
+def get_total_quota():
+    """Bytes of outputs of all users, 0 unlimited
+    """
+
+    return _get_bytes(configuration.get_config_value('quota', 'total'))
+
+
+def get_user_quota(owner):
+    """Bytes of outputs of given user, 0 unlimited
+    """
+
+    users = configuration.get_config_section('quota:users')
+    quota = users.get(str(owner).lower())
+    if quota is None:
+        quota = configuration.get_config_value('quota', 'user')
+    return _get_bytes(quota)
+
+
+def reserve(size, owner=None, uuid=None, free_space=None):
+    """Reserve space for an output
+
+    :param size: bytes of the output
+    :param owner: user storing the output
+    :param uuid: request storing the output
+    :param free_space: free bytes on the file system
+    :returns: reservation, see :func:`finish` and :func:`release`
+    :raises NotEnoughStorage: quota or free space exceeded
+    """
+
+    timeout = float(configuration.get_config_value('quota', 'reservation_timeout'))
+    reservation = dblog.reserve_output(size, owner, uuid, get_user_quota(owner), get_total_quota(),
+                                       free_space, time.time() - timeout)
+    if reservation is None:
+        LOGGER.warning('No space for %i bytes of output of %s', size, owner)
+        raise NotEnoughStorage('Storage quota exceeded, %i bytes of output can not be stored' % size)
+    return reservation
+
+
+def finish(reservation, path, size):
+    """Record the output written to path in place of the reservation
+    """
+
+    dblog.finish_output(reservation, path, size)
+
+
+def release(reservation):
+    """Give the reserved space or the space of the removed output back
+    """
+
+    dblog.remove_output(reservation)
+
+
+def get_usage(owner=None):
+    """Return bytes taken by outputs of given user, all users if None
+    """
+
+    return dblog.get_output_usage(owner)
+
+
+def _get_bytes(size):
+    if not size:
+        return 0
+    return int(configuration.get_size_mb(str(size)) * 1024 * 1024)
@@ -0,0 +1,304 @@
+"""
+On-disk cache of reference inputs
+
+Downloaded reference inputs are kept in server->cache_path, so the next
+Execute referencing the same URL gets them without downloading again. The
+cache is disabled, if server->cache_path is empty.
+
+Files are stored by SHA-256 of their content in ``objects/``, one file is
+stored only once, even if more URLs return it. Records in ``keys/``, named
+by hash of the method, URL, headers and body of the request, point to the
+files and keep their ETag and Last-Modified. The cached file is used only after the
+server confirmed it did not change (304 Not Modified), responses without
+any of these headers are not cached.
+
+Files are linked to the workdir of the process, not copied, so they are
+read-only. Least recently used files are removed, once the cache grows over
+server->cache_maxsize. Size of the cache is counted by every process, files
+stored by other processes are counted, when the cache is scanned again,
+at eviction or after SCAN_INTERVAL.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from pywps import configuration
+from pywps.inout.storage import link_file
+
+LOGGER = logging.getLogger('PYWPS')
+
+# seconds, after which the size of the cache is counted again
+SCAN_INTERVAL = 600
+
+# [cache path, size in bytes, time of the last scan] of the cache
+_SIZE = [None, 0, 0]
+_SIZE_LOCK = threading.Lock()
+
+
+def get_cache_path():
+    """Return cache directory, None if cache is disabled
+    """
+
+    return configuration.get_config_value('server', 'cache_path') or None
+
+
+def get_key(datain):
+    """Return cache key of the reference
+
+    :param datain: reference, see :func:`pywps.app.Service._openurl`
+    """
+
+    key = hashlib.sha256()
+    key.update(str(datain.get('method', 'GET')).upper().encode('utf-8'))
+    key.update(b'\n')
+    key.update(datain.get('href').encode('utf-8'))
+    key.update(b'\n')
+    # responses may differ by the credentials, header names are case
+    # insensitive
+    headers = datain.get('header') or {}
+    for name in sorted(headers, key=lambda name: name.lower()):
+        header = u'%s: %s\n' % (name.lower(), headers[name])
+        key.update(header.encode('utf-8'))
+    for name in ('body', 'bodyreference'):
+        value = datain.get(name)
+        if value:
+            key.update(name.encode('utf-8') + b':')
+            key.update(value.encode('utf-8') if not isinstance(value, bytes) else value)
+    return key.hexdigest()
+
+
+def lookup(key):
+    """Return cached record of the reference
+
+    :returns: dict with url, etag, last_modified, digest and size or None
+    """
+
+    cache_path = get_cache_path()
+    if not cache_path:
+        return None
+
+    key_file = _get_key_file(cache_path, key)
+    try:
+        with open(key_file) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if not os.path.isfile(_get_object_file(cache_path, entry['digest'])):
+        # the file was evicted
+        _remove(key_file)
+        return None
+
+    return entry
+
+
+def get_headers(entry):
+    """Return headers of conditional request revalidating cached record
+    """
+
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def is_cacheable(headers):
+    """Check if response with given headers can be cached
+    """
+
+    if not get_cache_path():
+        return False
+
+    cache_control = (headers.get('Cache-Control') or '').lower()
+    if 'no-store' in cache_control:
+        return False
+
+    return bool(headers.get('ETag') or headers.get('Last-Modified'))
+
+
+def store(key, datain, headers, file_name, digest):
+    """Add downloaded file to the cache
+
+    The file is linked to the cache, not copied, and it is made read-only.
+
+    :param key: cache key, see :func:`get_key`
+    :param datain: the reference
+    :param headers: response headers
+    :param file_name: downloaded file
+    :param digest: SHA-256 hex digest of the file
+    """
+
+    cache_path = get_cache_path()
+    size = os.path.getsize(file_name)
+    if size > _get_max_size():
+        return
+
+    object_file = _get_object_file(cache_path, digest)
+    added = 0
+    try:
+        _makedirs(os.path.dirname(object_file))
+        if not os.path.isfile(object_file):
+            os.chmod(file_name, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            _replace(object_file, lambda temp: link_file(file_name, temp))
+            added = size
+
+        entry = {
+            'url': datain.get('href'),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'digest': digest,
+            'size': size
+        }
+        key_file = _get_key_file(cache_path, key)
+        _makedirs(os.path.dirname(key_file))
+        _replace(key_file, lambda temp: _write_json(temp, entry))
+    except (IOError, OSError) as e:
+        LOGGER.warning('Caching %s failed: %s', datain.get('href'), e)
+        return
+
+    LOGGER.debug('Cached %s as %s', datain.get('href'), digest)
+    if _add_size(cache_path, added) > _get_max_size():
+        evict()
+
+
+def restore(entry, target):
+    """Link cached file to target
+
+    :raises IOError, OSError: the file is not in the cache anymore
+    """
+
+    object_file = _get_object_file(get_cache_path(), entry['digest'])
+    # mark as recently used
+    os.utime(object_file, None)
+    how = link_file(object_file, target)
+    LOGGER.debug('Cached %s restored (%s)', entry['url'], how)
+
+
+def evict(max_size=None):
+    """Remove least recently used files, until the cache is smaller than
+    given size
+
+    :param max_size: bytes, default server->cache_maxsize
+    :returns: number of removed files
+    """
+
+    cache_path = get_cache_path()
+    if not cache_path:
+        return 0
+
+    if max_size is None:
+        max_size = _get_max_size()
+
+    objects = []
+    total = 0
+    for (dir_name, _, file_names) in os.walk(os.path.join(cache_path, 'objects')):
+        for file_name in file_names:
+            path = os.path.join(dir_name, file_name)
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            objects.append((file_stat.st_mtime, file_stat.st_size, path))
+            total += file_stat.st_size
+
+    removed = 0
+    objects.sort()
+    while objects and total > max_size:
+        (_, size, path) = objects.pop(0)
+        if _remove(path):
+            total -= size
+            removed += 1
+
+    with _SIZE_LOCK:
+        _SIZE[:] = [cache_path, total, time.time()]
+
+    if removed:
+        LOGGER.info('%i files removed from the reference cache', removed)
+    return removed
+
+
+def _add_size(cache_path, size):
+    """Add size of newly stored file to the size of the cache, the cache
+    is scanned first, if its size is not known or is outdated
+
+    :returns: size of the cache in bytes
+    """
+
+    with _SIZE_LOCK:
+        if _SIZE[0] == cache_path and time.time() - _SIZE[2] < SCAN_INTERVAL:
+            _SIZE[1] += size
+            return _SIZE[1]
+
+    total = _scan_size(cache_path)
+    with _SIZE_LOCK:
+        _SIZE[:] = [cache_path, total, time.time()]
+    return total
+
+
+def _scan_size(cache_path):
+    total = 0
+    for (dir_name, _, file_names) in os.walk(os.path.join(cache_path, 'objects')):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_name, file_name))
+            except OSError:
+                continue
+    return total
+
+
+def _get_max_size():
+    max_size = configuration.get_config_value('server', 'cache_maxsize')
+    return configuration.get_size_mb(max_size) * 1024 * 1024
+
+
+def _get_key_file(cache_path, key):
+    return os.path.join(cache_path, 'keys', key[:2], '%s.json' % key)
+
+
+def _get_object_file(cache_path, digest):
+    return os.path.join(cache_path, 'objects', digest[:2], digest)
+
+
+def _makedirs(dir_name):
+    try:
+        os.makedirs(dir_name)
+    except OSError:
+        if not os.path.isdir(dir_name):
+            raise
+
+
+def _replace(file_name, write):
+    """Create file_name by given function at once, readers never see
+    incomplete file
+    """
+
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(file_name), prefix='.tmp')
+    os.close(fd)
+    try:
+        write(temp)
+        os.rename(temp, file_name)
+    except:
+        _remove(temp)
+        raise
+
+
+def _write_json(file_name, obj):
+    with open(file_name, 'w') as f:
+        json.dump(obj, f)
+
+
+def _remove(file_name):
+    try:
+        os.remove(file_name)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,194 @@
+"""
+Retention of the PyWPS request log
+
+Finished requests older than given age are moved from the pywps_requests
+table to the pywps_requests_archive table or to gzip compressed JSON lines
+file, in batches of bounded size. Records of outputs removed by
+:mod:`pywps.expiry` are deleted too. Free pages are given back afterwards.
+
+Can be run from command line::
+
+    python -m pywps.retention --config pywps.cfg --days 30
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import time
+
+from pywps import configuration, dblog
+
+LOGGER = logging.getLogger('PYWPS')
+
+COLUMNS = ['uuid', 'pid', 'operation', 'version', 'time_start', 'time_end',
+           'identifier', 'message', 'percent_done', 'status']
+
+
+def purge_requests(days=None, batch_size=None, archive=None, max_batches=None,
+                   pause=0, vacuum=False):
+    """Archive and delete finished requests older than given number of days
+
+    :param days: age of requests to be removed, default server->logretention_days
+    :param batch_size: number of requests removed in one transaction,
+                       default server->logretention_batchsize
+    :param archive: 'table' to move requests to pywps_requests_archive, file
+                    name to append them to gzip compressed JSON lines file
+                    or 'none' to just delete them, default
+                    server->logretention_archive
+    :param max_batches: stop after given number of batches
+    :param pause: seconds to sleep between batches, gives way to other writers
+    :param vacuum: run full VACUUM if the database does not support
+                   incremental vacuum
+    :returns: number of removed requests
+    """
+
+    if days is None:
+        days = configuration.get_config_value('server', 'logretention_days')
+    if batch_size is None:
+        batch_size = configuration.get_config_value('server', 'logretention_batchsize')
+    if archive is None:
+        archive = configuration.get_config_value('server', 'logretention_archive')
+
+    days = float(days)
+    batch_size = int(batch_size)
+    if not archive or str(archive).lower() == 'none':
+        archive = None
+
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+    LOGGER.info('Removing finished requests started before %s', cutoff)
+
+    dblog.flush()
+    conn = dblog.get_connection()
+    cur = conn.cursor()
+
+    removed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        res = cur.execute("""
+            SELECT
+                uuid
+            FROM
+                pywps_requests
+            WHERE
+                time_start < ? AND (percent_done >= 100 OR percent_done < 0)
+            LIMIT ?
+        """, (cutoff, batch_size))
+        uuids = [row[0] for row in res.fetchall()]
+        if not uuids:
+            break
+
+        placeholders = ','.join('?' * len(uuids))
+        if archive == 'table':
+            cur.execute("""
+                INSERT OR REPLACE INTO
+                    pywps_requests_archive
+                SELECT %s FROM pywps_requests WHERE uuid IN (%s)
+            """ % (','.join(COLUMNS), placeholders), uuids)
+        elif archive:
+            res = cur.execute('SELECT %s FROM pywps_requests WHERE uuid IN (%s)' % (
+                ','.join(COLUMNS), placeholders), uuids)
+            _archive_to_file(archive, res.fetchall())
+
+        cur.execute('DELETE FROM pywps_requests WHERE uuid IN (%s)' % placeholders, uuids)
+        conn.commit()
+
+        removed += len(uuids)
+        batches += 1
+        LOGGER.debug('Removed batch of %i requests', len(uuids))
+
+        if pause:
+            time.sleep(pause)
+
+    LOGGER.info('%i requests removed', removed)
+
+    # records of expired outputs, the files are removed already
+    cur.execute('DELETE FROM pywps_outputs WHERE deleted < ?',
+                (time.time() - days * 24 * 60 * 60,))
+    conn.commit()
+
+    if removed:
+        compact(vacuum=vacuum)
+
+    return removed
+
+
+def compact(pages=1000, vacuum=False):
+    """Give free database pages back to the file system
+
+    Databases created with auto_vacuum=INCREMENTAL are compacted in steps of
+    given number of pages, others only by full VACUUM, if requested.
+
+    :param pages: number of pages freed in one step
+    :param vacuum: run full VACUUM if incremental vacuum is not available
+    """
+
+    conn = dblog.get_connection()
+    cur = conn.cursor()
+
+    auto_vacuum = cur.execute('PRAGMA auto_vacuum').fetchone()[0]
+    if auto_vacuum == 2:
+        free = cur.execute('PRAGMA freelist_count').fetchone()[0]
+        LOGGER.debug('Incremental vacuum of %i free pages', free)
+        while free > 0:
+            cur.execute('PRAGMA incremental_vacuum(%i)' % pages).fetchall()
+            conn.commit()
+            remaining = cur.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+    elif vacuum:
+        LOGGER.info('Running full VACUUM of the request log database')
+        conn.commit()
+        cur.execute('VACUUM')
+    else:
+        LOGGER.debug('Incremental vacuum not enabled for the request log database')
+
+
+def _archive_to_file(file_name, rows):
+    """Append requests to gzip compressed JSON lines file
+    """
+
+    archive_file = gzip.open(file_name, 'ab')
+    try:
+        for row in rows:
+            line = json.dumps(dict(zip(COLUMNS, row)), sort_keys=True) + '\n'
+            archive_file.write(line.encode('utf-8'))
+    finally:
+        archive_file.close()
+
+
+def main(argv=None):
+    """Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Archive and remove finished requests from the PyWPS request log')
+    parser.add_argument('-c', '--config', action='append',
+                        help='PyWPS configuration file, can be repeated')
+    parser.add_argument('-d', '--days', type=float,
+                        help='remove requests older than given number of days')
+    parser.add_argument('-b', '--batch-size', type=int,
+                        help='number of requests removed in one transaction')
+    parser.add_argument('-a', '--archive',
+                        help="'table', 'none' or gzip compressed JSON lines file name")
+    parser.add_argument('-m', '--max-batches', type=int,
+                        help='stop after given number of batches')
+    parser.add_argument('-p', '--pause', type=float, default=0,
+                        help='seconds to sleep between batches')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='run full VACUUM if incremental vacuum is not enabled')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    configuration.load_configuration(args.config)
+
+    removed = purge_requests(days=args.days, batch_size=args.batch_size,
+                             archive=args.archive, max_batches=args.max_batches,
+                             pause=args.pause, vacuum=args.vacuum)
+    print('%i requests removed' % removed)
+
+
+if __name__ == '__main__':
+    main()
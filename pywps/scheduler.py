@@ -0,0 +1,201 @@
+"""
+Admission control and ordering of Execute requests
+
+All requests share server->parallelprocesses slots. Further limits are
+read from the configuration::
+
+    [scheduler]
+    # slots kept free for synchronous requests, asynchronous requests
+    # never take them
+    sync_reserved = 1
+    # HTTP header identifying the user, if REMOTE_USER is not set, for
+    # example API key checked by a proxy in front of the service, clients
+    # can send any value, so no header is trusted by default
+    owner_header =
+
+    [scheduler:limits]
+    # maximum number of running requests of given process
+    buffer = 1
+
+    [scheduler:priorities]
+    # stored requests of processes with higher priority run first, default 0
+    sleep = 10
+
+    [scheduler:weights]
+    # share of the slots taken by stored requests of given user, default 1
+    alice = 3
+
+Stored requests are taken by priority, then from the user with the lowest
+number of running requests relative to its weight, then in the order they
+came. The user is the authenticated user (REMOTE_USER, the Tethys app sets
+it to the Django user), the trusted header or the client address.
+"""
+
+import logging
+import sqlite3
+import threading
+
+from pywps import configuration, dblog
+
+LOGGER = logging.getLogger('PYWPS')
+
+
+def get_limit(identifier):
+    """Maximum number of running requests of given process, 0 unlimited
+    """
+
+    limits = configuration.get_config_section('scheduler:limits')
+    return int(limits.get(str(identifier).lower(), 0))
+
+
+def get_priority(identifier):
+    """Priority of stored requests of given process
+    """
+
+    priorities = configuration.get_config_section('scheduler:priorities')
+    return int(priorities.get(str(identifier).lower(), 0))
+
+
+def get_weight(owner):
+    """Weight of given user in the fair share of the slots
+    """
+
+    weights = configuration.get_config_section('scheduler:weights')
+    weight = float(weights.get(str(owner).lower(), 1))
+    if weight <= 0:
+        LOGGER.warning('Weight of %s must be positive, using 1', owner)
+        weight = 1.0
+    return weight
+
+
+def get_capacity(synchronous=True):
+    """Number of slots available for synchronous or asynchronous requests
+    """
+
+    maxparalel = int(configuration.get_config_value('server', 'parallelprocesses'))
+    if synchronous:
+        return maxparalel
+
+    reserved = int(configuration.get_config_value('scheduler', 'sync_reserved') or 0)
+    # asynchronous requests must not starve
+    return max(maxparalel - reserved, 1)
+
+
+def can_run(identifier, synchronous=True):
+    """Check if request of given process can run now
+
+    :param identifier: process identifier
+    :param synchronous: synchronous request, may take the reserved slots
+    :returns: there is free slot and the process is below its limit
+    """
+
+    counts = dblog.get_running_counts()
+    running = sum(count for (_, _, count) in counts)
+    if running >= get_capacity(synchronous):
+        return False
+
+    limit = get_limit(identifier)
+    if limit:
+        process_running = sum(count for (ident, _, count) in counts if ident == identifier)
+        if process_running >= limit:
+            return False
+
+    return True
+
+
+def claim_next(lease_time=None):
+    """Lease the stored request, which should run next, if there is free
+    slot for it
+
+    :param lease_time: lease duration in seconds, default
+                       server->queue_leasetime
+    :returns: (uuid, identifier, workdir, request) or None, also if the
+              database is locked
+    """
+
+    if lease_time is None:
+        lease_time = float(configuration.get_config_value('server', 'queue_leasetime'))
+
+    while True:
+        counts = dblog.get_running_counts()
+        if sum(count for (_, _, count) in counts) >= get_capacity(synchronous=False):
+            return None
+
+        uuid = _select(dblog.get_waiting(), counts)
+        if uuid is None:
+            return None
+
+        try:
+            stored = dblog.claim_stored(lease_time, uuid)
+        except sqlite3.OperationalError as e:
+            # another worker is writing, the service tries again at its
+            # next poll
+            LOGGER.debug('Claiming stored request %s failed: %s', uuid, e)
+            return None
+        if stored is not None:
+            return stored
+
+        # taken by another worker meanwhile
+        LOGGER.debug('Stored request %s already leased', uuid)
+
+
+def hold_lease(uuid, lease_time=None):
+    """Renew lease of the stored request in background thread, while the
+    request runs, so it is not taken by another worker
+
+    Requests, which did not wait in the queue, are not leased, the thread
+    ends at its first renewal then.
+
+    :param lease_time: lease duration in seconds, default
+                       server->queue_leasetime
+    :returns: :class:`threading.Event`, set it when the request is done
+    """
+
+    if lease_time is None:
+        lease_time = float(configuration.get_config_value('server', 'queue_leasetime'))
+
+    done = threading.Event()
+    thread = threading.Thread(target=_renew_lease, args=(uuid, lease_time, done),
+                              name='pywps-lease')
+    thread.daemon = True
+    thread.start()
+    return done
+
+
+def _renew_lease(uuid, lease_time, done):
+    # renewed well before the lease expires, single failure does not lose it
+    while not done.wait(lease_time / 3):
+        try:
+            if not dblog.renew_lease(uuid, lease_time):
+                return
+        except sqlite3.Error as e:
+            LOGGER.warning('Renewing lease of %s failed: %s', uuid, e)
+
+
+def _select(waiting, counts):
+    """Select the request, which should run next
+
+    :param waiting: (uuid, identifier, owner) in the queue order
+    :param counts: (identifier, owner, count) of running requests
+    :returns: uuid or None
+    """
+
+    by_process = {}
+    by_owner = {}
+    for (identifier, owner, count) in counts:
+        by_process[identifier] = by_process.get(identifier, 0) + count
+        by_owner[owner] = by_owner.get(owner, 0) + count
+
+    selected = None
+    selected_key = None
+    for (order, (uuid, identifier, owner)) in enumerate(waiting):
+        limit = get_limit(identifier)
+        if limit and by_process.get(identifier, 0) >= limit:
+            continue
+
+        key = (-get_priority(identifier), by_owner.get(owner, 0) / get_weight(owner), order)
+        if selected_key is None or key < selected_key:
+            selected = uuid
+            selected_key = key
+
+    return selected
@@ -0,0 +1,251 @@
+"""
+Pool of working directories of the requests
+
+Making and removing the working directory of every request takes long on
+network file systems, so empty directories are made in advance and the
+directories of finished requests are emptied by a background thread of the
+service, off the request path::
+
+    [server]
+    # empty working directories kept ready, 0 makes new directory for
+    # every request and removes it at the end
+    workdir_pool = 16
+    # directory of the pool, default server->workdir, can be on tmpfs
+    workdir_pool_path = /dev/shm/pywps
+
+The directories are moved between the subdirectories of the pool by
+renaming, so the pool is shared by all processes of the service:
+
+free
+    empty directories, taken by :func:`acquire`
+dirty
+    directories of finished requests, given back by :func:`release`
+reset
+    directories being emptied
+
+Requests get new directory, as before, when there is no free one.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+from pywps import configuration
+
+LOGGER = logging.getLogger('PYWPS')
+
+# prefix of the working directories of the requests
+PREFIX = 'pyws_process_'
+# seconds between checks for directories released by other processes
+RESET_INTERVAL = 1
+# subdirectories of the pool
+SUBDIRS = ('free', 'dirty', 'reset')
+
+# names of free directories seen by this process
+_FREE = []
+_LOCK = threading.Lock()
+_RELEASED = threading.Event()
+_STOPPING = threading.Event()
+_THREAD = None
+
+
+def acquire():
+    """Return empty working directory for new request
+    """
+
+    (size, path) = _get_pool()
+    if size > 0:
+        free_dir = os.path.join(path, 'free')
+        while True:
+            with _LOCK:
+                if not _FREE:
+                    _FREE.extend(_list_dir(free_dir))
+                if not _FREE:
+                    break
+                name = _FREE.pop()
+
+            workdir = os.path.join(path, PREFIX + name)
+            try:
+                # other processes take the free directories too
+                os.rename(os.path.join(free_dir, name), workdir)
+                return workdir
+            except OSError:
+                continue
+
+        LOGGER.debug('No free working directory in %s', path)
+
+    return tempfile.mkdtemp(prefix=PREFIX, dir=configuration.get_config_value('server', 'workdir'))
+
+
+def release(workdir):
+    """Give working directory of finished request back to the pool, or
+    remove it, if it is not from the pool
+    """
+
+    if not os.path.isdir(workdir):
+        # released already
+        return
+
+    (size, path) = _get_pool()
+    (parent, name) = os.path.split(os.path.normpath(workdir))
+    if size > 0 and name.startswith(PREFIX) and _is_same_dir(parent, path):
+        try:
+            os.rename(workdir, os.path.join(path, 'dirty', name[len(PREFIX):]))
+            _RELEASED.set()
+            return
+        except OSError as e:
+            LOGGER.warning('Working directory %s not given back to the pool: %s', workdir, e)
+
+    shutil.rmtree(workdir)
+
+
+def reset():
+    """Empty the released directories and keep size of the pool free
+    directories, directories over the size are removed
+
+    :returns: number of emptied directories
+    """
+
+    (size, path) = _get_pool()
+    if size <= 0:
+        return 0
+
+    for subdir in SUBDIRS:
+        _make_dir(os.path.join(path, subdir))
+
+    free_dir = os.path.join(path, 'free')
+    free = len(_list_dir(free_dir))
+    emptied = 0
+    for name in _list_dir(os.path.join(path, 'dirty')):
+        if _STOPPING.is_set():
+            break
+
+        # another service may reset the same pool
+        reset_dir = os.path.join(path, 'reset', name)
+        try:
+            os.rename(os.path.join(path, 'dirty', name), reset_dir)
+        except OSError:
+            continue
+
+        if not _empty_dir(reset_dir):
+            LOGGER.warning('Working directory %s not emptied, removed from the pool', reset_dir)
+            shutil.rmtree(reset_dir, ignore_errors=True)
+            continue
+
+        emptied += 1
+        if free >= size:
+            os.rmdir(reset_dir)
+            continue
+        os.rename(reset_dir, os.path.join(free_dir, name))
+        free += 1
+
+    for _ in range(size - free):
+        _make_dir(os.path.join(free_dir, uuid.uuid4().hex))
+
+    if emptied:
+        LOGGER.debug('%i working directories emptied', emptied)
+    return emptied
+
+
+def start():
+    """Start thread resetting released directories, if the pool is enabled
+    """
+
+    global _THREAD
+
+    if _THREAD is not None or _get_pool()[0] <= 0:
+        return
+
+    _STOPPING.clear()
+    _THREAD = threading.Thread(target=_reset_loop, name='pywps-workdirs')
+    _THREAD.daemon = True
+    _THREAD.start()
+
+
+def stop():
+    """Stop the resetting thread
+    """
+
+    global _THREAD
+
+    if _THREAD is not None:
+        _STOPPING.set()
+        _RELEASED.set()
+        _THREAD.join()
+        _THREAD = None
+        # reset() may be called directly afterwards
+        _STOPPING.clear()
+
+
+def _reset_loop():
+    while not _STOPPING.is_set():
+        _RELEASED.clear()
+        try:
+            reset()
+        except Exception as e:
+            LOGGER.exception('Resetting working directories failed: %s', e)
+        # released by this process or, without notice, by worker processes
+        _RELEASED.wait(RESET_INTERVAL)
+
+
+def get_pool_path():
+    """Return directory of the pool, server->workdir_pool_path or
+    server->workdir
+    """
+
+    return configuration.get_config_value('server', 'workdir_pool_path') or \
+        configuration.get_config_value('server', 'workdir')
+
+
+def _get_pool():
+    """Return (size, path) of the pool
+    """
+
+    size = int(configuration.get_config_value('server', 'workdir_pool') or 0)
+    return (size, get_pool_path())
+
+
+def _empty_dir(dir_name):
+    """Remove content of the directory, keep the directory
+
+    :returns: True if the directory is empty
+    """
+
+    for name in os.listdir(dir_name):
+        file_path = os.path.join(dir_name, name)
+        if os.path.isdir(file_path) and not os.path.islink(file_path):
+            shutil.rmtree(file_path, ignore_errors=True)
+        else:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                LOGGER.warning('Removing %s failed: %s', file_path, e)
+
+    return not os.listdir(dir_name)
+
+
+def _list_dir(dir_name):
+    try:
+        return os.listdir(dir_name)
+    except OSError:
+        return []
+
+
+def _make_dir(dir_name):
+    try:
+        os.mkdir(dir_name, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _is_same_dir(dir_name, other):
+    try:
+        return os.path.samefile(dir_name, other)
+    except (OSError, AttributeError):
+        # no samefile on Windows with Python 2
+        return os.path.normcase(os.path.abspath(dir_name)) == os.path.normcase(os.path.abspath(other))
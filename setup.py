@@ -28,6 +28,13 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=dependencies,
+    entry_points={
+        'console_scripts': [
+            'pywps-log-retention = pywps.retention:main',
+            'pywps-expiry = pywps.expiry:main',
+            'pywps-layout = pywps.layout:main'
+        ]
+    },
     cmdclass={
         'install': custom_install_command(app_package, app_package_dir, dependencies),
         'develop': custom_develop_command(app_package, app_package_dir, dependencies)
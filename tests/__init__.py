@@ -0,0 +1,29 @@
+import unittest
+
+from tests import test_dblog, test_execute_status, test_expiry, test_httpclient, test_layout, \
+    test_process, test_refcache, test_registry, test_s3storage, test_scheduler, test_workdirs
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    """Load all tests
+    """
+
+    return unittest.TestSuite([
+        test_dblog.load_tests(),
+        test_execute_status.load_tests(),
+        test_expiry.load_tests(),
+        test_httpclient.load_tests(),
+        test_layout.load_tests(),
+        test_process.load_tests(),
+        test_refcache.load_tests(),
+        test_registry.load_tests(),
+        test_s3storage.load_tests(),
+        test_scheduler.load_tests(),
+        test_workdirs.load_tests(),
+    ])
+
+
+if __name__ == "__main__":
+    result = unittest.TextTestRunner(verbosity=1).run(load_tests())
+    if not result.wasSuccessful():
+        raise Exception("Some tests failed")
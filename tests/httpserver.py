@@ -0,0 +1,96 @@
+"""Local HTTP server answering with given replies, for tests of the clients
+"""
+
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class Reply(object):
+    """Reply of the server
+
+    :param close: close the connection after the reply, without telling
+                  the client by Connection: close
+    """
+
+    def __init__(self, code=200, body=b'', headers=None, close=False):
+        self.code = code
+        self.body = body
+        self.headers = headers or {}
+        self.close = close
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """Server answering with the replies in given order, the last one is
+    repeated
+
+    Received requests are kept in ``requests`` as (method, path, headers,
+    client port, body).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, replies):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.replies = list(replies)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:%i' % self.server_address[1]
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def handle_error(self, request, client_address):
+        # clients closing connections with unread replies
+        pass
+
+    def take_reply(self):
+        with self.lock:
+            if len(self.replies) > 1:
+                return self.replies.pop(0)
+            return self.replies[0]
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        with self.server.lock:
+            self.server.requests.append(
+                (self.command, self.path, dict((name.lower(), value) for (name, value)
+                                               in self.headers.items()),
+                 self.client_address[1], body))
+
+        reply = self.server.take_reply()
+        self.send_response(reply.code)
+        for (name, value) in reply.headers.items():
+            self.send_header(name, value)
+        if reply.code != 304:
+            self.send_header('Content-Length', str(len(reply.body)))
+        self.end_headers()
+        if self.command != 'HEAD' and reply.code != 304:
+            self.wfile.write(reply.body)
+        self.wfile.flush()
+        if reply.close:
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _reply
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,230 @@
+"""Unit tests for the request log database
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from pywps import configuration, dblog, scheduler
+from pywps.app.WPSRequest import WPSRequest
+
+
+class DbLogTestCase(unittest.TestCase):
+    """Request log in a database file of its own, written at once
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmp_dir, 'log.sqlite')
+        configuration.load_configuration()
+        configuration.config.set('server', 'logdatabase', self.database)
+        configuration.config.set('server', 'logdatabase_writebehind', 'false')
+
+    def tearDown(self):
+        dblog.close_connection()
+        shutil.rmtree(self.tmp_dir)
+
+
+class MigrationTest(DbLogTestCase):
+
+    def _create_old_database(self):
+        """Database with the tables of PyWPS 4.0.0, schema version 0
+        """
+
+        connection = sqlite3.connect(self.database)
+        connection.execute("""
+            CREATE TABLE pywps_requests(
+                uuid VARCHAR(255) not null primary key,
+                pid INTEGER not null,
+                operation varchar(30) not null,
+                version varchar(5) not null,
+                time_start text not null,
+                time_end text,
+                identifier text,
+                message text,
+                percent_done float,
+                status varchar(30)
+            )
+        """)
+        connection.execute("""
+            CREATE TABLE pywps_stored_requests(
+                uuid VARCHAR(255) not null primary key,
+                request BLOB not null
+            )
+        """)
+        connection.execute("""
+            INSERT INTO pywps_stored_requests (uuid, request) VALUES ('old', '{}')
+        """)
+        connection.commit()
+        connection.close()
+
+    def _get_columns(self, connection, table):
+        return [column[1] for column in connection.execute("PRAGMA table_info('%s')" % table)]
+
+    def test_new_database(self):
+        connection = dblog.get_connection()
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, dblog.SCHEMA_VERSION)
+        self.assertIn('deleted', self._get_columns(connection, 'pywps_outputs'))
+
+    def test_migrate_old_database(self):
+        self._create_old_database()
+
+        connection = dblog.get_connection()
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, dblog.SCHEMA_VERSION)
+
+        indexes = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        for index in ('pywps_requests_percent_done', 'pywps_requests_status',
+                      'pywps_requests_time_start', 'pywps_stored_requests_queued'):
+            self.assertIn(index, indexes)
+
+        self.assertIn('owner', self._get_columns(connection, 'pywps_requests'))
+        stored_columns = self._get_columns(connection, 'pywps_stored_requests')
+        for column in ('identifier', 'workdir', 'queued', 'lease_owner', 'lease_expires'):
+            self.assertIn(column, stored_columns)
+
+        # stored requests are kept, first in the queue
+        self.assertEqual(dblog.count_stored(), 1)
+        self.assertEqual(connection.execute(
+            "SELECT queued FROM pywps_stored_requests WHERE uuid = 'old'").fetchone()[0], 0)
+
+    def test_migrate_once(self):
+        dblog.get_connection()
+        dblog.close_connection()
+
+        connection = sqlite3.connect(self.database)
+        dblog._migrate(connection)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        connection.close()
+        self.assertEqual(version, dblog.SCHEMA_VERSION)
+
+    def test_newer_database(self):
+        connection = sqlite3.connect(self.database)
+        connection.execute('PRAGMA user_version = %i' % (dblog.SCHEMA_VERSION + 1))
+        dblog._migrate(connection)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        connection.close()
+        self.assertEqual(version, dblog.SCHEMA_VERSION + 1)
+
+
+class LeaseTest(DbLogTestCase):
+
+    def _store(self, uuid):
+        request = WPSRequest()
+        request.identifier = 'say_hello'
+        request.inputs = {}
+        request.outputs = {}
+        dblog.store_process(uuid, request, '/tmp/workdir')
+
+    def _get_lease(self, uuid):
+        return dblog.get_connection().execute("""
+            SELECT lease_owner, lease_expires FROM pywps_stored_requests WHERE uuid = ?
+        """, (uuid,)).fetchone()
+
+    def test_claim_in_queue_order(self):
+        self._store('first')
+        self._store('second')
+
+        claimed = dblog.claim_stored(60)
+        self.assertEqual(claimed[0], 'first')
+        self.assertEqual(claimed[1], 'say_hello')
+        self.assertEqual(claimed[2], '/tmp/workdir')
+        self.assertEqual(dblog.claim_stored(60)[0], 'second')
+        self.assertIsNone(dblog.claim_stored(60))
+
+    def test_claim_once(self):
+        self._store('job')
+        self.assertIsNotNone(dblog.claim_stored(60, 'job'))
+        self.assertIsNone(dblog.claim_stored(60, 'job'))
+        self.assertEqual(dblog.get_waiting(), [])
+
+    def test_claim_expired(self):
+        self._store('job')
+        self.assertIsNotNone(dblog.claim_stored(-1, 'job'))
+        owner = self._get_lease('job')[0]
+
+        # the worker died, the lease expired
+        self.assertIsNotNone(dblog.claim_stored(60, 'job'))
+        self.assertNotEqual(self._get_lease('job')[0], owner)
+
+    def test_renew_lease(self):
+        self._store('job')
+        dblog.claim_stored(1, 'job')
+        expires = self._get_lease('job')[1]
+
+        self.assertTrue(dblog.renew_lease('job', 60))
+        self.assertGreater(self._get_lease('job')[1], expires)
+        self.assertIsNone(dblog.claim_stored(60, 'job'))
+
+    def test_renew_not_leased(self):
+        self._store('job')
+        self.assertFalse(dblog.renew_lease('job', 60))
+        self.assertFalse(dblog.renew_lease('unknown', 60))
+
+    def test_hold_lease(self):
+        self._store('job')
+        dblog.claim_stored(0.3, 'job')
+
+        done = scheduler.hold_lease('job', 0.3)
+        try:
+            time.sleep(0.5)
+            # the heartbeat renewed the lease, nobody else takes the job
+            self.assertIsNone(dblog.claim_stored(60, 'job'))
+        finally:
+            done.set()
+
+        time.sleep(0.5)
+        self.assertIsNotNone(dblog.claim_stored(60, 'job'))
+
+    def test_claim_locked(self):
+        self._store('job')
+        dblog.get_connection().execute('PRAGMA busy_timeout = 0')
+        other = sqlite3.connect(self.database)
+        other.execute('BEGIN IMMEDIATE')
+        try:
+            self.assertRaises(sqlite3.OperationalError, dblog.claim_stored, 60, 'job')
+            # not retried until the lock is released
+            self.assertIsNone(scheduler.claim_next(60))
+        finally:
+            other.rollback()
+            other.close()
+
+        self.assertEqual(scheduler.claim_next(60)[0], 'job')
+
+    def test_remove_stored(self):
+        self._store('job')
+        dblog.claim_stored(60, 'job')
+        dblog.remove_stored('job')
+        self.assertEqual(dblog.count_stored(), 0)
+
+
+class ReserveTest(DbLogTestCase):
+
+    def test_reserve(self):
+        reservation = dblog.reserve_output(60, 'alice', total_quota=100)
+        self.assertIsNotNone(reservation)
+        self.assertIsNone(dblog.reserve_output(50, 'bob', total_quota=100))
+        self.assertIsNone(dblog.reserve_output(50, 'alice', owner_quota=100))
+        self.assertIsNotNone(dblog.reserve_output(50, 'bob', owner_quota=100))
+
+    def test_reserve_counts_queued(self):
+        configuration.config.set('server', 'logdatabase_writebehind', 'true')
+        dblog.record_output('job', 'alice', '/tmp/output.txt', 60)
+        self.assertIsNone(dblog.reserve_output(50, 'alice', total_quota=100))
+        self.assertIsNone(dblog.reserve_output(50, 'alice', owner_quota=100))
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(MigrationTest),
+        loader.loadTestsFromTestCase(LeaseTest),
+        loader.loadTestsFromTestCase(ReserveTest),
+    ]
+    return unittest.TestSuite(suite_list)
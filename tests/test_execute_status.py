@@ -0,0 +1,183 @@
+"""Unit tests for the status of asynchronous Execute requests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from pywps import configuration, dblog, jobstate, layout
+from pywps import Process, Service, LiteralInput, LiteralOutput
+from pywps.app.WPSResponse import WPSResponse
+
+NAMESPACES = {'wps': 'http://www.opengis.net/wps/1.0.0'}
+
+
+class HelloProcess(Process):
+    """Process recording the status written before its job is handed over
+
+    :param run: run the job at once, as a fast worker would, before the
+                response is built
+    """
+
+    def __init__(self, run=True):
+        super(HelloProcess, self).__init__(
+            self._handler,
+            identifier='hello',
+            title='Hello',
+            inputs=[LiteralInput('name', 'Name', data_type='string')],
+            outputs=[LiteralOutput('response', 'Response', data_type='string')],
+            store_supported=True,
+            status_supported=True
+        )
+        self.run = run
+        self.handed_over = []
+
+    def _handler(self, request, response):
+        response.outputs['response'].data = 'Hello %s' % request.inputs['name'][0].data
+        return response
+
+    def _run_async(self, wps_request, wps_response):
+        state = jobstate.get(self.uuid)
+        self.handed_over.append((get_status(self.status_location), state and state['status']))
+        if self.run:
+            self._run_process(wps_request, wps_response)
+
+
+def get_status(status_location):
+    """Return name of the status element of status document, None if there
+    is no document
+    """
+
+    if not os.path.exists(status_location):
+        return None
+    status = etree.parse(status_location).find('wps:Status', NAMESPACES)
+    return etree.QName(status[0]).localname
+
+
+class ExecuteStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        configuration.load_configuration()
+        for (option, value) in (('logdatabase', os.path.join(self.tmp_dir, 'log.sqlite')),
+                                ('logdatabase_writebehind', 'false'),
+                                ('outputpath', self.tmp_dir),
+                                ('workdir', self.tmp_dir),
+                                ('workerpool', 'false'),
+                                ('jobstate', 'memory')):
+            configuration.config.set('server', option, value)
+        self.service = None
+
+    def tearDown(self):
+        if self.service is not None:
+            self.service.stop_workers()
+        jobstate.stop()
+        dblog.close_connection()
+        shutil.rmtree(self.tmp_dir)
+
+    def _execute(self, process, status='true'):
+        self.service = Service([process])
+        self.service.start_workers()
+        client = Client(self.service, BaseResponse)
+        resp = client.get('?service=WPS&request=Execute&version=1.0.0&identifier=hello'
+                          '&DataInputs=name=foo&storeExecuteResponse=true&status=%s' % status)
+        self.assertEqual(resp.status_code, 200)
+
+        doc = etree.fromstring(resp.data)
+        uuid = doc.get('statusLocation').rsplit('/', 1)[1][:-len('.xml')]
+        return (doc, uuid)
+
+    def _get_logged(self, uuid):
+        dblog.flush()
+        return dblog.get_connection().execute(
+            'SELECT percent_done, status FROM pywps_requests WHERE uuid = ?', (uuid,)).fetchone()
+
+    def test_accepted_before_hand_over(self):
+        process = HelloProcess(run=False)
+        (doc, uuid) = self._execute(process)
+
+        self.assertEqual(process.handed_over, [('ProcessAccepted', 'accepted')])
+        self.assertIsNotNone(doc.find('wps:Status/wps:ProcessAccepted', NAMESPACES))
+        self.assertEqual(get_status(layout.find('%s.xml' % uuid)), 'ProcessAccepted')
+
+    def test_final_status_kept(self):
+        process = HelloProcess()
+        (_, uuid) = self._execute(process)
+
+        # the response of the service does not replace the status written
+        # by the job
+        self.assertEqual(process.handed_over, [('ProcessAccepted', 'accepted')])
+        self.assertEqual(get_status(layout.find('%s.xml' % uuid)), 'ProcessSucceeded')
+        self.assertEqual(jobstate.get(uuid)['status'], 'succeeded')
+        self.assertEqual(self._get_logged(uuid), (100, str(WPSResponse.DONE_STATUS)))
+
+    def test_finished_row_kept(self):
+        process = HelloProcess()
+        (_, uuid) = self._execute(process)
+
+        # accepted status written after the job finished
+        accepted = WPSResponse(process, None, uuid)
+        accepted.status = WPSResponse.STORE_AND_UPDATE_STATUS
+        dblog.update_response(uuid, accepted)
+        self.assertEqual(self._get_logged(uuid), (100, str(WPSResponse.DONE_STATUS)))
+
+    def test_failed_row_kept(self):
+        process = HelloProcess(run=False)
+        (_, uuid) = self._execute(process)
+
+        failed = WPSResponse(process, None, uuid)
+        failed.status = WPSResponse.STORE_AND_UPDATE_STATUS
+        failed.status_percentage = -1
+        dblog.update_response(uuid, failed)
+        failed.status_percentage = 50
+        dblog.update_response(uuid, failed)
+        self.assertEqual(self._get_logged(uuid), (-1, str(WPSResponse.STORE_AND_UPDATE_STATUS)))
+
+    def test_stored_sync(self):
+        process = HelloProcess()
+        (doc, uuid) = self._execute(process, status='false')
+
+        self.assertEqual(process.handed_over, [])
+        self.assertIsNotNone(doc.find('wps:Status/wps:ProcessSucceeded', NAMESPACES))
+        self.assertEqual(get_status(layout.find('%s.xml' % uuid)), 'ProcessSucceeded')
+
+
+class JobStateOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        configuration.load_configuration()
+        configuration.config.set('server', 'jobstate', 'memory')
+        jobstate.start()
+
+    def tearDown(self):
+        jobstate.stop()
+
+    def test_final_state_kept(self):
+        jobstate.put('job', 'started', 50, 'running', b'started')
+        jobstate.put('job', 'succeeded', 100, 'done', b'succeeded')
+        jobstate.put('job', 'accepted', 0, '', b'accepted')
+        jobstate.put('job', 'started', 50, 'running', b'started')
+
+        state = jobstate.get('job')
+        self.assertEqual(state['status'], 'succeeded')
+        self.assertEqual(state['document'], b'succeeded')
+
+    def test_failed_after_succeeded(self):
+        jobstate.put('job', 'succeeded', 100, 'done', b'succeeded')
+        jobstate.put('job', 'failed', -1, 'error', b'failed')
+        self.assertEqual(jobstate.get('job')['status'], 'failed')
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(ExecuteStatusTest),
+        loader.loadTestsFromTestCase(JobStateOrderTest),
+    ]
+    return unittest.TestSuite(suite_list)
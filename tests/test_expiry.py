@@ -0,0 +1,67 @@
+"""Unit tests for expiry of files in outputpath
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pywps import configuration, dblog, expiry, layout
+
+UUID = '3fa85f64-5717-11e7-b114-b2f933d5fe66'
+
+
+class ScanTest(unittest.TestCase):
+    """outputpath shared with the working directories, their pool and the
+    request log, as in default configuration
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        configuration.load_configuration()
+        for (option, value) in (('logdatabase', os.path.join(self.tmp_dir, 'pywps-log.sqlite')),
+                                ('logdatabase_writebehind', 'false'),
+                                ('outputpath', self.tmp_dir),
+                                ('workdir', self.tmp_dir)):
+            configuration.config.set('server', option, value)
+
+    def tearDown(self):
+        dblog.close_connection()
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_file(self, *names):
+        file_path = os.path.join(self.tmp_dir, *names)
+        layout.make_dirs(file_path)
+        open(file_path, 'w').close()
+        return file_path
+
+    def test_scan(self):
+        status_path = self._make_file('%s.xml' % UUID)
+        sharded_path = self._make_file('3f', 'a8', 'tmpa1b2c3.txt')
+        recorded_path = self._make_file('ab', 'tmpd4e5f6.txt')
+        dblog.record_output(UUID, None, recorded_path, 0)
+        skipped = [
+            self._make_file('tmpforeign.txt'),
+            self._make_file('pyws_process_x', 'input.txt'),
+            self._make_file('free', 'a' * 32, 'input.txt'),
+            self._make_file('3f', '%s.xml.1-2.tmp' % UUID),
+        ]
+        database = dblog.get_database()
+
+        self.assertEqual(expiry.scan(), 2)
+        self.assertTrue(dblog.is_output_recorded(status_path))
+        self.assertTrue(dblog.is_output_recorded(sharded_path))
+        for file_path in skipped + [database]:
+            self.assertFalse(dblog.is_output_recorded(file_path), file_path)
+
+        # recorded already
+        self.assertEqual(expiry.scan(), 0)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(ScanTest),
+    ]
+    return unittest.TestSuite(suite_list)
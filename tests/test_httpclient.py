@@ -0,0 +1,133 @@
+"""Unit tests for the pooled HTTP client
+"""
+
+import time
+import unittest
+
+from pywps import configuration, httpclient
+from pywps._compat import HTTPError
+
+from tests.httpserver import Reply, Server
+
+
+class HttpClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        configuration.load_configuration()
+        configuration.config.set('http', 'backoff', '0.01')
+        configuration.config.set('http', 'retries', '2')
+        httpclient.clear()
+        self.server = None
+
+    def tearDown(self):
+        httpclient.clear()
+        if self.server is not None:
+            self.server.stop()
+
+    def _start(self, *replies):
+        self.server = Server(replies).start()
+        return self.server
+
+    def _get(self, path='/', **kwargs):
+        response = httpclient.urlopen(self.server.url + path, **kwargs)
+        try:
+            return (response.code, response.read())
+        finally:
+            response.close()
+
+    def _get_ports(self):
+        return [port for (_, _, _, port, _) in self.server.requests]
+
+
+class PoolTest(HttpClientTestCase):
+
+    def test_connection_reused(self):
+        self._start(Reply(body=b'first'), Reply(body=b'second'))
+        self.assertEqual(self._get(), (200, b'first'))
+        self.assertEqual(self._get(), (200, b'second'))
+
+        ports = self._get_ports()
+        self.assertEqual(len(ports), 2)
+        self.assertEqual(ports[0], ports[1])
+
+    def test_reuse_after_server_closed(self):
+        self._start(Reply(body=b'first', close=True), Reply(body=b'second'))
+        self.assertEqual(self._get(), (200, b'first'))
+        # the server closed the pooled connection meanwhile
+        time.sleep(0.1)
+
+        self.assertEqual(self._get(), (200, b'second'))
+        ports = self._get_ports()
+        self.assertEqual(len(ports), 2)
+        self.assertNotEqual(ports[0], ports[1])
+
+    def test_unread_body_not_reused(self):
+        self._start(Reply(body=b'x' * (httpclient.DRAIN_SIZE + 1)), Reply(body=b'second'))
+        httpclient.urlopen(self.server.url).close()
+        self.assertEqual(self._get(), (200, b'second'))
+        ports = self._get_ports()
+        self.assertNotEqual(ports[0], ports[1])
+
+    def test_pool_size(self):
+        configuration.config.set('http', 'poolsize', '1')
+        self._start(Reply(body=b'data'))
+        responses = [httpclient.urlopen(self.server.url) for _ in range(2)]
+        for response in responses:
+            response.read()
+            response.close()
+        self.assertEqual(len(httpclient._POOLS[('http', self.server.url[7:])]), 1)
+
+
+class RetryTest(HttpClientTestCase):
+
+    def test_retry_limit(self):
+        self._start(Reply(503))
+        try:
+            self._get()
+            self.fail('HTTPError expected')
+        except HTTPError as e:
+            self.assertEqual(e.code, 503)
+        # first attempt and http->retries retries
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retry_succeeds(self):
+        self._start(Reply(502), Reply(body=b'data'))
+        self.assertEqual(self._get(), (200, b'data'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_post_not_retried(self):
+        self._start(Reply(503))
+        self.assertRaises(HTTPError, self._get, data=b'body')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.server.requests[0][4], b'body')
+
+    def test_no_retry_after_deadline(self):
+        configuration.config.set('http', 'backoff', '1')
+        self._start(Reply(503))
+        self.assertRaises(HTTPError, self._get, timeout=0.5)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_not_modified(self):
+        self._start(Reply(304, headers={'ETag': '"v1"'}))
+        try:
+            self._get(headers={'If-None-Match': '"v1"'})
+            self.fail('HTTPError expected')
+        except HTTPError as e:
+            self.assertEqual(e.code, 304)
+        self.assertEqual(self.server.requests[0][2]['if-none-match'], '"v1"')
+
+    def test_redirect(self):
+        self._start(Reply(302, headers={'Location': '/target'}), Reply(body=b'data'))
+        self.assertEqual(self._get('/source'), (200, b'data'))
+        self.assertEqual([path for (_, path, _, _, _) in self.server.requests],
+                         ['/source', '/target'])
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(PoolTest),
+        loader.loadTestsFromTestCase(RetryTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,240 @@
+"""Unit tests for layout of files in outputpath
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from pywps import configuration, dblog, layout
+from pywps.exceptions import NoApplicableCode
+
+UUID = '3fa85f64-5717-11e7-b114-b2f933d5fe66'
+
+
+class LayoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.outputpath = os.path.join(self.tmp_dir, 'outputs')
+        os.mkdir(self.outputpath)
+        configuration.load_configuration()
+        for (option, value) in (('logdatabase', os.path.join(self.tmp_dir, 'log.sqlite')),
+                                ('logdatabase_writebehind', 'false'),
+                                ('outputpath', self.outputpath),
+                                ('url', 'http://localhost/wps'),
+                                ('outputurl', '/outputs/')):
+            configuration.config.set('server', option, value)
+
+    def tearDown(self):
+        dblog.close_connection()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_status(self, file_path, output_url):
+        with open(file_path, 'w') as f:
+            f.write('<wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0" '
+                    'statusLocation="/outputs/%s.xml">'
+                    '<wps:Reference href="%s" mimeType="text/plain"/>'
+                    '</wps:ExecuteResponse>' % (UUID, output_url))
+
+    def _read(self, file_path):
+        with open(file_path) as f:
+            return f.read()
+
+
+class PathTest(LayoutTestCase):
+
+    def test_levels(self):
+        self.assertEqual(layout.get_levels('flat'), [])
+        self.assertEqual(layout.get_levels(''), [])
+        self.assertEqual(layout.get_levels('2/2'), [2, 2])
+        self.assertEqual(layout.get_levels('/3/'), [3])
+        for invalid in ('0/2', '5', 'a/b', '2//2'):
+            self.assertRaises(NoApplicableCode, layout.get_levels, invalid)
+
+    def test_levels_configured(self):
+        self.assertEqual(layout.get_levels(), [])
+        configuration.config.set('server', 'outputlayout', '1/2')
+        self.assertEqual(layout.get_levels(), [1, 2])
+
+    def test_shards(self):
+        self.assertEqual(layout.get_shards('%s.xml' % UUID, []), [])
+        self.assertEqual(layout.get_shards('%s.xml' % UUID, [2, 2]), ['3f', 'a8'])
+        self.assertEqual(layout.get_shards('ABCDEF.tif', [2]), ['ab'])
+
+        # names not starting with hexadecimal digits are hashed
+        digest = hashlib.md5(b'output.tif').hexdigest()
+        self.assertEqual(layout.get_shards('output.tif', [2, 2]), [digest[:2], digest[2:4]])
+        self.assertEqual(layout.get_shards('ab', [2, 2]), ['18', '7e'])
+
+    def test_path_and_url(self):
+        name = '%s.xml' % UUID
+        self.assertEqual(layout.get_relative_path(name, [2, 2]), os.path.join('3f', 'a8', name))
+        self.assertEqual(layout.get_relative_url(name, [2, 2]), '3f/a8/%s' % name)
+        self.assertEqual(layout.get_relative_url(name, []), name)
+        self.assertEqual(layout.get_path(name, [2, 2]),
+                         os.path.join(self.outputpath, '3f', 'a8', name))
+        self.assertEqual(layout.get_path(name, [], '/data'), os.path.join('/data', name))
+
+    def test_find(self):
+        name = '%s.xml' % UUID
+        configuration.config.set('server', 'outputlayout', '2/2')
+        self.assertIsNone(layout.find(name))
+
+        # not migrated yet
+        flat_path = os.path.join(self.outputpath, name)
+        open(flat_path, 'w').close()
+        self.assertEqual(layout.find(name), flat_path)
+
+        sharded_path = layout.get_path(name)
+        layout.make_dirs(sharded_path)
+        open(sharded_path, 'w').close()
+        self.assertEqual(layout.find(name), sharded_path)
+
+    def test_create_file(self):
+        flat = layout.create_file('out', '.tif')
+        self.assertEqual(os.path.dirname(flat), self.outputpath)
+        self.assertTrue(os.path.basename(flat).startswith('out'))
+
+        configuration.config.set('server', 'outputlayout', '2/2')
+        sharded = layout.create_file('out', '.tif')
+        name = os.path.basename(sharded)
+        self.assertTrue(name.endswith('-out.tif'))
+        self.assertEqual(sharded, layout.get_path(name))
+        self.assertTrue(os.path.isfile(sharded))
+        self.assertNotEqual(layout.create_file('out', '.tif'), sharded)
+
+
+class MigrateTest(LayoutTestCase):
+
+    def test_migrate(self):
+        status_name = '%s.xml' % UUID
+        output_name = 'tmpa1b2c3.txt'
+        status_path = os.path.join(self.outputpath, status_name)
+        output_path = os.path.join(self.outputpath, output_name)
+        self._write_status(status_path, 'http://localhost/wps/outputs/%s' % output_name)
+        with open(output_path, 'w') as f:
+            f.write('output')
+        dblog.record_output(UUID, None, status_path, 100)
+        dblog.record_output(UUID, None, output_path, 6)
+
+        self.assertEqual(layout.migrate(levels=[2, 2]), 2)
+
+        new_status_path = layout.get_path(status_name, [2, 2])
+        new_output_path = layout.get_path(output_name, [2, 2])
+        self.assertFalse(os.path.exists(status_path))
+        self.assertEqual(self._read(new_output_path), 'output')
+        status = self._read(new_status_path)
+        self.assertIn('statusLocation="/outputs/3f/a8/%s"' % status_name, status)
+        self.assertIn('href="http://localhost/wps/outputs/%s"' %
+                      layout.get_relative_url(output_name, [2, 2]), status)
+        self.assertTrue(dblog.is_output_recorded(new_status_path))
+        self.assertTrue(dblog.is_output_recorded(new_output_path))
+        self.assertFalse(dblog.is_output_recorded(status_path))
+
+        # nothing left to move
+        self.assertEqual(layout.migrate(levels=[2, 2]), 0)
+
+        # and back, prefix directories are removed
+        self.assertEqual(layout.migrate(levels=[]), 2)
+        self.assertEqual(sorted(os.listdir(self.outputpath)), sorted([output_name, status_name]))
+        self.assertIn('statusLocation="/outputs/%s"' % status_name, self._read(status_path))
+        self.assertTrue(dblog.is_output_recorded(output_path))
+
+    def test_migrate_skips_temporary(self):
+        temp_path = os.path.join(self.outputpath, '%s.xml.1-2.tmp' % UUID)
+        open(temp_path, 'w').close()
+        self.assertEqual(layout.migrate(levels=[2, 2]), 0)
+        self.assertTrue(os.path.exists(temp_path))
+
+    def test_migrate_keeps_existing(self):
+        name = '%s.xml' % UUID
+        flat_path = os.path.join(self.outputpath, name)
+        sharded_path = layout.get_path(name, [2, 2])
+        self._write_status(flat_path, '')
+        layout.make_dirs(sharded_path)
+        self._write_status(sharded_path, 'sharded')
+
+        self.assertEqual(layout.migrate(levels=[2, 2]), 0)
+        self.assertTrue(os.path.exists(flat_path))
+        self.assertIn('href="sharded"', self._read(sharded_path))
+
+
+class SharedOutputPathTest(LayoutTestCase):
+    """outputpath shared with the working directories, their pool and the
+    request log, as in default configuration
+    """
+
+    def setUp(self):
+        super(SharedOutputPathTest, self).setUp()
+        for option in ('workdir', 'workdir_pool_path'):
+            configuration.config.set('server', option, self.outputpath)
+        configuration.config.set('server', 'logdatabase',
+                                 os.path.join(self.outputpath, 'pywps-log.sqlite'))
+
+    def _make_file(self, *names):
+        file_path = os.path.join(self.outputpath, *names)
+        layout.make_dirs(file_path)
+        with open(file_path, 'w') as f:
+            f.write('data')
+        return file_path
+
+    def test_migrate_shared(self):
+        status_name = '%s.xml' % UUID
+        status_path = os.path.join(self.outputpath, status_name)
+        output_path = self._make_file('tmpa1b2c3.txt')
+        self._write_status(status_path, '')
+        dblog.record_output(UUID, None, output_path, 4)
+
+        foreign = [
+            self._make_file('tmpforeign'),
+            self._make_file('abcdef0123.txt'),
+            self._make_file('pyws_process_x', 'input.txt'),
+            self._make_file('free', 'a' * 32, 'input.txt'),
+            self._make_file('dirty', 'b' * 32, 'input.txt'),
+            # directory with name of prefix directory in working directory
+            self._make_file('pyws_process_y', 'ab', 'input.txt'),
+        ]
+        os.mkdir(os.path.join(self.outputpath, 'reset'))
+        os.mkdir(os.path.join(self.outputpath, 'free', 'c' * 32))
+        database = dblog.get_database()
+        self.assertTrue(os.path.exists(database))
+
+        self.assertEqual(layout.migrate(levels=[2, 2]), 2)
+        self.assertTrue(os.path.isfile(layout.get_path(status_name, [2, 2])))
+        self.assertTrue(os.path.isfile(layout.get_path('tmpa1b2c3.txt', [2, 2])))
+        for file_path in foreign + [database]:
+            self.assertTrue(os.path.isfile(file_path), file_path)
+
+        self.assertEqual(layout.migrate(levels=[]), 2)
+        self.assertTrue(os.path.isfile(status_path))
+        self.assertTrue(os.path.isfile(output_path))
+        for file_path in foreign + [database]:
+            self.assertTrue(os.path.isfile(file_path), file_path)
+        # empty directories, which are not prefix directories, are kept
+        self.assertTrue(os.path.isdir(os.path.join(self.outputpath, 'reset')))
+        self.assertTrue(os.path.isdir(os.path.join(self.outputpath, 'free', 'c' * 32)))
+
+    def test_walk(self):
+        status_path = os.path.join(self.outputpath, '%s.xml' % UUID)
+        self._write_status(status_path, '')
+        sharded_path = self._make_file('3f', 'a8', 'output.txt')
+        self._make_file('pyws_process_x', 'input.txt')
+        self._make_file('free', 'a' * 32, 'input.txt')
+        self._make_file('%s.xml.1-2.tmp' % UUID)
+        dblog.record_output(UUID, None, status_path, 100)
+
+        self.assertEqual(sorted(layout.walk()),
+                         sorted([(status_path, False), (sharded_path, True)]))
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(PathTest),
+        loader.loadTestsFromTestCase(MigrateTest),
+        loader.loadTestsFromTestCase(SharedOutputPathTest),
+    ]
+    return unittest.TestSuite(suite_list)
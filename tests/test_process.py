@@ -0,0 +1,193 @@
+"""Unit tests for copies of processes executing the requests
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from lxml import etree
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from pywps import configuration, dblog
+from pywps import Process, Service, LiteralInput, LiteralOutput
+
+NAMESPACES = {'wps': 'http://www.opengis.net/wps/1.0.0'}
+
+
+class EchoProcess(Process):
+    """Process writing its input to its working directory
+    """
+
+    def __init__(self):
+        super(EchoProcess, self).__init__(
+            self._handler,
+            identifier='echo',
+            title='Echo',
+            inputs=[LiteralInput('name', 'Name', data_type='string')],
+            outputs=[LiteralOutput('response', 'Response', data_type='string')]
+        )
+
+    def _handler(self, request, response):
+        name = request.inputs['name'][0].data
+        with open(os.path.join(self.workdir, 'name.txt'), 'w') as f:
+            f.write(name)
+        # let the other requests run meanwhile
+        time.sleep(0.1)
+        with open(os.path.join(self.workdir, 'name.txt')) as f:
+            response.outputs['response'].data = '%s %s' % (f.read(), self.workdir)
+        return response
+
+
+def echo_handler(request, response):
+    return response
+
+
+class NewInstanceTest(unittest.TestCase):
+
+    def test_copy(self):
+        process = EchoProcess()
+        instance = process.new_instance('/tmp/workdir')
+
+        self.assertIsNot(instance, process)
+        self.assertEqual(instance.identifier, 'echo')
+        self.assertEqual(instance.workdir, '/tmp/workdir')
+        self.assertIsNone(instance.uuid)
+
+        self.assertEqual([inpt.identifier for inpt in instance.inputs], ['name'])
+        self.assertIsNot(instance.inputs[0], process.inputs[0])
+        self.assertEqual(instance.inputs[0].workdir, '/tmp/workdir')
+        self.assertEqual([outpt.identifier for outpt in instance.outputs], ['response'])
+        self.assertIsNot(instance.outputs[0], process.outputs[0])
+        self.assertEqual(instance.outputs[0].workdir, '/tmp/workdir')
+
+    def test_template_unchanged(self):
+        process = EchoProcess()
+        instance = process.new_instance('/tmp/workdir')
+        instance._set_uuid('3fa85f64-5717-11e7-b114-b2f933d5fe66')
+        instance.outputs[0].data = 'data'
+
+        self.assertIsNone(process.workdir)
+        self.assertIsNone(process.uuid)
+        self.assertEqual(process.status_location, '')
+        self.assertIsNone(process.inputs[0].workdir)
+        self.assertIsNone(process.outputs[0].workdir)
+        self.assertIsNone(process.outputs[0].data)
+
+    def test_handler_bound_to_copy(self):
+        process = EchoProcess()
+        instance = process.new_instance()
+        self.assertIs(instance.handler.__self__, instance)
+        self.assertIs(process.handler.__self__, process)
+
+    def test_function_handler(self):
+        process = Process(echo_handler, 'echo', 'Echo')
+        self.assertIs(process.new_instance().handler, echo_handler)
+
+    def test_instances_independent(self):
+        process = EchoProcess()
+        first = process.new_instance('/tmp/first')
+        second = process.new_instance('/tmp/second')
+        first.set_workdir('/tmp/other')
+        self.assertEqual(second.workdir, '/tmp/second')
+        self.assertEqual(second.inputs[0].workdir, '/tmp/second')
+
+
+class DescribeCacheTest(unittest.TestCase):
+
+    def test_cached(self):
+        process = EchoProcess()
+        fragment = process.describe_fragment()
+        self.assertIs(process.describe_fragment(), fragment)
+
+        # requests change their copies only
+        instance = process.new_instance('/tmp/workdir')
+        instance.inputs[0].data = 'name'
+        instance.outputs[0].data = 'response'
+        self.assertIs(process.describe_fragment(), fragment)
+
+    def test_input_changed(self):
+        process = EchoProcess()
+        process.describe_fragment()
+        process.inputs[0].title = 'Your name'
+        self.assertIn(b'Your name', process.describe_fragment())
+
+    def test_output_changed(self):
+        process = EchoProcess()
+        process.describe_fragment()
+        process.outputs[0].abstract = 'Greeting'
+        self.assertIn(b'Greeting', process.describe_fragment())
+
+    def test_inputs_replaced(self):
+        process = EchoProcess()
+        process.describe_fragment()
+        process.inputs.append(LiteralInput('count', 'Count', data_type='integer'))
+        self.assertIn(b'count', process.describe_fragment())
+
+
+class ConcurrentExecuteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        configuration.load_configuration()
+        for (option, value) in (('logdatabase', os.path.join(self.tmp_dir, 'log.sqlite')),
+                                ('outputpath', self.tmp_dir),
+                                ('workdir', self.tmp_dir),
+                                ('workerpool', 'false'),
+                                ('jobstate', 'none'),
+                                ('parallelprocesses', '8')):
+            configuration.config.set('server', option, value)
+        self.service = None
+
+    def tearDown(self):
+        if self.service is not None:
+            self.service.stop_workers()
+        # log written behind, before the database is removed
+        dblog.flush()
+        dblog.close_connection()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_threads(self):
+        process = EchoProcess()
+        self.service = Service([process])
+        cwd = os.getcwd()
+        results = {}
+
+        def execute(index):
+            client = Client(self.service, BaseResponse)
+            resp = client.get('?service=WPS&request=Execute&version=1.0.0&identifier=echo'
+                              '&DataInputs=name=n%i' % index)
+            data = etree.fromstring(resp.data).find(
+                'wps:ProcessOutputs/wps:Output/wps:Data/wps:LiteralData', NAMESPACES)
+            results[index] = data.text.split(' ', 1)
+
+        threads = [threading.Thread(target=execute, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), list(range(8)))
+        for (index, (name, workdir)) in results.items():
+            self.assertEqual(name, 'n%i' % index)
+            # the working directory was cleaned
+            self.assertFalse(os.path.exists(workdir))
+        self.assertEqual(len(set(workdir for (_, workdir) in results.values())), 8)
+
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertIsNone(process.workdir)
+        self.assertIsNone(process.uuid)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(NewInstanceTest),
+        loader.loadTestsFromTestCase(DescribeCacheTest),
+        loader.loadTestsFromTestCase(ConcurrentExecuteTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,226 @@
+"""Unit tests for the on-disk cache of reference inputs
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from pywps import configuration, httpclient, refcache
+from pywps import ComplexInput, Format
+
+from tests.httpserver import Reply, Server
+
+# pywps.app.Service is shadowed by the class in pywps.app
+import pywps.app.Service
+service_module = sys.modules['pywps.app.Service']
+
+
+class RefCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'cache')
+        configuration.load_configuration()
+        configuration.config.set('server', 'cache_path', self.cache_path)
+        refcache._SIZE[:] = [None, 0, 0]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _download(self, content):
+        (fd, file_name) = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        return file_name
+
+    def _store(self, href, content, etag='"v1"'):
+        datain = {'href': href}
+        refcache.store(refcache.get_key(datain), datain, {'ETag': etag},
+                       self._download(content), hashlib.sha256(content).hexdigest())
+        return refcache.get_key(datain)
+
+    def _read(self, file_name):
+        with open(file_name, 'rb') as f:
+            return f.read()
+
+
+class KeyTest(RefCacheTestCase):
+
+    def test_headers(self):
+        plain = refcache.get_key({'href': 'http://example.com/data'})
+        alice = refcache.get_key({'href': 'http://example.com/data',
+                                  'header': {'Authorization': 'alice'}})
+        bob = refcache.get_key({'href': 'http://example.com/data',
+                                'header': {'Authorization': 'bob'}})
+        self.assertEqual(len(set([plain, alice, bob])), 3)
+
+        # header names are case insensitive, their order does not matter
+        self.assertEqual(refcache.get_key({'href': 'http://example.com/data',
+                                           'header': {'authorization': 'alice'}}), alice)
+        self.assertEqual(
+            refcache.get_key({'href': 'http://example.com/data',
+                              'header': {'Accept': 'text/csv', 'Authorization': 'alice'}}),
+            refcache.get_key({'href': 'http://example.com/data',
+                              'header': {'authorization': 'alice', 'accept': 'text/csv'}}))
+
+    def test_method_and_body(self):
+        get = refcache.get_key({'href': 'http://example.com/data'})
+        post = refcache.get_key({'href': 'http://example.com/data', 'method': 'POST',
+                                 'body': 'a=1'})
+        other = refcache.get_key({'href': 'http://example.com/data', 'method': 'POST',
+                                  'body': 'a=2'})
+        self.assertEqual(len(set([get, post, other])), 3)
+
+
+class StoreTest(RefCacheTestCase):
+
+    def test_store_and_restore(self):
+        key = self._store('http://example.com/data', b'data')
+        entry = refcache.lookup(key)
+        self.assertEqual(entry['etag'], '"v1"')
+        self.assertEqual(entry['size'], 4)
+        self.assertEqual(refcache.get_headers(entry), {'If-None-Match': '"v1"'})
+
+        target = os.path.join(self.tmp_dir, 'restored')
+        refcache.restore(entry, target)
+        self.assertEqual(self._read(target), b'data')
+
+    def test_same_content_stored_once(self):
+        first = self._store('http://example.com/first', b'data')
+        second = self._store('http://example.com/second', b'data')
+        self.assertEqual(refcache.lookup(first)['digest'], refcache.lookup(second)['digest'])
+        self.assertEqual(refcache._scan_size(self.cache_path), 4)
+
+    def test_cacheable(self):
+        self.assertTrue(refcache.is_cacheable({'ETag': '"v1"'}))
+        self.assertTrue(refcache.is_cacheable({'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}))
+        self.assertFalse(refcache.is_cacheable({}))
+        self.assertFalse(refcache.is_cacheable({'ETag': '"v1"', 'Cache-Control': 'no-store'}))
+        configuration.config.set('server', 'cache_path', '')
+        self.assertFalse(refcache.is_cacheable({'ETag': '"v1"'}))
+
+
+class EvictTest(RefCacheTestCase):
+
+    def _age(self, key, seconds):
+        object_file = refcache._get_object_file(self.cache_path, refcache.lookup(key)['digest'])
+        mtime = time.time() - seconds
+        os.utime(object_file, (mtime, mtime))
+
+    def test_least_recently_used(self):
+        old = self._store('http://example.com/old', b'old data')
+        used = self._store('http://example.com/used', b'used data')
+        new = self._store('http://example.com/new', b'new data')
+        self._age(old, 30)
+        self._age(used, 20)
+        self._age(new, 10)
+
+        # restored file is recently used
+        refcache.restore(refcache.lookup(used), os.path.join(self.tmp_dir, 'restored'))
+
+        self.assertEqual(refcache.evict(20), 1)
+        self.assertIsNone(refcache.lookup(old))
+        self.assertIsNotNone(refcache.lookup(used))
+        self.assertIsNotNone(refcache.lookup(new))
+        # record of the evicted file is removed
+        self.assertFalse(os.path.exists(refcache._get_key_file(self.cache_path, old)))
+
+    def test_evicted_when_full(self):
+        # 20 bytes
+        configuration.config.set('server', 'cache_maxsize', '%fkb' % (20 / 1024.0))
+        old = self._store('http://example.com/old', b'x' * 10)
+        self._age(old, 10)
+        new = self._store('http://example.com/new', b'y' * 15)
+
+        self.assertIsNone(refcache.lookup(old))
+        self.assertIsNotNone(refcache.lookup(new))
+        self.assertEqual(refcache._SIZE[1], 15)
+
+    def test_too_big_not_stored(self):
+        configuration.config.set('server', 'cache_maxsize', '%fkb' % (10 / 1024.0))
+        self.assertIsNone(refcache.lookup(self._store('http://example.com/big', b'x' * 11)))
+
+
+class RevalidateTest(RefCacheTestCase):
+
+    def setUp(self):
+        super(RevalidateTest, self).setUp()
+        httpclient.clear()
+        self.server = None
+
+    def tearDown(self):
+        httpclient.clear()
+        if self.server is not None:
+            self.server.stop()
+        super(RevalidateTest, self).tearDown()
+
+    def _fetch(self, datain):
+        file_name = os.path.join(self.tmp_dir, 'input%i' % len(self.server.requests))
+        complexinput = ComplexInput('data', 'Data', supported_formats=[Format('text/csv')])
+        service_module._fetch_reference(datain, file_name, 1024 * 1024, complexinput)
+        return self._read(file_name)
+
+    def test_not_modified(self):
+        self.server = Server([Reply(body=b'data', headers={'ETag': '"v1"'}),
+                              Reply(304, headers={'ETag': '"v1"'}),
+                              Reply(body=b'new data', headers={'ETag': '"v2"'})]).start()
+        datain = {'href': self.server.url + '/data.csv'}
+
+        self.assertEqual(self._fetch(datain), b'data')
+        self.assertNotIn('if-none-match', self.server.requests[0][2])
+
+        # revalidated, taken from the cache
+        self.assertEqual(self._fetch(datain), b'data')
+        self.assertEqual(self.server.requests[1][2]['if-none-match'], '"v1"')
+
+        # changed on the server
+        self.assertEqual(self._fetch(datain), b'new data')
+        self.assertEqual(self.server.requests[2][2]['if-none-match'], '"v1"')
+        self.assertEqual(refcache.lookup(refcache.get_key(datain))['etag'], '"v2"')
+
+    def test_evicted_after_not_modified(self):
+        self.server = Server([Reply(body=b'data', headers={'ETag': '"v1"'}),
+                              Reply(304, headers={'ETag': '"v1"'}),
+                              Reply(body=b'data', headers={'ETag': '"v1"'})]).start()
+        datain = {'href': self.server.url + '/data.csv'}
+        self._fetch(datain)
+        entry = refcache.lookup(refcache.get_key(datain))
+
+        # the file is evicted between the lookup and the restore
+        original_lookup = refcache.lookup
+        refcache.lookup = lambda key: entry
+        try:
+            os.remove(refcache._get_object_file(self.cache_path, entry['digest']))
+            self.assertEqual(self._fetch(datain), b'data')
+        finally:
+            refcache.lookup = original_lookup
+
+        # downloaded again without the conditional header
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertNotIn('if-none-match', self.server.requests[2][2])
+
+    def test_keys_differ_by_header(self):
+        self.server = Server([Reply(body=b'alice', headers={'ETag': '"a"'}),
+                              Reply(body=b'bob', headers={'ETag': '"b"'})]).start()
+        href = self.server.url + '/data.csv'
+        self.assertEqual(self._fetch({'href': href, 'header': {'Authorization': 'alice'}}),
+                         b'alice')
+        self.assertEqual(self._fetch({'href': href, 'header': {'Authorization': 'bob'}}), b'bob')
+        # no conditional request for the other user
+        self.assertNotIn('if-none-match', self.server.requests[1][2])
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(KeyTest),
+        loader.loadTestsFromTestCase(StoreTest),
+        loader.loadTestsFromTestCase(EvictTest),
+        loader.loadTestsFromTestCase(RevalidateTest),
+    ]
+    return unittest.TestSuite(suite_list)
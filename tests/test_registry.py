@@ -0,0 +1,74 @@
+"""Unit tests for the Service shared by the wps controller of the app
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pywps import configuration, dblog
+from tethysapp.pywps4 import registry
+
+# pywps.app.Service is shadowed by the class in pywps.app
+service_module = sys.modules['pywps.app.Service']
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        configuration.load_configuration()
+        for (option, value) in (('logdatabase', os.path.join(self.tmp_dir, 'log.sqlite')),
+                                ('outputpath', self.tmp_dir),
+                                ('workdir', self.tmp_dir),
+                                ('workerpool', 'false'),
+                                ('jobstate', 'none')):
+            configuration.config.set('server', option, value)
+        self.processes = registry.PROCESSES
+        registry.PROCESSES = [('processes.sayhello', 'SayHello')]
+
+    def tearDown(self):
+        with registry._LOCK:
+            if registry._SERVICE is not None:
+                registry._SERVICE.stop_workers()
+                registry._SERVICE = None
+        registry.PROCESSES = self.processes
+        dblog.close_connection()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reload_stops_old_service(self):
+        old = registry.get_service()
+        self.assertIs(registry.get_service(), old)
+        self.assertIsNotNone(old._dispatcher)
+        self.assertIn(old, service_module._STARTED)
+
+        # not changed
+        self.assertIs(registry.reload_service(), old)
+
+        new = registry.reload_service(force=True)
+        self.assertIsNot(new, old)
+        self.assertIsNone(old._dispatcher)
+        self.assertNotIn(old, service_module._STARTED)
+        self.assertIsNotNone(new._dispatcher)
+        self.assertIn(new, service_module._STARTED)
+        self.assertIs(registry.get_service(), new)
+
+    def test_failed_reload(self):
+        old = registry.get_service()
+        registry.PROCESSES = [('processes.missing', 'Missing')]
+        self.assertRaises(ImportError, registry.reload_service, True)
+        self.assertIsNone(old._dispatcher)
+        self.assertIsNone(registry._SERVICE)
+
+        registry.PROCESSES = [('processes.sayhello', 'SayHello')]
+        self.assertIsNot(registry.get_service(), old)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(ReloadTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,50 @@
+"""Unit tests for the owner of the requests used by the scheduler
+"""
+
+import unittest
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from pywps import configuration
+from pywps.app.WPSRequest import WPSRequest
+
+QUERY = 'service=wps&request=GetCapabilities'
+
+
+class OwnerTest(unittest.TestCase):
+
+    def setUp(self):
+        configuration.load_configuration()
+
+    def _get_owner(self, headers=None, remote_user=None):
+        environ = EnvironBuilder(query_string=QUERY, headers=headers,
+                                 environ_base={'REMOTE_ADDR': '192.0.2.1'}).get_environ()
+        if remote_user:
+            environ['REMOTE_USER'] = remote_user
+        return WPSRequest(Request(environ)).owner
+
+    def test_remote_addr(self):
+        self.assertEqual(self._get_owner(), '192.0.2.1')
+
+    def test_header_not_trusted(self):
+        self.assertEqual(self._get_owner({'X-API-Key': 'alice'}), '192.0.2.1')
+
+    def test_remote_user(self):
+        self.assertEqual(self._get_owner({'X-API-Key': 'alice'}, 'bob'), 'bob')
+
+    def test_trusted_header(self):
+        configuration.config.set('scheduler', 'owner_header', 'X-API-Key')
+        self.assertEqual(self._get_owner({'X-API-Key': 'alice'}), 'alice')
+        self.assertEqual(self._get_owner(), '192.0.2.1')
+        # authenticated user is not replaced by the header
+        self.assertEqual(self._get_owner({'X-API-Key': 'alice'}, 'bob'), 'bob')
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(OwnerTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,147 @@
+"""Unit tests for the pool of working directories
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pywps import configuration, workdirs
+
+
+class WorkdirsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pool_path = os.path.join(self.tmp_dir, 'pool')
+        os.mkdir(self.pool_path)
+        configuration.load_configuration()
+        configuration.config.set('server', 'workdir', self.tmp_dir)
+        configuration.config.set('server', 'workdir_pool_path', self.pool_path)
+        del workdirs._FREE[:]
+
+    def tearDown(self):
+        workdirs.stop()
+        del workdirs._FREE[:]
+        shutil.rmtree(self.tmp_dir)
+
+    def _set_size(self, size):
+        configuration.config.set('server', 'workdir_pool', str(size))
+
+    def _list(self, subdir):
+        return sorted(workdirs._list_dir(os.path.join(self.pool_path, subdir)))
+
+
+class NoPoolTest(WorkdirsTestCase):
+
+    def test_acquire_release(self):
+        self._set_size(0)
+        workdir = workdirs.acquire()
+        self.assertEqual(os.path.dirname(workdir), self.tmp_dir)
+        self.assertTrue(os.path.basename(workdir).startswith(workdirs.PREFIX))
+        self.assertEqual(os.listdir(workdir), [])
+
+        open(os.path.join(workdir, 'input.txt'), 'w').close()
+        workdirs.release(workdir)
+        self.assertFalse(os.path.exists(workdir))
+        # released already
+        workdirs.release(workdir)
+
+    def test_reset(self):
+        self._set_size(0)
+        self.assertEqual(workdirs.reset(), 0)
+        self.assertEqual(os.listdir(self.pool_path), [])
+
+
+class PoolTest(WorkdirsTestCase):
+
+    def setUp(self):
+        super(PoolTest, self).setUp()
+        self._set_size(2)
+
+    def test_reset_fills_pool(self):
+        self.assertEqual(workdirs.reset(), 0)
+        self.assertEqual(len(self._list('free')), 2)
+        self.assertEqual(self._list('dirty'), [])
+
+    def test_acquire_from_pool(self):
+        workdirs.reset()
+        free = self._list('free')
+
+        workdir = workdirs.acquire()
+        self.assertEqual(os.path.dirname(workdir), self.pool_path)
+        self.assertIn(os.path.basename(workdir)[len(workdirs.PREFIX):], free)
+        self.assertEqual(len(self._list('free')), 1)
+
+        other = workdirs.acquire()
+        self.assertNotEqual(other, workdir)
+        self.assertEqual(self._list('free'), [])
+
+        # pool is empty, new directory is made
+        third = workdirs.acquire()
+        self.assertEqual(os.path.dirname(third), self.tmp_dir)
+
+    def test_release_and_reset(self):
+        workdirs.reset()
+        workdir = workdirs.acquire()
+        name = os.path.basename(workdir)[len(workdirs.PREFIX):]
+        os.mkdir(os.path.join(workdir, 'data'))
+        open(os.path.join(workdir, 'data', 'input.txt'), 'w').close()
+
+        workdirs.release(workdir)
+        self.assertFalse(os.path.exists(workdir))
+        self.assertEqual(self._list('dirty'), [name])
+
+        self.assertEqual(workdirs.reset(), 1)
+        self.assertEqual(self._list('dirty'), [])
+        self.assertIn(name, self._list('free'))
+        self.assertEqual(os.listdir(os.path.join(self.pool_path, 'free', name)), [])
+
+        # the emptied directory is reused
+        del workdirs._FREE[:]
+        reused = set(os.path.basename(workdirs.acquire()) for _ in range(2))
+        self.assertIn(workdirs.PREFIX + name, reused)
+
+    def test_reset_keeps_size(self):
+        workdirs.reset()
+        acquired = [workdirs.acquire() for _ in range(2)]
+        workdirs.reset()
+        self.assertEqual(len(self._list('free')), 2)
+
+        for workdir in acquired:
+            workdirs.release(workdir)
+        self.assertEqual(workdirs.reset(), 2)
+        # directories over the size are removed
+        self.assertEqual(len(self._list('free')), 2)
+        self.assertEqual(self._list('reset'), [])
+
+    def test_release_foreign(self):
+        workdirs.reset()
+        workdir = tempfile.mkdtemp(prefix=workdirs.PREFIX, dir=self.tmp_dir)
+        workdirs.release(workdir)
+        self.assertFalse(os.path.exists(workdir))
+        self.assertEqual(self._list('dirty'), [])
+
+    def test_background_reset(self):
+        workdirs.start()
+        deadline = time.time() + 5
+        while len(self._list('free')) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        workdir = workdirs.acquire()
+        workdirs.release(workdir)
+
+        while (self._list('dirty') or len(self._list('free')) < 2) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self._list('dirty'), [])
+        self.assertEqual(len(self._list('free')), 2)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(NoPoolTest),
+        loader.loadTestsFromTestCase(PoolTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -2,22 +2,17 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 
 
-from processes.sleep import Sleep
-from processes.ultimate_question import UltimateQuestion
-from processes.centroids import Centroids
-from processes.sayhello import SayHello
-from processes.feature_count import FeatureCount
-from processes.buffer import Buffer
-from processes.area import Area
-from processes.bboxinout import Box
-from pywps.app.Service import Service
 from werkzeug.wrappers import Request as werkzeug_Request
 
 import os
 import uuid
 from pywps.app.WPSRequest import WPSRequest
 from pywps.dblog import log_request, update_response
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from .registry import get_service
+
+# build the shared Service when the app is loaded, not on first request
+get_service()
 
 @login_required()
 def home(request):
@@ -32,23 +27,25 @@ def home(request):
     return render(request, 'pywps4/home.html', context)
 
 
+def _get_environ(request):
+    """
+    WSGI environ of the request, with REMOTE_USER set to the authenticated
+    Django user, PyWPS takes it for the owner of the request.
+    """
+    environ = dict(request.environ)
+    environ.pop('REMOTE_USER', None)
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated():
+        environ['REMOTE_USER'] = user.get_username()
+    return environ
+
+
 #http://127.0.0.1:8000/apps/pywps4/wps/?service=wps&request=GetCapabilities
 #http://127.0.0.1:8000/apps/pywps4/wps/?Request=DescribeProcess&Service=WPS&Version=1.0.0&Identifier=area
 def wps(request):
 
-    processes = [
-        FeatureCount(),
-        SayHello(),
-        Centroids(),
-        UltimateQuestion(),
-        Sleep(),
-        Buffer(),
-        Area(),
-        Box()
-    ]
-    service = Service(processes=processes)
-    http_request = werkzeug_Request(request.environ)
-    print type(http_request)
+    service = get_service()
+    http_request = werkzeug_Request(_get_environ(request))
 
 
 
@@ -62,13 +59,29 @@ def wps(request):
     # try:
     wps_request = WPSRequest(http_request)
     # LOGGER.info('Request: %s', wps_request.operation)
+    if wps_request.operation == 'getstatus':
+        response = service.get_status(wps_request.jobid, http_request.if_none_match,
+                                      wps_request.status_format, wps_request.status_wait,
+                                      http_request.headers.get('Last-Event-ID'))
+        if wps_request.status_format == 'events':
+            django_response = StreamingHttpResponse(response.response,
+                                                    content_type=response.content_type)
+            django_response['Cache-Control'] = 'no-cache'
+            return django_response
+
+        django_response = HttpResponse(response.get_data(), status=response.status_code,
+                                       content_type=response.content_type)
+        if 'ETag' in response.headers:
+            django_response['ETag'] = response.headers['ETag']
+        return django_response
+
     if wps_request.operation in ['getcapabilities',
                                  'describeprocess',
                                  'execute']:
         # log_request(request_uuid, wps_request)
         response = None
         if wps_request.operation == 'getcapabilities':
-            response = service.get_capabilities()
+            response = service.get_capabilities(http_request.if_none_match)
 
         elif wps_request.operation == 'describeprocess':
             response = service.describe(wps_request.identifiers)
@@ -86,7 +99,6 @@ def wps(request):
         raise RuntimeError("Unknown operation %r"
                            % wps_request.operation)
 
-    print response.get_data()
     # except HTTPException as e:
     #     # transform HTTPException to OWS NoApplicableCode exception
     #     if not isinstance(e, NoApplicableCode):
@@ -99,5 +111,9 @@ def wps(request):
     #     update_response(request_uuid, FakeResponse, close=True)
     #     return e
 
-    return HttpResponse(response.get_data(), content_type='application/xhtml+xml')
+    django_response = HttpResponse(response.get_data(), status=response.status_code,
+                                   content_type='application/xhtml+xml')
+    if 'ETag' in response.headers:
+        django_response['ETag'] = response.headers['ETag']
+    return django_response
     #
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Process-wide registry of the PyWPS Service published by this app
+
+The Service and its processes are built once, when the app is loaded, and
+reused by every request to the ``wps`` controller. Call
+:func:`reload_service` to rebuild them after a process module changed.
+"""
+
+import importlib
+import logging
+import os
+import sys
+import threading
+
+from pywps.app.Service import Service
+
+LOGGER = logging.getLogger('PYWPS')
+
+# (module, class) of every process published by the app
+PROCESSES = [
+    ('processes.feature_count', 'FeatureCount'),
+    ('processes.sayhello', 'SayHello'),
+    ('processes.centroids', 'Centroids'),
+    ('processes.ultimate_question', 'UltimateQuestion'),
+    ('processes.sleep', 'Sleep'),
+    ('processes.buffer', 'Buffer'),
+    ('processes.area', 'Area'),
+    ('processes.bboxinout', 'Box')
+]
+
+_SERVICE = None
+_MTIMES = {}
+_LOCK = threading.Lock()
+
+
+def get_service():
+    """Return the shared Service, build it on first use
+    """
+
+    global _SERVICE
+
+    if _SERVICE is None:
+        with _LOCK:
+            if _SERVICE is None:
+                _SERVICE = _build_service(reload_modules=False)
+
+    return _SERVICE
+
+
+def reload_service(force=False):
+    """Rebuild the shared Service if any of the process modules changed
+
+    :param force: rebuild even if no process module changed on disk
+    :returns: the shared Service
+    """
+
+    global _SERVICE
+
+    with _LOCK:
+        if _SERVICE is None:
+            _SERVICE = _build_service(reload_modules=False)
+        elif force or _modules_changed():
+            LOGGER.info('Reloading process modules')
+            # the worker pool and the background threads of the old Service
+            # are stopped first, if the modules fail to load, the next call
+            # builds the Service again
+            (service, _SERVICE) = (_SERVICE, None)
+            service.stop_workers()
+            _SERVICE = _build_service(reload_modules=True)
+
+    return _SERVICE
+
+
+def _build_service(reload_modules):
+    """Import (or re-import) process modules and create new Service
+    """
+
+    processes = []
+    for (module_name, class_name) in PROCESSES:
+        module = importlib.import_module(module_name)
+        if reload_modules:
+            module = _reload(module)
+        _MTIMES[module_name] = _get_mtime(module)
+        processes.append(getattr(module, class_name)())
+
+    LOGGER.debug('Service created with %i processes', len(processes))
+    service = Service(processes=processes)
+    # the worker pool is forked here, at app load, not from a request
+    # thread, Execute requests do not start it
+    service.start_workers()
+    return service
+
+
+def _modules_changed():
+    """Check process module sources for modification since last build
+    """
+
+    for (module_name, _) in PROCESSES:
+        module = sys.modules.get(module_name)
+        if module is None or _get_mtime(module) != _MTIMES.get(module_name):
+            return True
+
+    return False
+
+
+def _get_mtime(module):
+    """Return modification time of the module source file
+    """
+
+    file_name = getattr(module, '__file__', None)
+    if not file_name:
+        return None
+
+    if file_name.endswith(('.pyc', '.pyo')):
+        file_name = file_name[:-1]
+
+    try:
+        return os.stat(file_name).st_mtime
+    except OSError:
+        return None
+
+
+def _reload(module):
+    try:
+        from importlib import reload
+    except ImportError:
+        from imp import reload
+    return reload(module)